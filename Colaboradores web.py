@@ -1,15 +1,39 @@
 import streamlit as st
 import pandas as pd
 import dropbox
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 from io import BytesIO
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from zipfile import ZipFile
+from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from copy import copy
 import calendar
 import time
 import json
+import hashlib
+import random
+import os
+import uuid
+import tempfile
+
+from processamento_salarial.database.workbook_bundle import WorkbookBundle
+from processamento_salarial.database.sqlite_store import ArmazemSQLite, PADRAO_ABA_MENSAL, chave_linha, localizar_linha
+from processamento_salarial.database.sidecar_arrow import SidecarArrow
+from processamento_salarial.database import snapshot_delta
+from processamento_salarial.database.cliente_dropbox import ClienteDropboxResiliente
+from processamento_salarial.calculations.processamento_lote import processar_calculo_lote, COLUNAS_MONETARIAS
+from processamento_salarial.calculations.resultados_incrementais import ResultadosIncrementais
+from processamento_salarial.calculations.dinheiro import em_euros
+from processamento_salarial.calculations.simulacao import (
+    AlteracaoSalarial, TIPOS_ALTERACAO, CAMPOS_GRUPO, CENARIO_ATUAL, simular_cenarios, resumo_cenarios
+)
+from processamento_salarial.calculations.projecao import projetar_salarios, COLUNAS_PROJECAO
+from processamento_salarial.calculations.tabela_irs import compilar_tabela_irs
+from processamento_salarial.calculations.calendario import CalendarioUteis
+from processamento_salarial.calculations.feriados import feriados_ano, feriados_nacionais, data_feriado_municipal
+from processamento_salarial.database.armazenamento import (
+    ArmazenamentoDropbox, ArmazenamentoLocal, ConflitoRevisao, ConteudoDivergente, FicheiroNaoEncontrado
+)
 
 st.set_page_config(
     page_title="Processamento Salarial v3.5.1",
@@ -19,25 +43,28 @@ st.set_page_config(
 
 # ==================== CONFIGURAÇÕES ====================
 
-DROPBOX_APP_KEY = st.secrets["DROPBOX_APP_KEY"]
-DROPBOX_APP_SECRET = st.secrets["DROPBOX_APP_SECRET"]
-DROPBOX_REFRESH_TOKEN = st.secrets["DROPBOX_REFRESH_TOKEN"]
+# "dropbox" (produção) ou "local" (pasta no disco, sem rede - para testes e medições)
+ARMAZENAMENTO = st.secrets.get("ARMAZENAMENTO", "dropbox")
 ADMIN_PASSWORD = st.secrets.get("ADMIN_PASSWORD", "adminpedro")
 
-dbx = dropbox.Dropbox(
-    app_key=DROPBOX_APP_KEY,
-    app_secret=DROPBOX_APP_SECRET,
-    oauth2_refresh_token=DROPBOX_REFRESH_TOKEN
-)
+# Dados locais por content_hash da Dropbox: base SQLite indexada e sidecars Arrow de cada aba
+USAR_SQLITE = st.secrets.get("USAR_SQLITE", True)
+PASTA_DADOS_LOCAIS = st.secrets.get("PASTA_DADOS_LOCAIS", os.path.join(tempfile.gettempdir(), "processamento_salarial"))
+
+# Uploads acima do limiar vão por sessão de upload, em blocos (bytes)
+LIMIAR_UPLOAD_SESSAO = st.secrets.get("LIMIAR_UPLOAD_SESSAO", 8 * 1024 * 1024)
+TAMANHO_BLOCO_UPLOAD = st.secrets.get("TAMANHO_BLOCO_UPLOAD", 4 * 1024 * 1024)
 
 EMPRESAS = {
     "Magnetic Sky Lda": {
         "path": "/Pedro Couto/Projectos/Alcalá_Arc_Amoreira/Gestão operacional/RH/Processamento Salários Magnetic/Gestão Colaboradores Magnetic.xlsx",
-        "pasta_baixas": "/Pedro Couto/Projectos/Alcalá_Arc_Amoreira/Gestão operacional/RH/Baixas Médicas"
+        "pasta_baixas": "/Pedro Couto/Projectos/Alcalá_Arc_Amoreira/Gestão operacional/RH/Baixas Médicas",
+        "feriados_municipais": [(1, 14)]
     },
     "CCM Retail Lda": {
         "path": "/Pedro Couto/Projectos/Pingo Doce/Pingo Doce/2. Operação/1. Recursos Humanos/Processamento salarial/Gestão Colaboradores.xlsx",
-        "pasta_baixas": "/Pedro Couto/Projectos/Pingo Doce/Pingo Doce/2. Operação/1. Recursos Humanos/Baixas Médicas"
+        "pasta_baixas": "/Pedro Couto/Projectos/Pingo Doce/Pingo Doce/2. Operação/1. Recursos Humanos/Baixas Médicas",
+        "feriados_municipais": [(1, 14)]
     }
 }
 
@@ -56,13 +83,6 @@ CATEGORIAS_PROFISSIONAIS = {
     ]
 }
 
-FERIADOS_NACIONAIS_2025 = [
-    date(2025, 1, 1), date(2025, 4, 18), date(2025, 4, 20), date(2025, 4, 25),
-    date(2025, 5, 1), date(2025, 6, 10), date(2025, 6, 19), date(2025, 8, 15),
-    date(2025, 10, 5), date(2025, 11, 1), date(2025, 12, 1), date(2025, 12, 8),
-    date(2025, 12, 25)
-]
-
 MOTIVOS_RESCISAO = [
     "Denúncia pela entidade patronal - período experimental",
     "Denúncia pelo trabalhador - período experimental",
@@ -106,6 +126,110 @@ COLUNAS_HORAS_EXTRAS = [
     "Horas Feriados", "Horas Extra", "Outros Proveitos", "Observações", "Timestamp"
 ]
 
+# Processamento do mês (aba Processamento_YYYY_MM): coluna do cálculo -> cabeçalho na aba
+ROTULOS_PROCESSAMENTO = {
+    'dias_faltas': "Faltas (dias úteis)",
+    'dias_baixas': "Baixas (dias úteis)",
+    'dias_uteis_trabalhados': "Dias Úteis Trabalhados",
+    'vencimento_ajustado': "Vencimento Ajustado",
+    'sub_alimentacao': "Sub. Alimentação",
+    'trabalho_noturno': "Trabalho Noturno",
+    'domingos': "Domingos",
+    'feriados': "Feriados",
+    'sub_ferias': "Sub. Férias",
+    'sub_natal': "Sub. Natal",
+    'banco_horas_valor': "Horas Extra",
+    'outros_proveitos': "Outros Proveitos",
+    'total_remuneracoes': "Total Remunerações",
+    'seg_social': "Segurança Social",
+    'irs': "IRS",
+    'desconto_especie': "Cartão Refeição",
+    'total_descontos': "Total Descontos",
+    'liquido': "Líquido"
+}
+
+COLUNAS_PROCESSAMENTO = (
+    ["Nome Completo", "Ano", "Mês", "Secção", "Categoria Profissional"] +
+    list(ROTULOS_PROCESSAMENTO.values()) + ["Timestamp"]
+)
+
+COLUNAS_VALORES_PROCESSAMENTO = [
+    rotulo for chave, rotulo in ROTULOS_PROCESSAMENTO.items()
+    if chave not in ('dias_faltas', 'dias_baixas', 'dias_uteis_trabalhados')
+]
+
+# Campos numéricos obrigatórios no cálculo em lote: chave do dados_form -> coluna da aba Colaboradores
+CAMPOS_OBRIGATORIOS_LOTE = {
+    'salario_bruto': 'Salário Bruto',
+    'horas_semana': 'Nº Horas/Semana',
+    'subsidio_alimentacao': 'Subsídio Alimentação Diário'
+}
+
+# Conflitos de revisão no upload: nº de tentativas e espera base (segundos, exponencial com jitter)
+MAX_TENTATIVAS_UPLOAD = 4
+ESPERA_BASE_CONFLITO = 0.5
+
+# Fila de alterações: gravar automaticamente após X segundos sem novas alterações
+TEMPO_GRAVACAO_AUTOMATICA = 60
+INTERVALO_VERIFICACAO_PENDENTES = 15
+
+# A fila fica também na base local: alterações de uma sessão sem atividade há X segundos são retomadas por outra
+TEMPO_ABANDONO_PENDENTES = 300
+
+# Correções de offset seguidas aceites por bloco numa sessão de upload (as falhas de rede repete-as o cliente Dropbox)
+MAX_TENTATIVAS_BLOCO = 5
+
+# Snapshots: acima de X linhas substituídas (snapshots antigos) na aba Estado_ fica só a última por colaborador
+# (as outras vão para Historico_)
+LIMITE_LINHAS_SNAPSHOT = 200
+GUARDAR_HISTORICO_SNAPSHOTS = True
+
+# Formato dos snapshots: "completo" (abas Estado_, uma linha inteira por gravação) ou
+# "delta" (abas Delta_, só os campos alterados, com um checkpoint completo a cada X linhas)
+FORMATO_SNAPSHOT = st.secrets.get("FORMATO_SNAPSHOT", "completo")
+INTERVALO_CHECKPOINT_SNAPSHOT = 12
+
+# Chamadas à Dropbox: tentativas em limites de pedidos/falhas transitórias e ligações HTTP em paralelo
+MAX_TENTATIVAS_DROPBOX = 5
+ESPERA_MAXIMA_DROPBOX = 30.0
+MAX_LIGACOES_DROPBOX = 8
+
+# Metadados (revisão) do Excel na Dropbox: reaproveitados durante X segundos em vez de pedidos a cada leitura
+TTL_METADADOS_EXCEL = 5.0
+
+@st.cache_resource
+def obter_cliente_dropbox():
+    """Cliente Dropbox do processo: uma só sessão HTTP (pool de ligações) e estatísticas partilhadas"""
+    dbx = dropbox.Dropbox(
+        app_key=st.secrets["DROPBOX_APP_KEY"],
+        app_secret=st.secrets["DROPBOX_APP_SECRET"],
+        oauth2_refresh_token=st.secrets["DROPBOX_REFRESH_TOKEN"],
+        session=dropbox.create_session(max_connections=MAX_LIGACOES_DROPBOX),
+        # As repetições ficam todas no ClienteDropboxResiliente
+        max_retries_on_error=0,
+        max_retries_on_rate_limit=0
+    )
+    return ClienteDropboxResiliente(
+        dbx,
+        max_tentativas=MAX_TENTATIVAS_DROPBOX,
+        espera_base=ESPERA_BASE_CONFLITO,
+        espera_maxima=ESPERA_MAXIMA_DROPBOX
+    )
+
+# Armazenamento dos ficheiros (Excel e baixas): Dropbox ou pasta local
+if ARMAZENAMENTO == "local":
+    armazenamento = ArmazenamentoLocal(
+        st.secrets.get("PASTA_ARMAZENAMENTO_LOCAL", os.path.join(PASTA_DADOS_LOCAIS, "armazenamento")),
+        latencia=st.secrets.get("LATENCIA_ARMAZENAMENTO_LOCAL", 0.0)
+    )
+else:
+    armazenamento = ArmazenamentoDropbox(
+        obter_cliente_dropbox(),
+        limiar_sessao=LIMIAR_UPLOAD_SESSAO,
+        tamanho_bloco=TAMANHO_BLOCO_UPLOAD,
+        max_tentativas_bloco=MAX_TENTATIVAS_BLOCO
+    )
+
 ESTADOS_CIVIS = ["Solteiro", "Casado Único Titular", "Casado Dois Titulares"]
 HORAS_PERMITIDAS = [16, 20, 40]
 
@@ -171,13 +295,16 @@ if 'authenticated' not in st.session_state:
 if 'salario_minimo' not in st.session_state:
     st.session_state.salario_minimo = 870.0
 if 'feriados_municipais' not in st.session_state:
-    st.session_state.feriados_municipais = [date(2025, 1, 14)]
+    # Regras por empresa: (mês, dia) ou desvio em dias da Páscoa; repetem-se todos os anos
+    st.session_state.feriados_municipais = {
+        nome: list(cfg.get("feriados_municipais", [])) for nome, cfg in EMPRESAS.items()
+    }
 if 'ultimo_reload' not in st.session_state:
     st.session_state.ultimo_reload = datetime.now()
 if 'tabela_irs' not in st.session_state:
     st.session_state.tabela_irs = None
-if 'dados_processamento' not in st.session_state:
-    st.session_state.dados_processamento = {}
+if 'resultados_salariais' not in st.session_state:
+    st.session_state.resultados_salariais = ResultadosIncrementais()
 if 'empresa_selecionada' not in st.session_state:
     st.session_state.empresa_selecionada = list(EMPRESAS.keys())[0]
 if 'mes_selecionado' not in st.session_state:
@@ -192,6 +319,20 @@ if 'password_incorrect' not in st.session_state:
     st.session_state.password_incorrect = False
 if 'campos_selecionados_output' not in st.session_state:
     st.session_state.campos_selecionados_output = []
+if 'cache_excel' not in st.session_state:
+    st.session_state.cache_excel = {}
+if 'metadados_excel' not in st.session_state:
+    st.session_state.metadados_excel = {}
+if 'alteracoes_pendentes' not in st.session_state:
+    st.session_state.alteracoes_pendentes = {}
+if 'ultima_alteracao' not in st.session_state:
+    st.session_state.ultima_alteracao = {}
+if 'id_sessao' not in st.session_state:
+    st.session_state.id_sessao = uuid.uuid4().hex
+if 'sessoes_upload' not in st.session_state:
+    st.session_state.sessoes_upload = {}
+if 'envios_interrompidos' not in st.session_state:
+    st.session_state.envios_interrompidos = {}
 
 # ==================== FUNÇÕES DE AUTENTICAÇÃO ====================
 
@@ -268,24 +409,78 @@ def normalizar_tipo_subsidio(valor):
 def get_nome_aba_snapshot(ano, mes):
     return f"Estado_{ano}_{mes:02d}"
 
+def get_nome_aba_historico_snapshot(ano, mes):
+    return f"Historico_{ano}_{mes:02d}"
+
+def get_nome_aba_delta_snapshot(ano, mes):
+    return f"Delta_{ano}_{mes:02d}"
+
 def get_nome_aba_faltas_baixas(ano, mes):
     return f"Faltas_Baixas_{ano}_{mes:02d}"
 
 def get_nome_aba_horas_extras(ano, mes):
     return f"Extras_{ano}_{mes:02d}"
 
-def criar_pasta_dropbox(path):
-    """Cria pasta na Dropbox se não existir"""
-    try:
-        dbx.files_get_metadata(path)
-        return True
-    except:
+def get_nome_aba_processamento(ano, mes):
+    return f"Processamento_{ano}_{mes:02d}"
+
+@st.cache_resource
+def obter_cache_pastas():
+    """Pastas conhecidas na Dropbox por empresa (partilhado por todas as sessões do processo)"""
+    return {}
+
+def carregar_pastas_empresa(empresa):
+    """Conjunto (em minúsculas) das pastas de baixas da empresa - listado uma vez, recursivamente"""
+    cache = obter_cache_pastas()
+    if empresa not in cache:
         try:
-            dbx.files_create_folder_v2(path)
+            cache[empresa] = armazenamento.listar_pastas(EMPRESAS[empresa]["pasta_baixas"], recursivo=True)
+        except FicheiroNaoEncontrado:
+            # Pasta base ainda não existe: fica tudo por criar
+            cache[empresa] = set()
+    return cache[empresa]
+
+def garantir_pastas_dropbox(empresa, pastas):
+    """Cria numa só chamada as pastas que ainda não existem"""
+    try:
+        conhecidas = carregar_pastas_empresa(empresa)
+        em_falta = [p for p in pastas if p.lower() not in conhecidas]
+        if not em_falta:
             return True
-        except Exception as e:
-            st.error(f"Erro ao criar pasta: {e}")
-            return False
+        
+        # As pastas intermédias são criadas automaticamente: basta pedir as mais profundas
+        folhas = [p for p in em_falta if not any(o.lower().startswith(p.lower() + "/") for o in em_falta)]
+        armazenamento.criar_pastas(folhas)
+        
+        conhecidas.update(p.lower() for p in em_falta)
+        return True
+    
+    except Exception as e:
+        obter_cache_pastas().pop(empresa, None)
+        st.error(f"Erro ao criar pasta: {e}")
+        return False
+
+def enviar_ficheiro(caminho, conteudo, rev=None, novo=False, descricao="ficheiro"):
+    """Envia o conteúdo, mostrando o progresso dos uploads longos (feitos em blocos)
+    
+    O estado das sessões de upload fica em st.session_state: se o envio falhar a
+    meio, a próxima tentativa com o mesmo conteúdo continua do último bloco aceite.
+    """
+    barra = []
+    
+    def progresso(enviados, total):
+        if enviados >= total and not barra:
+            return
+        if not barra:
+            barra.append(st.progress(0.0))
+        barra[0].progress(enviados / total, text=f"📤 A enviar {descricao} ({enviados:,} de {total:,} bytes)...")
+    
+    try:
+        return armazenamento.enviar(caminho, conteudo, rev=rev, novo=novo, progresso=progresso,
+                                    sessoes=st.session_state.sessoes_upload)
+    finally:
+        if barra:
+            barra[0].empty()
 
 def upload_ficheiro_baixa(empresa, ano, mes, colaborador, file):
     """Upload de ficheiro de baixa médica para Dropbox"""
@@ -294,9 +489,7 @@ def upload_ficheiro_baixa(empresa, ano, mes, colaborador, file):
         pasta_ano = f"{pasta_base}/{ano}"
         pasta_mes = f"{pasta_ano}/{mes:02d}_{calendar.month_name[mes]}"
         
-        criar_pasta_dropbox(pasta_base)
-        criar_pasta_dropbox(pasta_ano)
-        criar_pasta_dropbox(pasta_mes)
+        garantir_pastas_dropbox(empresa, [pasta_base, pasta_ano, pasta_mes])
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         nome_limpo = colaborador.replace(" ", "_")
@@ -306,7 +499,7 @@ def upload_ficheiro_baixa(empresa, ano, mes, colaborador, file):
         caminho_completo = f"{pasta_mes}/{nome_ficheiro}"
         
         file.seek(0)
-        dbx.files_upload(file.read(), caminho_completo, mode=dropbox.files.WriteMode.overwrite)
+        enviar_ficheiro(caminho_completo, file.read(), descricao=nome_ficheiro)
         
         return caminho_completo
         
@@ -314,15 +507,148 @@ def upload_ficheiro_baixa(empresa, ano, mes, colaborador, file):
         st.error(f"❌ Erro ao fazer upload: {e}")
         return None
 
-def download_excel(empresa):
+def caminho_excel(empresa, ano=None):
+    """Excel principal (Colaboradores + ano corrente) ou arquivo de um ano anterior"""
+    caminho = EMPRESAS[empresa]["path"]
+    if ano is None:
+        return caminho
+    base, extensao = os.path.splitext(caminho)
+    return f"{base} {ano}{extensao}"
+
+def chave_excel(empresa, ano=None):
+    return empresa if ano is None else f"{empresa} {ano}"
+
+def ano_da_aba(nome_aba):
+    correspondencia = PADRAO_ABA_MENSAL.match(nome_aba)
+    return int(correspondencia.group(2)) if correspondencia else None
+
+def ano_arquivo_aba(empresa, nome_aba):
+    """Ano do arquivo onde está a aba, ou None se estiver no Excel principal
+    
+    Abas de anos anteriores só passam para o arquivo anual quando ele existe;
+    até lá continuam no principal.
+    """
+    ano = ano_da_aba(nome_aba)
+    if ano is None or ano >= date.today().year:
+        return None
+    return ano if obter_cache_excel(empresa, ano) else None
+
+def obter_metadados_excel(empresa, ano=None):
+    """Metadados do Excel na Dropbox (None se não existir), pedidos no máximo uma vez a cada TTL_METADADOS_EXCEL segundos"""
+    chave = chave_excel(empresa, ano)
+    guardados = st.session_state.metadados_excel.get(chave)
+    if guardados and time.monotonic() - guardados[0] < TTL_METADADOS_EXCEL:
+        return guardados[1]
+    
+    try:
+        metadata = armazenamento.obter_metadados(caminho_excel(empresa, ano))
+    except FicheiroNaoEncontrado:
+        metadata = None
+    st.session_state.metadados_excel[chave] = (time.monotonic(), metadata)
+    return metadata
+
+def esquecer_metadados_excel(empresa, ano=None):
+    """Obriga a pedir de novo a revisão do Excel (depois de um conflito ou de um upload divergente)"""
+    st.session_state.metadados_excel.pop(chave_excel(empresa, ano), None)
+
+def guardar_cache_excel(empresa, metadata, conteudo=None, ano=None):
+    """Guarda a revisão Dropbox do Excel (o conteúdo só é transferido quando for preciso)"""
+    st.session_state.metadados_excel[chave_excel(empresa, ano)] = (time.monotonic(), metadata)
+    st.session_state.cache_excel[chave_excel(empresa, ano)] = {
+        'caminho': caminho_excel(empresa, ano),
+        'rev': metadata.rev,
+        'content_hash': metadata.content_hash,
+        'conteudo': conteudo,
+        'bundle': None
+    }
+
+def obter_cache_excel(empresa, ano=None):
+    """Devolve a entrada de cache do Excel - verifica apenas a revisão atual na Dropbox
+    
+    Para um arquivo anual que ainda não existe devolve None, sem erro.
+    """
+    chave = chave_excel(empresa, ano)
     try:
-        file_path = EMPRESAS[empresa]["path"]
-        _, response = dbx.files_download(file_path)
-        return BytesIO(response.content)
+        metadata = obter_metadados_excel(empresa, ano)
+        if metadata is None:
+            st.session_state.cache_excel.pop(chave, None)
+            if ano is None:
+                st.error(f"❌ Excel não encontrado: {caminho_excel(empresa)}")
+            return None
+        
+        cache = st.session_state.cache_excel.get(chave)
+        if cache and cache['content_hash'] == metadata.content_hash:
+            cache['rev'] = metadata.rev
+            return cache
+        
+        guardar_cache_excel(empresa, metadata, ano=ano)
+        return st.session_state.cache_excel[chave]
     except Exception as e:
         st.error(f"❌ Erro ao baixar Excel: {e}")
         return None
 
+def obter_conteudo_excel(empresa, cache):
+    """Transfere o Excel da revisão em cache, se ainda não tiver sido transferido"""
+    if cache['conteudo'] is None:
+        _, cache['conteudo'] = armazenamento.descarregar(cache['caminho'], rev=cache['rev'])
+    return cache['conteudo']
+
+def obter_armazem(empresa, ano=None):
+    return ArmazemSQLite(os.path.join(PASTA_DADOS_LOCAIS, f"{chave_excel(empresa, ano)}.sqlite"))
+
+def abrir_workbook_bundle(empresa, cache, ano=None):
+    """WorkbookBundle da revisão em cache, lido dos sidecars Arrow sempre que possível"""
+    sidecar = SidecarArrow(os.path.join(PASTA_DADOS_LOCAIS, "sidecar", chave_excel(empresa, ano)), cache['content_hash'])
+    return WorkbookBundle(lambda: obter_conteudo_excel(empresa, cache), sidecar)
+
+def carregar_bundle(empresa, ano=None):
+    """Devolve os dados da revisão atual - interpretados uma única vez por revisão.
+    
+    Com USAR_SQLITE a leitura é feita na base local (importada só quando o
+    content_hash do Excel muda); caso contrário, num WorkbookBundle em memória.
+    Em ambos os casos o XLSX só é interpretado se não houver sidecar Arrow da revisão.
+    Com `ano`, lê o arquivo desse ano em vez do Excel principal.
+    """
+    cache = obter_cache_excel(empresa, ano)
+    if not cache:
+        return None
+    
+    if cache['bundle'] is None:
+        if USAR_SQLITE:
+            try:
+                armazem = obter_armazem(empresa, ano)
+                if armazem.content_hash != cache['content_hash']:
+                    armazem.importar(abrir_workbook_bundle(empresa, cache, ano), cache['content_hash'])
+                cache['bundle'] = armazem
+            except Exception as e:
+                st.warning(f"⚠️ Base local indisponível, a ler do Excel: {e}")
+        
+        if cache['bundle'] is None:
+            try:
+                cache['bundle'] = abrir_workbook_bundle(empresa, cache, ano)
+            except Exception as e:
+                st.error(f"❌ Erro ao ler Excel: {e}")
+                return None
+    
+    return cache['bundle']
+
+def sincronizar_armazem(empresa, hash_base, alteracoes, ano=None):
+    """Depois de um upload, aplica as alterações à base local (linha a linha) em vez de a reimportar"""
+    if not USAR_SQLITE:
+        return
+    
+    try:
+        armazem = obter_armazem(empresa, ano)
+        if armazem.content_hash != hash_base:
+            return
+        
+        for alteracao in alteracoes:
+            armazem.aplicar_alteracao(alteracao)
+        
+        armazem.marcar_sincronizado(st.session_state.cache_excel[chave_excel(empresa, ano)]['content_hash'])
+    except Exception as e:
+        st.warning(f"⚠️ Base local será reimportada: {e}")
+
 def garantir_aba(wb, nome_aba, colunas):
     """Garante que a aba existe, criando-a se necessário"""
     if nome_aba not in wb.sheetnames:
@@ -338,9 +664,15 @@ def garantir_aba(wb, nome_aba, colunas):
         return True
     return False
 
-def validar_workbook(wb):
-    """Valida integridade do workbook"""
+def validar_workbook(wb, ano=None):
+    """Valida integridade do workbook (os arquivos anuais não têm aba 'Colaboradores')"""
     try:
+        if ano is not None:
+            if not wb.sheetnames:
+                st.error(f"🚨 CRÍTICO: Arquivo {ano} sem abas!")
+                return False
+            return True
+        
         if "Colaboradores" not in wb.sheetnames:
             st.error("🚨 CRÍTICO: Aba 'Colaboradores' não encontrada!")
             return False
@@ -359,16 +691,29 @@ def validar_workbook(wb):
         st.error(f"🚨 Erro ao validar workbook: {e}")
         return False
 
-def upload_excel_seguro(empresa, wb):
-    """Upload com validação robusta - v3.5.1 SEM BACKUP"""
+def assinatura_xlsx(conteudo):
+    """Hash das partes do XLSX exceto docProps/core.xml (data de gravação): igual para o mesmo workbook gravado duas vezes"""
+    resumo = hashlib.sha256()
+    with ZipFile(BytesIO(conteudo)) as arquivo:
+        for nome in sorted(arquivo.namelist()):
+            if nome != "docProps/core.xml":
+                resumo.update(nome.encode())
+                resumo.update(arquivo.read(nome))
+    return resumo.hexdigest()
+
+def upload_excel_seguro(empresa, wb, rev, ano=None):
+    """Upload com validação robusta - só grava se a Dropbox ainda estiver na revisão `rev`
+    
+    Com `ano`, grava o arquivo desse ano; `rev=None` cria-o (falha se já existir).
+    """
     try:
         # VALIDAÇÃO PRÉ-UPLOAD
-        if not validar_workbook(wb):
+        if not validar_workbook(wb, ano):
             st.error("❌ Validação falhou - upload cancelado!")
             return False
         
         # PREPARAR UPLOAD
-        file_path = EMPRESAS[empresa]["path"]
+        file_path = caminho_excel(empresa, ano)
         output = BytesIO()
         
         # SALVAR com tratamento de erro
@@ -386,23 +731,486 @@ def upload_excel_seguro(empresa, wb):
             st.error(f"❌ Ficheiro muito pequeno ({file_size} bytes) - upload cancelado!")
             return False
         
-        # UPLOAD
-        dbx.files_upload(output.read(), file_path, mode=dropbox.files.WriteMode.overwrite)
+        # UPLOAD (falha com conflito se outro utilizador gravou entretanto, ou se o content_hash devolvido não bater certo)
+        conteudo = output.read()
         
-        # VERIFICAR upload
-        time.sleep(0.3)
+        # Nova tentativa do mesmo envio (mesmo workbook sobre a mesma revisão): reenvia os bytes da tentativa
+        # interrompida, para a sessão de upload continuar do último bloco aceite
+        assinatura = assinatura_xlsx(conteudo)
+        interrompido = st.session_state.envios_interrompidos.pop(file_path, None)
+        if interrompido and interrompido['rev'] == rev and interrompido['assinatura'] == assinatura:
+            conteudo = interrompido['conteudo']
         
-        ws_colab = wb["Colaboradores"]
-        st.success(f"✅ Excel salvo ({ws_colab.max_row-1} colaboradores, {file_size:,} bytes)")
+        try:
+            metadata = enviar_ficheiro(file_path, conteudo, rev=rev, novo=rev is None,
+                                       descricao=f"Excel {chave_excel(empresa, ano)}")
+        except (ConflitoRevisao, ConteudoDivergente):
+            raise
+        except Exception:
+            st.session_state.envios_interrompidos[file_path] = {'rev': rev, 'assinatura': assinatura, 'conteudo': conteudo}
+            raise
+        guardar_cache_excel(empresa, metadata, conteudo, ano)
+        
+        if ano is None:
+            ws_colab = wb["Colaboradores"]
+            st.success(f"✅ Excel salvo ({ws_colab.max_row-1} colaboradores, {file_size:,} bytes)")
+        else:
+            st.success(f"✅ Arquivo {ano} salvo ({len(wb.sheetnames)} abas, {file_size:,} bytes)")
         
         return True
         
+    except ConflitoRevisao:
+        esquecer_metadados_excel(empresa, ano)
+        raise
+    except ConteudoDivergente as e:
+        # O Excel na Dropbox não é o que foi enviado: forçar novo download na próxima leitura
+        esquecer_metadados_excel(empresa, ano)
+        st.session_state.cache_excel.pop(chave_excel(empresa, ano), None)
+        st.error(f"🚨 CRÍTICO: Excel gravado na Dropbox não corresponde ao enviado - verifique o ficheiro! {e}")
+        return False
     except Exception as e:
         st.error(f"❌ Erro ao enviar Excel: {e}")
         import traceback
         st.error(f"🔍 Detalhes: {traceback.format_exc()}")
         return False
 
+# ==================== ALTERAÇÕES PENDENTES ====================
+
+def registar_alteracao(empresa, alteracao):
+    """Junta uma alteração à fila da empresa - só é enviada para a Dropbox no próximo flush"""
+    alteracao.setdefault('id', uuid.uuid4().hex)
+    fila = st.session_state.alteracoes_pendentes.setdefault(empresa, [])
+    fila.append(alteracao)
+    st.session_state.ultima_alteracao[empresa] = time.time()
+    persistir_alteracoes_pendentes(empresa)
+    invalidar_resultados(empresa, alteracao)
+
+def persistir_alteracoes_pendentes(empresa):
+    """Guarda a fila da empresa na base local (não se perde se o separador fechar antes do flush)"""
+    fila = st.session_state.alteracoes_pendentes.get(empresa, [])
+    adotadas = obter_armazem(empresa).guardar_pendentes(st.session_state.id_sessao, fila)
+    if adotadas:
+        st.session_state.alteracoes_pendentes[empresa] = [a for a in fila if a['id'] not in adotadas]
+
+def retomar_alteracoes_pendentes():
+    """Junta à fila as alterações guardadas por sessões que terminaram sem as enviar; renova as desta sessão"""
+    for empresa in EMPRESAS:
+        retomadas = obter_armazem(empresa).adotar_pendentes(st.session_state.id_sessao,
+                                                           time.time() - TEMPO_ABANDONO_PENDENTES)
+        if retomadas:
+            st.session_state.alteracoes_pendentes.setdefault(empresa, []).extend(retomadas)
+            st.session_state.ultima_alteracao[empresa] = 0
+            for alteracao in retomadas:
+                invalidar_resultados(empresa, alteracao)
+            st.info(f"♻️ {len(retomadas)} alterações por gravar de uma sessão anterior retomadas ({empresa})")
+        elif contar_alteracoes_pendentes(empresa) > 0:
+            persistir_alteracoes_pendentes(empresa)
+
+def invalidar_resultados(empresa, alteracao):
+    """Marca como sujos só os resultados salariais que dependem da aba/colaborador alterados"""
+    colaborador = alteracao.get('nome')
+    if colaborador is None and alteracao['tipo'] == 'adicionar_linha':
+        colaborador = alteracao['linha'][alteracao['colunas'].index("Nome Completo")]
+    
+    if alteracao['aba'] == 'Colaboradores':
+        st.session_state.resultados_salariais.marcar_sujo(empresa, colaborador=colaborador)
+        return
+    
+    correspondencia = PADRAO_ABA_MENSAL.match(alteracao['aba'])
+    if correspondencia and correspondencia.group(1) in ('Faltas_Baixas', 'Extras'):
+        ano, mes = int(correspondencia.group(2)), int(correspondencia.group(3))
+        st.session_state.resultados_salariais.marcar_sujo(empresa, ano, mes, colaborador)
+
+def contar_alteracoes_pendentes(empresa=None):
+    if empresa:
+        return len(st.session_state.alteracoes_pendentes.get(empresa, []))
+    return sum(len(fila) for fila in st.session_state.alteracoes_pendentes.values())
+
+def atualizar_celulas_colaborador(ws, nome, campos):
+    """Escreve só as células alteradas nas linhas do colaborador (colunas novas vão para o fim)"""
+    cabecalho = {}
+    for idx_coluna, celula in enumerate(next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ()), start=1):
+        if celula is not None:
+            cabecalho.setdefault(celula, idx_coluna)
+    
+    if 'Nome Completo' not in cabecalho:
+        raise ValueError("Coluna 'Nome Completo' não encontrada")
+    
+    col_nome = cabecalho['Nome Completo']
+    linhas = [
+        idx_linha
+        for idx_linha, (valor,) in enumerate(
+            ws.iter_rows(min_row=2, min_col=col_nome, max_col=col_nome, values_only=True), start=2
+        )
+        if valor == nome
+    ]
+    if not linhas:
+        raise ValueError(f"Colaborador '{nome}' não encontrado")
+    
+    for coluna, valor in campos.items():
+        if coluna not in cabecalho:
+            cabecalho[coluna] = ws.max_column + 1
+            ws.cell(row=1, column=cabecalho[coluna], value=coluna)
+        for idx_linha in linhas:
+            ws.cell(row=idx_linha, column=cabecalho[coluna], value=valor)
+
+def compactar_aba_snapshots(wb, nome_aba, aba_historico=None):
+    """Deixa na aba só a última linha de cada colaborador; as outras passam para `aba_historico` (se indicada)"""
+    if nome_aba not in wb.sheetnames:
+        return
+    
+    ws = wb[nome_aba]
+    linhas = list(ws.iter_rows(values_only=True))
+    if len(linhas) < 2:
+        return
+    
+    cabecalho = list(linhas[0])
+    if 'Nome Completo' not in cabecalho:
+        raise ValueError("Coluna 'Nome Completo' não encontrada")
+    
+    idx_nome = cabecalho.index('Nome Completo')
+    ultima = {linha[idx_nome]: i for i, linha in enumerate(linhas[1:])}
+    manter = set(ultima.values())
+    if len(manter) == len(linhas) - 1:
+        return
+    
+    if aba_historico:
+        garantir_aba(wb, aba_historico, cabecalho)
+        for i, linha in enumerate(linhas[1:]):
+            if i not in manter:
+                wb[aba_historico].append(linha)
+    
+    # Reescrever só as linhas de dados de uma vez (apagar linha a linha seria quadrático)
+    ws.delete_rows(2, ws.max_row - 1)
+    for i, linha in enumerate(linhas[1:]):
+        if i in manter:
+            ws.append(linha)
+
+def aplicar_alteracao(wb, alteracao):
+    """Aplica uma alteração da fila ao workbook (lança ValueError se não for aplicável)"""
+    nome_aba = alteracao['aba']
+    
+    if alteracao['tipo'] == 'adicionar_linha':
+        garantir_aba(wb, nome_aba, alteracao['colunas'])
+        wb[nome_aba].append(alteracao['linha'])
+    
+    elif alteracao['tipo'] == 'atualizar_colaborador':
+        atualizar_celulas_colaborador(wb[nome_aba], alteracao['nome'], alteracao['campos'])
+    
+    elif alteracao['tipo'] == 'eliminar_linha':
+        if nome_aba not in wb.sheetnames:
+            raise ValueError(f"Aba '{nome_aba}' não encontrada")
+        
+        # A linha é procurada pelos valores: outra sessão pode ter acrescentado ou apagado linhas entretanto
+        ws = wb[nome_aba]
+        cabecalho = [celula.value for celula in ws[1]]
+        posicao = localizar_linha(cabecalho, list(ws.iter_rows(min_row=2, values_only=True)),
+                                  alteracao['chave'], alteracao['linha_idx'])
+        if posicao is None:
+            raise ValueError(f"Registo de '{alteracao['nome']}' já não existe em '{nome_aba}'")
+        
+        ws.delete_rows(posicao + 2)
+    
+    elif alteracao['tipo'] == 'compactar_snapshots':
+        compactar_aba_snapshots(wb, nome_aba, alteracao.get('aba_historico'))
+    
+    elif alteracao['tipo'] == 'substituir_aba':
+        # Aba recriada no mesmo sítio, só com as linhas indicadas
+        posicao = None
+        if nome_aba in wb.sheetnames:
+            posicao = wb.sheetnames.index(nome_aba)
+            wb.remove(wb[nome_aba])
+        garantir_aba(wb, nome_aba, alteracao['colunas'])
+        if posicao is not None:
+            wb.move_sheet(nome_aba, offset=posicao - wb.sheetnames.index(nome_aba))
+        for linha in alteracao['linhas']:
+            wb[nome_aba].append(linha)
+    
+    else:
+        raise ValueError(f"Tipo de alteração desconhecido: {alteracao['tipo']}")
+
+def aplicar_alteracoes_pendentes_df(empresa, nome_aba, df):
+    """Reflete no DataFrame da aba as alterações ainda por gravar (mesma ordem do flush)"""
+    for alteracao in st.session_state.alteracoes_pendentes.get(empresa, []):
+        if alteracao['aba'] != nome_aba:
+            continue
+        
+        if alteracao['tipo'] == 'adicionar_linha':
+            nova = pd.DataFrame([alteracao['linha']], columns=alteracao['colunas'])
+            df = nova if df.empty else pd.concat([df, nova], ignore_index=True)
+        elif alteracao['tipo'] == 'eliminar_linha':
+            posicao = localizar_linha(df.columns, df.itertuples(index=False), alteracao['chave'], alteracao['linha_idx'])
+            if posicao is not None:
+                df = df.drop(index=df.index[posicao]).reset_index(drop=True)
+        elif alteracao['tipo'] == 'compactar_snapshots':
+            if not df.empty:
+                df = df[~df['Nome Completo'].duplicated(keep='last')].reset_index(drop=True)
+        elif alteracao['tipo'] == 'substituir_aba':
+            df = pd.DataFrame(alteracao['linhas'], columns=alteracao['colunas'])
+    
+    return df
+
+def carregar_aba_com_pendentes(empresa, nome_aba, colunas, colaborador=None):
+    """Lê uma aba mensal já com as alterações pendentes aplicadas (do Excel principal ou do arquivo do ano)"""
+    bundle = carregar_bundle(empresa, ano_arquivo_aba(empresa, nome_aba))
+    if not bundle:
+        return pd.DataFrame()
+    
+    tem_pendentes = any(a['aba'] == nome_aba for a in st.session_state.alteracoes_pendentes.get(empresa, []))
+    
+    if not bundle.tem_aba(nome_aba):
+        df = pd.DataFrame(columns=colunas)
+    elif tem_pendentes:
+        df = bundle.ler_aba(nome_aba)
+    else:
+        return bundle.ler_aba(nome_aba, colaborador)
+    
+    df = aplicar_alteracoes_pendentes_df(empresa, nome_aba, df)
+    
+    if colaborador is not None:
+        df = df[df['Nome Completo'] == colaborador]
+    
+    return df
+
+def carregar_ultimo_registo(empresa, nome_aba, colunas, colaborador):
+    """Última linha do colaborador numa aba mensal - sem pendentes, vai direta ao índice da última linha"""
+    tem_pendentes = any(a['aba'] == nome_aba for a in st.session_state.alteracoes_pendentes.get(empresa, []))
+    if not tem_pendentes:
+        bundle = carregar_bundle(empresa, ano_arquivo_aba(empresa, nome_aba))
+        if not bundle or not bundle.tem_aba(nome_aba):
+            return pd.DataFrame(columns=colunas)
+        return bundle.ultimo_registo(nome_aba, colaborador)
+    
+    return carregar_aba_com_pendentes(empresa, nome_aba, colunas, colaborador).tail(1)
+
+def gravar_alteracoes(empresa, alteracoes, ano=None):
+    """Aplica as alterações sobre a revisão atual e faz upload condicionado a essa revisão.
+    
+    Se outro utilizador gravou entretanto, volta a descarregar o Excel, reaplica as
+    alterações (são operações ao nível da linha) e tenta de novo com backoff.
+    Com `ano`, as alterações são gravadas no arquivo desse ano.
+    """
+    for tentativa in range(MAX_TENTATIVAS_UPLOAD):
+        cache = obter_cache_excel(empresa, ano)
+        if not cache:
+            return False
+        
+        try:
+            wb = load_workbook(BytesIO(obter_conteudo_excel(empresa, cache)), data_only=False)
+        except Exception as e:
+            st.error(f"❌ Erro ao baixar Excel: {e}")
+            return False
+        
+        if not validar_workbook(wb, ano):
+            st.error("❌ Validação inicial falhou")
+            return False
+        
+        abas_criadas = []
+        aplicadas = []
+        for alteracao in alteracoes:
+            aba_nova = alteracao['aba'] not in wb.sheetnames
+            try:
+                aplicar_alteracao(wb, alteracao)
+                aplicadas.append(alteracao)
+                if aba_nova and alteracao['aba'] not in abas_criadas:
+                    abas_criadas.append(alteracao['aba'])
+            except ValueError as e:
+                st.warning(f"⚠️ Alteração ignorada ({alteracao.get('descricao', alteracao['tipo'])}): {e}")
+        
+        if not aplicadas:
+            return False
+        
+        if not validar_workbook(wb, ano):
+            st.error("❌ Validação pós-modificação falhou")
+            return False
+        
+        try:
+            if not upload_excel_seguro(empresa, wb, cache['rev'], ano):
+                return False
+        except ConflitoRevisao:
+            espera = ESPERA_BASE_CONFLITO * (2 ** tentativa) * (1 + random.random())
+            st.info(f"🔄 Excel alterado por outro utilizador - a reaplicar alterações ({tentativa + 1}/{MAX_TENTATIVAS_UPLOAD})")
+            time.sleep(espera)
+            continue
+        
+        sincronizar_armazem(empresa, cache['content_hash'], aplicadas, ano)
+        
+        for nome_aba in abas_criadas:
+            st.success(f"✨ Aba '{nome_aba}' foi criada")
+        return True
+    
+    st.error("❌ Não foi possível gravar: o Excel continua a ser alterado por outro utilizador. Tente novamente.")
+    return False
+
+def copiar_abas_para_arquivo(empresa, ano, wb_origem, abas):
+    """Copia as abas para o arquivo do ano (criando-o se preciso)
+    
+    Uma aba que já está no arquivo (copiada numa execução anterior que não
+    chegou a retirá-la do principal) só recebe as linhas do principal que lá
+    faltam, pela chave Nome Completo + Timestamp: entretanto outra sessão pode
+    ter acrescentado registos à aba no principal, que se perderiam ao retirá-la.
+    """
+    for tentativa in range(MAX_TENTATIVAS_UPLOAD):
+        cache = obter_cache_excel(empresa, ano)
+        if cache:
+            wb = load_workbook(BytesIO(obter_conteudo_excel(empresa, cache)), data_only=False)
+        else:
+            wb = Workbook()
+            wb.remove(wb.active)
+        
+        alterado = False
+        for nome_aba in abas:
+            linhas = [l for l in wb_origem[nome_aba].iter_rows(values_only=True) if any(v is not None for v in l)]
+            if not linhas:
+                continue
+            
+            colunas = list(linhas[0])
+            if garantir_aba(wb, nome_aba, colunas):
+                for linha in linhas[1:]:
+                    wb[nome_aba].append(linha)
+                alterado = True
+                continue
+            
+            ws = wb[nome_aba]
+            colunas_arquivo = [c.value for c in ws[1]]
+            arquivadas = {tuple(chave_linha(colunas_arquivo, l)) for l in ws.iter_rows(min_row=2, values_only=True)}
+            for linha in linhas[1:]:
+                if tuple(chave_linha(colunas, linha)) not in arquivadas:
+                    ws.append([linha[colunas.index(c)] if c in colunas else None for c in colunas_arquivo])
+                    alterado = True
+        
+        if not alterado:
+            return True
+        
+        try:
+            if not upload_excel_seguro(empresa, wb, cache['rev'] if cache else None, ano):
+                return False
+            return True
+        except ConflitoRevisao:
+            time.sleep(ESPERA_BASE_CONFLITO * (2 ** tentativa) * (1 + random.random()))
+    
+    st.error(f"❌ Não foi possível gravar o arquivo {ano}")
+    return False
+
+def arquivar_anos_anteriores(empresa):
+    """Passa as abas mensais de anos anteriores do Excel principal para os arquivos anuais"""
+    ano_atual = date.today().year
+    
+    for tentativa in range(MAX_TENTATIVAS_UPLOAD):
+        cache = obter_cache_excel(empresa)
+        if not cache:
+            return False
+        
+        wb = load_workbook(BytesIO(obter_conteudo_excel(empresa, cache)), data_only=False)
+        abas_por_ano = {}
+        for nome_aba in wb.sheetnames:
+            ano = ano_da_aba(nome_aba)
+            if ano is not None and ano < ano_atual:
+                abas_por_ano.setdefault(ano, []).append(nome_aba)
+        
+        if not abas_por_ano:
+            return True
+        
+        # Primeiro os arquivos, só depois se retiram as abas do principal
+        for ano, abas in sorted(abas_por_ano.items()):
+            if not copiar_abas_para_arquivo(empresa, ano, wb, abas):
+                return False
+        
+        for abas in abas_por_ano.values():
+            for nome_aba in abas:
+                del wb[nome_aba]
+        
+        try:
+            if not upload_excel_seguro(empresa, wb, cache['rev']):
+                return False
+        except ConflitoRevisao:
+            time.sleep(ESPERA_BASE_CONFLITO * (2 ** tentativa) * (1 + random.random()))
+            continue
+        
+        st.success(f"📦 Anos arquivados ({empresa}): {', '.join(str(a) for a in sorted(abas_por_ano))}")
+        return True
+    
+    return False
+
+def tem_anos_por_arquivar(empresa):
+    bundle = carregar_bundle(empresa)
+    ano_atual = date.today().year
+    return bool(bundle) and any((ano_da_aba(a) or ano_atual) < ano_atual for a in bundle.abas)
+
+def gravar_alteracoes_pendentes(empresa):
+    """Grava a fila da empresa: por ficheiro (principal e arquivos anuais), um download e um upload"""
+    fila = list(st.session_state.alteracoes_pendentes.get(empresa, []))
+    if not fila:
+        return True
+    
+    try:
+        por_ficheiro = {}
+        for alteracao in fila:
+            por_ficheiro.setdefault(ano_arquivo_aba(empresa, alteracao['aba']), []).append(alteracao)
+        
+        gravadas = []
+        for ano, alteracoes in por_ficheiro.items():
+            if gravar_alteracoes(empresa, alteracoes, ano):
+                gravadas.extend(alteracoes)
+        
+        if gravadas:
+            ids_gravadas = {id(a) for a in gravadas}
+            st.session_state.alteracoes_pendentes[empresa] = [
+                a for a in st.session_state.alteracoes_pendentes[empresa] if id(a) not in ids_gravadas
+            ]
+            persistir_alteracoes_pendentes(empresa)
+            st.success(f"✅ {len(gravadas)} alterações gravadas ({empresa})")
+        
+        if len(gravadas) < len(fila):
+            return False
+        
+        if tem_anos_por_arquivar(empresa):
+            arquivar_anos_anteriores(empresa)
+        return True
+        
+    except Exception as e:
+        st.error(f"❌ Erro ao gravar alterações pendentes: {e}")
+        import traceback
+        st.error(f"🔍 Detalhes: {traceback.format_exc()}")
+        return False
+
+def gravar_todas_alteracoes_pendentes():
+    sucesso = True
+    for empresa in list(st.session_state.alteracoes_pendentes.keys()):
+        if contar_alteracoes_pendentes(empresa) > 0:
+            sucesso = gravar_alteracoes_pendentes(empresa) and sucesso
+    return sucesso
+
+@st.fragment(run_every=INTERVALO_VERIFICACAO_PENDENTES)
+def mostrar_alteracoes_pendentes():
+    """Indicador de alterações pendentes - grava automaticamente após inatividade"""
+    retomar_alteracoes_pendentes()
+    total = contar_alteracoes_pendentes()
+    if total == 0:
+        return
+    
+    agora = time.time()
+    gravou = False
+    for empresa in list(st.session_state.alteracoes_pendentes.keys()):
+        if contar_alteracoes_pendentes(empresa) == 0:
+            continue
+        if agora - st.session_state.ultima_alteracao.get(empresa, agora) >= TEMPO_GRAVACAO_AUTOMATICA:
+            with st.spinner(f"A gravar alterações de {empresa}..."):
+                gravou = gravar_alteracoes_pendentes(empresa) or gravou
+    
+    if gravou:
+        st.rerun()
+    
+    st.warning(f"⏳ {total} alterações pendentes - ainda não gravadas na Dropbox")
+    for empresa, fila in st.session_state.alteracoes_pendentes.items():
+        if fila:
+            st.caption(f"{empresa}: {len(fila)}")
+    
+    if st.button("💾 Gravar agora", use_container_width=True, key="gravar_pendentes"):
+        with st.spinner("A gravar..."):
+            if gravar_todas_alteracoes_pendentes():
+                st.rerun()
+
 # ==================== FUNÇÕES DE CÁLCULO ====================
 
 def calcular_vencimento_hora(salario_bruto, horas_semana):
@@ -410,10 +1218,19 @@ def calcular_vencimento_hora(salario_bruto, horas_semana):
         return 0
     return (salario_bruto * 12) / (52 * horas_semana)
 
-def calcular_vencimento_ajustado(salario_bruto, dias_faltas, dias_baixas):
-    dias_pagos = 30 - dias_faltas - dias_baixas
-    dias_pagos = max(dias_pagos, 0)
-    return (salario_bruto / 30) * dias_pagos
+@st.cache_resource
+def obter_calendario_uteis(ano_inicio, ano_fim, feriados):
+    """Calendário de dias úteis dos anos indicados (partilhado por todas as sessões do processo)"""
+    return CalendarioUteis(date(ano_inicio, 1, 1), date(ano_fim, 12, 31), feriados)
+
+def calendario_uteis(ano_inicio, ano_fim, feriados_list):
+    return obter_calendario_uteis(ano_inicio, ano_fim, tuple(sorted(set(feriados_list))))
+
+def feriados_empresa(empresa, ano_inicio, ano_fim=None):
+    """Feriados nacionais e municipais da empresa entre os anos indicados (cada ano vem do lru_cache de feriados_ano)"""
+    regras = tuple(st.session_state.feriados_municipais.get(empresa, []))
+    anos = range(ano_inicio, (ano_fim or ano_inicio) + 1)
+    return frozenset().union(*(feriados_ano(ano, regras) for ano in anos))
 
 def calcular_dias_entre_datas(data_inicio, data_fim, feriados_list):
     """Calcula dias úteis e totais entre duas datas"""
@@ -421,72 +1238,45 @@ def calcular_dias_entre_datas(data_inicio, data_fim, feriados_list):
         return 0, 0
     
     dias_totais = (data_fim - data_inicio).days + 1
-    dias_uteis = 0
-    
-    data_atual = data_inicio
-    while data_atual <= data_fim:
-        if data_atual.weekday() < 5 and data_atual not in feriados_list:
-            dias_uteis += 1
-        data_atual += timedelta(days=1)
+    dias_uteis = calendario_uteis(data_inicio.year, data_fim.year, feriados_list).contar(data_inicio, data_fim)
     
     return dias_uteis, dias_totais
 
 def calcular_dias_uteis(ano, mes, feriados_list):
-    num_dias = calendar.monthrange(ano, mes)[1]
-    dias_uteis = 0
-    for dia in range(1, num_dias + 1):
-        data = date(ano, mes, dia)
-        if data.weekday() < 5 and data not in feriados_list:
-            dias_uteis += 1
-    return dias_uteis
+    return calendario_uteis(ano, ano, feriados_list).contar_mes(ano, mes)
+
+@st.cache_resource
+def obter_cache_tabelas_irs():
+    """Tabelas IRS já compiladas, por hash do ficheiro (partilhado por todas as sessões do processo)"""
+    return {}
 
 def carregar_tabela_irs_excel(uploaded_file):
+    """Compila as tabelas de retenção do Excel (uma vez por ficheiro) e passa a usá-las no cálculo"""
     try:
-        xls = pd.ExcelFile(uploaded_file)
-        st.success(f"✅ Ficheiro carregado! Abas: {', '.join(xls.sheet_names)}")
-        st.session_state.tabela_irs = xls
-        return xls
+        conteudo = uploaded_file.getvalue()
+        chave = hashlib.sha256(conteudo).hexdigest()
+        cache = obter_cache_tabelas_irs()
+        if chave not in cache:
+            cache[chave] = compilar_tabela_irs(conteudo)
+        tabela = cache[chave]
+        
+        st.success(f"✅ Tabela carregada! {len(tabela.tabelas)} tabelas de retenção, {len(tabela.situacoes)} situações cobertas")
+        for aba, motivo in tabela.ignoradas.items():
+            st.caption(f"ℹ️ Aba '{aba}' ignorada: {motivo}")
+        st.session_state.tabela_irs = tabela
+        return tabela
     except Exception as e:
         st.error(f"❌ Erro ao carregar tabela: {e}")
         return None
 
-def calcular_irs_por_tabela(base_incidencia, estado_civil, num_dependentes, tem_deficiencia=False):
-    reducao_dependentes = num_dependentes * 0.01
-    
-    if base_incidencia <= 820:
-        taxa = 0.135
-    elif base_incidencia <= 1200:
-        taxa = 0.18
-    elif base_incidencia <= 1700:
-        taxa = 0.23
-    elif base_incidencia <= 2500:
-        taxa = 0.265
-    else:
-        taxa = 0.32
-    
-    taxa_final = max(taxa - reducao_dependentes, 0.05)
-    
-    if estado_civil == "Casado Único Titular":
-        taxa_final *= 0.85
-    
-    return base_incidencia * taxa_final
-
-def calcular_irs(base_incidencia, modo_calculo, percentagem_fixa, estado_civil, num_dependentes, tem_deficiencia=False):
-    if modo_calculo == "Fixa":
-        taxa = percentagem_fixa / 100
-        irs = base_incidencia * taxa
-        return irs
-    else:
-        return calcular_irs_por_tabela(base_incidencia, estado_civil, num_dependentes, tem_deficiencia)
-
 # ==================== FUNÇÕES DE DADOS BASE ====================
 
 def carregar_dados_base(empresa):
     """Lê sempre da aba 'Colaboradores'"""
-    excel_file = download_excel(empresa)
-    if excel_file:
+    bundle = carregar_bundle(empresa)
+    if bundle:
         try:
-            df = pd.read_excel(excel_file, sheet_name="Colaboradores")
+            df = bundle.colaboradores
             
             # v3.5.1: Garantir colunas essenciais ATUALIZADAS
             colunas_essenciais = {
@@ -538,41 +1328,53 @@ def carregar_colaboradores_ativos(empresa, ano=None, mes=None):
     
     return colaboradores
 
+def texto_campo(valor):
+    """Valor de um campo como texto para comparação (vazio/NaN -> '', datas em AAAA-MM-DD)"""
+    if valor is None or (isinstance(valor, str) and valor in ('', 'nan')) or (not isinstance(valor, str) and pd.isna(valor)):
+        return ''
+    if isinstance(valor, (datetime, date)):
+        return pd.Timestamp(valor).strftime("%Y-%m-%d")
+    return str(valor)
+
+def campos_alterados(campos, originais):
+    """Só os campos do formulário cujo valor difere do carregado (os restantes não são reescritos)"""
+    alterados = {}
+    for coluna, valor in campos.items():
+        original = originais.get(coluna)
+        if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            numero = pd.to_numeric(original, errors='coerce')
+            igual = not pd.isna(numero) and round(float(numero), 2) == round(float(valor), 2)
+        else:
+            igual = texto_campo(original) == texto_campo(valor)
+        if not igual:
+            alterados[coluna] = valor
+    return alterados
+
+def atualizar_colaborador(empresa, colaborador, campos):
+    """Atualiza campos de um colaborador na aba Colaboradores (com reaplicação em caso de conflito)"""
+    df_base = carregar_dados_base(empresa)
+    
+    if df_base.empty or not (df_base['Nome Completo'] == colaborador).any():
+        st.error(f"❌ Colaborador '{colaborador}' não encontrado")
+        return False
+    
+    alteracao = {
+        'tipo': 'atualizar_colaborador',
+        'aba': 'Colaboradores',
+        'nome': colaborador,
+        'campos': campos,
+        'descricao': f"Colaborador {colaborador}"
+    }
+    if not gravar_alteracoes(empresa, [alteracao]):
+        return False
+    
+    invalidar_resultados(empresa, alteracao)
+    return True
+
 def atualizar_status_colaborador(empresa, colaborador, novo_status):
     """Atualiza Status APENAS na aba Colaboradores"""
     try:
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            return False
-        
-        df = pd.read_excel(excel_file, sheet_name="Colaboradores")
-        
-        if 'Status' not in df.columns:
-            df['Status'] = 'Ativo'
-        
-        mask = df['Nome Completo'] == colaborador
-        if mask.any():
-            df.loc[mask, 'Status'] = novo_status
-        else:
-            st.error(f"❌ Colaborador '{colaborador}' não encontrado")
-            return False
-        
-        wb = load_workbook(excel_file, data_only=False)
-        
-        if not validar_workbook(wb):
-            return False
-        
-        if "Colaboradores" in wb.sheetnames:
-            idx = wb.sheetnames.index("Colaboradores")
-            del wb["Colaboradores"]
-            ws = wb.create_sheet("Colaboradores", idx)
-        else:
-            ws = wb.create_sheet("Colaboradores", 0)
-        
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws.append(r)
-        
-        if upload_excel_seguro(empresa, wb):
+        if atualizar_colaborador(empresa, colaborador, {'Status': novo_status}):
             st.success(f"✅ Status de '{colaborador}' → '{novo_status}'")
             return True
         
@@ -653,71 +1455,102 @@ def criar_snapshot_inicial(empresa, colaborador, ano, mes):
     
     return snapshot
 
+def reconstruir_snapshot(empresa, colaborador, ano, mes):
+    """Snapshot completo do colaborador no fim de (ano, mes), a partir das abas Delta_
+    
+    Recua mês a mês até encontrar um checkpoint e aplica os deltas seguintes.
+    Normalmente o checkpoint está no próprio ano; se não estiver, continua pelos
+    anos anteriores enquanto houver registos (histórico completo).
+    Devolve (snapshot, nº de deltas desde o checkpoint) ou (None, 0).
+    """
+    blocos = []
+    ano_registo, mes_registo, ano_com_registos = ano, mes, False
+    while True:
+        df = carregar_aba_com_pendentes(empresa, get_nome_aba_delta_snapshot(ano_registo, mes_registo),
+                                        snapshot_delta.COLUNAS_DELTA, colaborador)
+        if not df.empty:
+            blocos.append(df)
+            ano_com_registos = True
+            if (df['Tipo Registo'] == snapshot_delta.TIPO_CHECKPOINT).any():
+                break
+        
+        if mes_registo > 1:
+            mes_registo -= 1
+        elif ano_com_registos:
+            ano_registo, mes_registo, ano_com_registos = ano_registo - 1, 12, False
+        else:
+            break
+    
+    registos = [registo for df in reversed(blocos) for registo in df.to_dict('records')]
+    snapshot, deltas = snapshot_delta.reconstruir(registos)
+    if snapshot is not None:
+        snapshot['Ano'] = ano
+        snapshot['Mês'] = mes
+    return snapshot, deltas
+
 def carregar_ultimo_snapshot(empresa, colaborador, ano, mes):
     """Carrega último snapshot com dados ATUALIZADOS - v3.5.1"""
-    excel_file = download_excel(empresa)
-    if not excel_file:
+    bundle = carregar_bundle(empresa)
+    if not bundle:
         return None
     
     try:
-        wb = load_workbook(excel_file, data_only=False)
-        nome_aba = get_nome_aba_snapshot(ano, mes)
-        
-        if nome_aba in wb.sheetnames:
-            df = pd.read_excel(excel_file, sheet_name=nome_aba)
-            df_colab = df[df['Nome Completo'] == colaborador]
+        if FORMATO_SNAPSHOT == "delta":
+            snapshot, _ = reconstruir_snapshot(empresa, colaborador, ano, mes)
+        else:
+            df = carregar_ultimo_registo(empresa, get_nome_aba_snapshot(ano, mes), COLUNAS_SNAPSHOT, colaborador)
+            df_colab = df[df['Nome Completo'] == colaborador] if not df.empty else df
+            snapshot = df_colab.iloc[-1].to_dict() if not df_colab.empty else None
+        
+        if snapshot is not None:
+            # Atualizar com dados mais recentes da aba Colaboradores
+            df_base = carregar_dados_base(empresa)
+            dados_colab = df_base[df_base['Nome Completo'] == colaborador]
             
-            if not df_colab.empty:
-                snapshot = df_colab.iloc[-1].to_dict()
+            if not dados_colab.empty:
+                dados = dados_colab.iloc[0]
                 
-                # Atualizar com dados mais recentes da aba Colaboradores
-                df_base = carregar_dados_base(empresa)
-                dados_colab = df_base[df_base['Nome Completo'] == colaborador]
+                # Campos dinâmicos
+                snapshot['Nº Horas/Semana'] = float(dados.get('Nº Horas/Semana', snapshot.get('Nº Horas/Semana', 40)))
+                snapshot['Subsídio Alimentação Diário'] = float(dados.get('Subsídio Alimentação Diário', snapshot.get('Subsídio Alimentação Diário', 5.96)))
+                snapshot['Número Pingo Doce'] = str(dados.get('Número Pingo Doce', snapshot.get('Número Pingo Doce', '')))
+                snapshot['Salário Bruto'] = float(dados.get('Salário Bruto', snapshot.get('Salário Bruto', 870.0)))
                 
-                if not dados_colab.empty:
-                    dados = dados_colab.iloc[0]
-                    
-                    # Campos dinâmicos
-                    snapshot['Nº Horas/Semana'] = float(dados.get('Nº Horas/Semana', snapshot.get('Nº Horas/Semana', 40)))
-                    snapshot['Subsídio Alimentação Diário'] = float(dados.get('Subsídio Alimentação Diário', snapshot.get('Subsídio Alimentação Diário', 5.96)))
-                    snapshot['Número Pingo Doce'] = str(dados.get('Número Pingo Doce', snapshot.get('Número Pingo Doce', '')))
-                    snapshot['Salário Bruto'] = float(dados.get('Salário Bruto', snapshot.get('Salário Bruto', 870.0)))
-                    
-                    horas = float(snapshot['Nº Horas/Semana'])
-                    snapshot['Vencimento Hora'] = calcular_vencimento_hora(snapshot['Salário Bruto'], horas)
-                    
-                    snapshot['Cartão Refeição'] = normalizar_sim_nao(dados.get('Cartão Refeição', snapshot.get('Cartão Refeição', 'Não')))
-                    snapshot['Sub Férias Tipo'] = normalizar_tipo_subsidio(dados.get('Sub Férias Tipo', snapshot.get('Sub Férias Tipo', 'Duodécimos')))
-                    snapshot['Sub Natal Tipo'] = normalizar_tipo_subsidio(dados.get('Sub Natal Tipo', snapshot.get('Sub Natal Tipo', 'Duodécimos')))
-                    
-                    snapshot['Estado Civil'] = normalizar_estado_civil(dados.get('Estado Civil', snapshot.get('Estado Civil', 'Solteiro')))
-                    snapshot['Nº Titulares'] = int(dados.get('Nº Titulares', snapshot.get('Nº Titulares', 2)))
-                    snapshot['Nº Dependentes'] = int(dados.get('Nº Dependentes', snapshot.get('Nº Dependentes', 0)))
-                    snapshot['Deficiência'] = normalizar_deficiencia(dados.get('Pessoa com Deficiência', snapshot.get('Deficiência', 'Não')))
-                    snapshot['IRS Modo Calculo'] = normalizar_tipo_irs(dados.get('Tipo IRS', snapshot.get('IRS Modo Calculo', 'Tabela')))
-                    snapshot['IRS Percentagem Fixa'] = normalizar_percentagem_irs(dados.get('% IRS Fixa', snapshot.get('IRS Percentagem Fixa', 0)))
-                    snapshot['IBAN'] = str(dados.get('IBAN', snapshot.get('IBAN', '')))
-                    
-                    # v3.5.1: Campos atualizados
-                    snapshot['E-mail'] = str(dados.get('E-mail', snapshot.get('E-mail', '')))
-                    snapshot['Data de Nascimento'] = str(dados.get('Data de Nascimento', snapshot.get('Data de Nascimento', '')))
-                    snapshot['Documento de Identificação'] = str(dados.get('Documento de Identificação', snapshot.get('Documento de Identificação', '')))
-                    snapshot['Validade Documento'] = str(dados.get('Validade Documento', snapshot.get('Validade Documento', '')))
-                    snapshot['Nacionalidade'] = str(dados.get('Nacionalidade', snapshot.get('Nacionalidade', '')))
-                    snapshot['Telemóvel'] = str(dados.get('Telemóvel', snapshot.get('Telemóvel', '')))
-                    snapshot['Bairro Fiscal'] = str(dados.get('Bairro Fiscal', snapshot.get('Bairro Fiscal', '')))
-                    snapshot['Morada'] = str(dados.get('Morada', snapshot.get('Morada', '')))
-                    snapshot['Cod Postal'] = str(dados.get('Cod Postal', snapshot.get('Cod Postal', '')))
-                    snapshot['Categoria Profissional'] = str(dados.get('Categoria Profissional', snapshot.get('Categoria Profissional', '')))
-                    
-                    snapshot['Data Rescisão'] = str(dados.get('Data Rescisão', snapshot.get('Data Rescisão', '')))
-                    snapshot['Motivo Rescisão'] = str(dados.get('Motivo Rescisão', snapshot.get('Motivo Rescisão', '')))
+                horas = float(snapshot['Nº Horas/Semana'])
+                snapshot['Vencimento Hora'] = calcular_vencimento_hora(snapshot['Salário Bruto'], horas)
+                
+                snapshot['Cartão Refeição'] = normalizar_sim_nao(dados.get('Cartão Refeição', snapshot.get('Cartão Refeição', 'Não')))
+                snapshot['Sub Férias Tipo'] = normalizar_tipo_subsidio(dados.get('Sub Férias Tipo', snapshot.get('Sub Férias Tipo', 'Duodécimos')))
+                snapshot['Sub Natal Tipo'] = normalizar_tipo_subsidio(dados.get('Sub Natal Tipo', snapshot.get('Sub Natal Tipo', 'Duodécimos')))
+                
+                snapshot['Estado Civil'] = normalizar_estado_civil(dados.get('Estado Civil', snapshot.get('Estado Civil', 'Solteiro')))
+                snapshot['Nº Titulares'] = int(dados.get('Nº Titulares', snapshot.get('Nº Titulares', 2)))
+                snapshot['Nº Dependentes'] = int(dados.get('Nº Dependentes', snapshot.get('Nº Dependentes', 0)))
+                snapshot['Deficiência'] = normalizar_deficiencia(dados.get('Pessoa com Deficiência', snapshot.get('Deficiência', 'Não')))
+                snapshot['IRS Modo Calculo'] = normalizar_tipo_irs(dados.get('Tipo IRS', snapshot.get('IRS Modo Calculo', 'Tabela')))
+                snapshot['IRS Percentagem Fixa'] = normalizar_percentagem_irs(dados.get('% IRS Fixa', snapshot.get('IRS Percentagem Fixa', 0)))
+                snapshot['IBAN'] = str(dados.get('IBAN', snapshot.get('IBAN', '')))
                 
-                if 'Status' not in snapshot or pd.isna(snapshot['Status']) or snapshot['Status'] == '':
-                    snapshot['Status'] = 'Ativo'
+                # v3.5.1: Campos atualizados
+                snapshot['E-mail'] = str(dados.get('E-mail', snapshot.get('E-mail', '')))
+                snapshot['Data de Nascimento'] = str(dados.get('Data de Nascimento', snapshot.get('Data de Nascimento', '')))
+                snapshot['Documento de Identificação'] = str(dados.get('Documento de Identificação', snapshot.get('Documento de Identificação', '')))
+                snapshot['Validade Documento'] = str(dados.get('Validade Documento', snapshot.get('Validade Documento', '')))
+                snapshot['Nacionalidade'] = str(dados.get('Nacionalidade', snapshot.get('Nacionalidade', '')))
+                snapshot['Telemóvel'] = str(dados.get('Telemóvel', snapshot.get('Telemóvel', '')))
+                snapshot['Bairro Fiscal'] = str(dados.get('Bairro Fiscal', snapshot.get('Bairro Fiscal', '')))
+                snapshot['Morada'] = str(dados.get('Morada', snapshot.get('Morada', '')))
+                snapshot['Cod Postal'] = str(dados.get('Cod Postal', snapshot.get('Cod Postal', '')))
+                snapshot['Categoria Profissional'] = str(dados.get('Categoria Profissional', snapshot.get('Categoria Profissional', '')))
                 
-                st.caption(f"📸 Snapshot {ano}-{mes:02d}: {snapshot.get('Timestamp', 'N/A')}")
-                return snapshot
+                snapshot['Data Rescisão'] = str(dados.get('Data Rescisão', snapshot.get('Data Rescisão', '')))
+                snapshot['Motivo Rescisão'] = str(dados.get('Motivo Rescisão', snapshot.get('Motivo Rescisão', '')))
+            
+            if 'Status' not in snapshot or pd.isna(snapshot['Status']) or snapshot['Status'] == '':
+                snapshot['Status'] = 'Ativo'
+            
+            st.caption(f"📸 Snapshot {ano}-{mes:02d}: {snapshot.get('Timestamp', 'N/A')}")
+            return snapshot
         
         snapshot = criar_snapshot_inicial(empresa, colaborador, ano, mes)
         if snapshot:
@@ -736,21 +1569,21 @@ def gravar_snapshot(empresa, snapshot):
         
         ano = snapshot['Ano']
         mes = snapshot['Mês']
-        nome_aba = get_nome_aba_snapshot(ano, mes)
         
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            return False
-        
-        wb = load_workbook(excel_file, data_only=False)
-        
-        if not validar_workbook(wb):
-            return False
-        
-        aba_criada = garantir_aba(wb, nome_aba, COLUNAS_SNAPSHOT)
-        
-        ws = wb[nome_aba]
+        if FORMATO_SNAPSHOT == "delta":
+            anterior, deltas = reconstruir_snapshot(empresa, snapshot['Nome Completo'], ano, mes)
+            nome_aba = get_nome_aba_delta_snapshot(ano, mes)
+            registar_alteracao(empresa, {
+                'tipo': 'adicionar_linha',
+                'aba': nome_aba,
+                'colunas': snapshot_delta.COLUNAS_DELTA,
+                'linha': snapshot_delta.criar_linha(snapshot, anterior, deltas, INTERVALO_CHECKPOINT_SNAPSHOT),
+                'descricao': f"Snapshot {snapshot.get('Nome Completo', '')}"
+            })
+            st.success(f"✅ Snapshot registado ({contar_alteracoes_pendentes(empresa)} alterações pendentes)")
+            return True
         
+        nome_aba = get_nome_aba_snapshot(ano, mes)
         nova_linha = []
         for col in COLUNAS_SNAPSHOT:
             valor = snapshot.get(col, '')
@@ -759,18 +1592,24 @@ def gravar_snapshot(empresa, snapshot):
             else:
                 nova_linha.append(str(valor) if valor else '')
         
-        ws.append(nova_linha)
+        registar_alteracao(empresa, {
+            'tipo': 'adicionar_linha',
+            'aba': nome_aba,
+            'colunas': COLUNAS_SNAPSHOT,
+            'linha': nova_linha,
+            'descricao': f"Snapshot {snapshot.get('Nome Completo', '')}"
+        })
         
-        sucesso = upload_excel_seguro(empresa, wb)
+        # Conta só as linhas substituídas: depois de compactar fica uma por colaborador, e essas não contam
+        compactacao_pendente = any(a['tipo'] == 'compactar_snapshots' and a['aba'] == nome_aba
+                                   for a in st.session_state.alteracoes_pendentes.get(empresa, []))
+        if LIMITE_LINHAS_SNAPSHOT and not compactacao_pendente:
+            df_estado = carregar_aba_com_pendentes(empresa, nome_aba, COLUNAS_SNAPSHOT)
+            if len(df_estado) - df_estado['Nome Completo'].nunique() > LIMITE_LINHAS_SNAPSHOT:
+                compactar_snapshots(empresa, ano, mes)
         
-        if sucesso:
-            linha = ws.max_row
-            st.success(f"✅ Snapshot gravado (linha {linha})")
-            if aba_criada:
-                st.success(f"✨ Aba '{nome_aba}' foi criada")
-            return True
-        
-        return False
+        st.success(f"✅ Snapshot registado ({contar_alteracoes_pendentes(empresa)} alterações pendentes)")
+        return True
         
     except Exception as e:
         st.error(f"❌ Erro ao gravar: {e}")
@@ -778,31 +1617,23 @@ def gravar_snapshot(empresa, snapshot):
         st.error(f"🔍 Detalhes: {traceback.format_exc()}")
         return False
 
+def compactar_snapshots(empresa, ano, mes, guardar_historico=GUARDAR_HISTORICO_SNAPSHOTS):
+    """Junta à fila a compactação da aba Estado_ do mês (fica o snapshot mais recente de cada colaborador)"""
+    nome_aba = get_nome_aba_snapshot(ano, mes)
+    registar_alteracao(empresa, {
+        'tipo': 'compactar_snapshots',
+        'aba': nome_aba,
+        'aba_historico': get_nome_aba_historico_snapshot(ano, mes) if guardar_historico else None,
+        'descricao': f"Compactar {nome_aba}"
+    })
+    return True
+
 def gravar_falta_baixa(empresa, ano, mes, colaborador, tipo, data_inicio, data_fim, obs, ficheiro_path=None):
     """Grava registo de falta ou baixa - v3.5.1"""
     try:
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            st.error("❌ Erro ao baixar Excel")
-            return False
-        
-        wb = load_workbook(excel_file, data_only=False)
-        
-        if not validar_workbook(wb):
-            st.error("❌ Validação inicial falhou")
-            return False
-        
         nome_aba = get_nome_aba_faltas_baixas(ano, mes)
         
-        aba_foi_criada = garantir_aba(wb, nome_aba, COLUNAS_FALTAS_BAIXAS)
-        
-        if nome_aba not in wb.sheetnames:
-            st.error(f"❌ ERRO CRÍTICO: Falha ao criar aba '{nome_aba}'")
-            return False
-        
-        ws = wb[nome_aba]
-        
-        feriados = FERIADOS_NACIONAIS_2025 + st.session_state.feriados_municipais
+        feriados = feriados_empresa(empresa, data_inicio.year, data_fim.year)
         dias_uteis, dias_totais = calcular_dias_entre_datas(data_inicio, data_fim, feriados)
         
         nova_linha = [
@@ -819,19 +1650,16 @@ def gravar_falta_baixa(empresa, ano, mes, colaborador, tipo, data_inicio, data_f
             datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         ]
         
-        ws.append(nova_linha)
-        
-        if not validar_workbook(wb):
-            st.error("❌ Validação pós-modificação falhou")
-            return False
-        
-        if upload_excel_seguro(empresa, wb):
-            st.success(f"✅ {tipo} registada: {dias_uteis} dias úteis / {dias_totais} dias totais")
-            if aba_foi_criada:
-                st.success(f"✨ Aba '{nome_aba}' foi criada")
-            return True
+        registar_alteracao(empresa, {
+            'tipo': 'adicionar_linha',
+            'aba': nome_aba,
+            'colunas': COLUNAS_FALTAS_BAIXAS,
+            'linha': nova_linha,
+            'descricao': f"{tipo} {colaborador}"
+        })
         
-        return False
+        st.success(f"✅ {tipo} registada: {dias_uteis} dias úteis / {dias_totais} dias totais")
+        return True
         
     except Exception as e:
         st.error(f"❌ Erro ao gravar falta/baixa: {e}")
@@ -842,38 +1670,28 @@ def gravar_falta_baixa(empresa, ano, mes, colaborador, tipo, data_inicio, data_f
 def eliminar_registo_falta_baixa(empresa, ano, mes, linha_idx):
     """Elimina um registo específico de falta/baixa"""
     try:
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            return False
-        
-        wb = load_workbook(excel_file, data_only=False)
-        
-        if not validar_workbook(wb):
-            return False
-        
         nome_aba = get_nome_aba_faltas_baixas(ano, mes)
+        df = carregar_aba_com_pendentes(empresa, nome_aba, COLUNAS_FALTAS_BAIXAS)
         
-        if nome_aba not in wb.sheetnames:
+        if df.empty:
             st.error(f"❌ Aba '{nome_aba}' não encontrada!")
             return False
         
-        ws = wb[nome_aba]
-        linha_excel = linha_idx + 2
-        
-        if linha_excel > ws.max_row:
+        if linha_idx >= len(df):
             st.error("❌ Linha inválida!")
             return False
         
-        ws.delete_rows(linha_excel)
-        
-        if not validar_workbook(wb):
-            return False
-        
-        if upload_excel_seguro(empresa, wb):
-            st.success("✅ Registo eliminado!")
-            return True
+        registar_alteracao(empresa, {
+            'tipo': 'eliminar_linha',
+            'aba': nome_aba,
+            'linha_idx': linha_idx,
+            'nome': df.iloc[linha_idx]['Nome Completo'],
+            'chave': chave_linha(df.columns, df.iloc[linha_idx].tolist()),
+            'descricao': f"Eliminar linha {linha_idx + 2} de {nome_aba}"
+        })
         
-        return False
+        st.success("✅ Registo eliminado!")
+        return True
         
     except Exception as e:
         st.error(f"❌ Erro ao eliminar: {e}")
@@ -882,27 +1700,8 @@ def eliminar_registo_falta_baixa(empresa, ano, mes, linha_idx):
 def gravar_horas_extras(empresa, ano, mes, colaborador, h_noturnas, h_domingos, h_feriados, h_extra, outros_prov, obs):
     """Grava registo de horas extras - v3.5.1"""
     try:
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            st.error("❌ Erro ao baixar Excel")
-            return False
-        
-        wb = load_workbook(excel_file, data_only=False)
-        
-        if not validar_workbook(wb):
-            st.error("❌ Validação inicial falhou")
-            return False
-        
         nome_aba = get_nome_aba_horas_extras(ano, mes)
         
-        aba_foi_criada = garantir_aba(wb, nome_aba, COLUNAS_HORAS_EXTRAS)
-        
-        if nome_aba not in wb.sheetnames:
-            st.error(f"❌ ERRO CRÍTICO: Falha ao criar aba '{nome_aba}'")
-            return False
-        
-        ws = wb[nome_aba]
-        
         nova_linha = [
             colaborador,
             ano,
@@ -916,19 +1715,16 @@ def gravar_horas_extras(empresa, ano, mes, colaborador, h_noturnas, h_domingos,
             datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         ]
         
-        ws.append(nova_linha)
-        
-        if not validar_workbook(wb):
-            st.error("❌ Validação pós-modificação falhou")
-            return False
-        
-        if upload_excel_seguro(empresa, wb):
-            st.success(f"✅ Horas extras/proveitos registados")
-            if aba_foi_criada:
-                st.success(f"✨ Aba '{nome_aba}' foi criada")
-            return True
+        registar_alteracao(empresa, {
+            'tipo': 'adicionar_linha',
+            'aba': nome_aba,
+            'colunas': COLUNAS_HORAS_EXTRAS,
+            'linha': nova_linha,
+            'descricao': f"Extras {colaborador}"
+        })
         
-        return False
+        st.success(f"✅ Horas extras/proveitos registados")
+        return True
         
     except Exception as e:
         st.error(f"❌ Erro ao gravar horas extras: {e}")
@@ -939,38 +1735,28 @@ def gravar_horas_extras(empresa, ano, mes, colaborador, h_noturnas, h_domingos,
 def eliminar_registo_horas_extras(empresa, ano, mes, linha_idx):
     """Elimina um registo específico de horas extras"""
     try:
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            return False
-        
-        wb = load_workbook(excel_file, data_only=False)
-        
-        if not validar_workbook(wb):
-            return False
-        
         nome_aba = get_nome_aba_horas_extras(ano, mes)
+        df = carregar_aba_com_pendentes(empresa, nome_aba, COLUNAS_HORAS_EXTRAS)
         
-        if nome_aba not in wb.sheetnames:
+        if df.empty:
             st.error(f"❌ Aba '{nome_aba}' não encontrada!")
             return False
         
-        ws = wb[nome_aba]
-        linha_excel = linha_idx + 2
-        
-        if linha_excel > ws.max_row:
+        if linha_idx >= len(df):
             st.error("❌ Linha inválida!")
             return False
         
-        ws.delete_rows(linha_excel)
-        
-        if not validar_workbook(wb):
-            return False
-        
-        if upload_excel_seguro(empresa, wb):
-            st.success("✅ Registo eliminado!")
-            return True
+        registar_alteracao(empresa, {
+            'tipo': 'eliminar_linha',
+            'aba': nome_aba,
+            'linha_idx': linha_idx,
+            'nome': df.iloc[linha_idx]['Nome Completo'],
+            'chave': chave_linha(df.columns, df.iloc[linha_idx].tolist()),
+            'descricao': f"Eliminar linha {linha_idx + 2} de {nome_aba}"
+        })
         
-        return False
+        st.success("✅ Registo eliminado!")
+        return True
         
     except Exception as e:
         st.error(f"❌ Erro ao eliminar: {e}")
@@ -979,19 +1765,10 @@ def eliminar_registo_horas_extras(empresa, ano, mes, linha_idx):
 def carregar_faltas_baixas(empresa, ano, mes, colaborador=None):
     """Carrega faltas e baixas do mês"""
     try:
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            return pd.DataFrame()
-        
         nome_aba = get_nome_aba_faltas_baixas(ano, mes)
         
         try:
-            df = pd.read_excel(excel_file, sheet_name=nome_aba)
-            
-            if colaborador:
-                df = df[df['Nome Completo'] == colaborador]
-            
-            return df
+            return carregar_aba_com_pendentes(empresa, nome_aba, COLUNAS_FALTAS_BAIXAS, colaborador or None)
         except:
             return pd.DataFrame()
             
@@ -1002,19 +1779,10 @@ def carregar_faltas_baixas(empresa, ano, mes, colaborador=None):
 def carregar_horas_extras(empresa, ano, mes, colaborador=None):
     """Carrega horas extras do mês"""
     try:
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            return pd.DataFrame()
-        
         nome_aba = get_nome_aba_horas_extras(ano, mes)
         
         try:
-            df = pd.read_excel(excel_file, sheet_name=nome_aba)
-            
-            if colaborador:
-                df = df[df['Nome Completo'] == colaborador]
-            
-            return df
+            return carregar_aba_com_pendentes(empresa, nome_aba, COLUNAS_HORAS_EXTRAS, colaborador or None)
         except:
             return pd.DataFrame()
             
@@ -1025,39 +1793,16 @@ def carregar_horas_extras(empresa, ano, mes, colaborador=None):
 def registar_rescisao_colaborador(empresa, colaborador, data_rescisao, motivo, obs):
     """Registra rescisão na aba Colaboradores"""
     try:
-        excel_file = download_excel(empresa)
-        if not excel_file:
-            return False
-        
-        df = pd.read_excel(excel_file, sheet_name="Colaboradores")
-        
-        mask = df['Nome Completo'] == colaborador
-        if mask.any():
-            df.loc[mask, 'Data Rescisão'] = data_rescisao.strftime("%Y-%m-%d")
-            obs_completa = f"{motivo}"
-            if obs:
-                obs_completa += f" | Obs: {obs}"
-            df.loc[mask, 'Motivo Rescisão'] = obs_completa
-        else:
-            st.error(f"❌ Colaborador '{colaborador}' não encontrado")
-            return False
-        
-        wb = load_workbook(excel_file, data_only=False)
+        obs_completa = f"{motivo}"
+        if obs:
+            obs_completa += f" | Obs: {obs}"
         
-        if not validar_workbook(wb):
-            return False
-        
-        if "Colaboradores" in wb.sheetnames:
-            idx = wb.sheetnames.index("Colaboradores")
-            del wb["Colaboradores"]
-            ws = wb.create_sheet("Colaboradores", idx)
-        else:
-            ws = wb.create_sheet("Colaboradores", 0)
-        
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws.append(r)
+        campos = {
+            'Data Rescisão': data_rescisao.strftime("%Y-%m-%d"),
+            'Motivo Rescisão': obs_completa
+        }
         
-        if upload_excel_seguro(empresa, wb):
+        if atualizar_colaborador(empresa, colaborador, campos):
             st.success(f"✅ Rescisão registada para '{colaborador}'")
             return True
         
@@ -1068,96 +1813,151 @@ def registar_rescisao_colaborador(empresa, colaborador, data_rescisao, motivo, o
         return False
 
 def processar_calculo_salario(dados_form):
-    salario_bruto = dados_form['salario_bruto']
-    horas_semana = dados_form['horas_semana']
-    sub_alimentacao_dia = dados_form['subsidio_alimentacao']
-    vencimento_hora = calcular_vencimento_hora(salario_bruto, horas_semana)
-    
-    dias_faltas = dados_form['dias_faltas']
-    dias_baixas = dados_form['dias_baixas']
-    dias_uteis_trabalhados = dados_form['dias_uteis_trabalhados']
-    
-    horas_noturnas = dados_form.get('horas_noturnas', 0)
-    horas_domingos = dados_form.get('horas_domingos', 0)
-    horas_feriados = dados_form.get('horas_feriados', 0)
-    horas_extra = dados_form.get('horas_extra', 0)
-    
-    vencimento_ajustado = calcular_vencimento_ajustado(salario_bruto, dias_faltas, dias_baixas)
-    
-    sub_alimentacao = sub_alimentacao_dia * dias_uteis_trabalhados
-    trabalho_noturno = horas_noturnas * vencimento_hora * 0.25
-    domingos = horas_domingos * vencimento_hora
-    feriados = horas_feriados * vencimento_hora * 2
-    
-    sub_ferias_tipo = dados_form.get('sub_ferias_tipo', 'Duodécimos')
-    if sub_ferias_tipo == 'Total':
-        sub_ferias = salario_bruto
-    elif sub_ferias_tipo == 'Não Pagar':
-        sub_ferias = 0
-    else:
-        sub_ferias = salario_bruto / 12
-    
-    sub_natal_tipo = dados_form.get('sub_natal_tipo', 'Duodécimos')
-    if sub_natal_tipo == 'Total':
-        sub_natal = salario_bruto
-    elif sub_natal_tipo == 'Não Pagar':
-        sub_natal = 0
-    else:
-        sub_natal = salario_bruto / 12
-    
-    banco_horas_valor = vencimento_hora * horas_extra
-    outros_proveitos = dados_form.get('outros_proveitos', 0)
-    
-    total_remuneracoes = (vencimento_ajustado + sub_alimentacao + trabalho_noturno + 
-                          domingos + feriados + sub_ferias + sub_natal + 
-                          banco_horas_valor + outros_proveitos)
-    
-    base_ss = total_remuneracoes - sub_alimentacao
-    seg_social = base_ss * 0.11
-    
-    base_irs = (vencimento_ajustado + trabalho_noturno + domingos + feriados + 
-                sub_ferias + sub_natal + banco_horas_valor + outros_proveitos)
-    
-    irs = calcular_irs(
-        base_incidencia=base_irs,
-        modo_calculo=dados_form.get('irs_modo', 'Tabela'),
-        percentagem_fixa=dados_form.get('irs_percentagem_fixa', 0),
-        estado_civil=dados_form.get('estado_civil', 'Solteiro'),
-        num_dependentes=dados_form.get('num_dependentes', 0),
-        tem_deficiencia=dados_form.get('tem_deficiencia', False)
-    )
-    
-    desconto_especie = 0
-    cartao_refeicao = dados_form.get('cartao_refeicao', False)
-    
-    if cartao_refeicao:
-        desconto_especie = sub_alimentacao
-    
-    total_descontos = seg_social + irs + desconto_especie
-    
-    liquido = total_remuneracoes - total_descontos
+    """Cálculo de um colaborador: o do processamento em lote com uma linha (valores ao cêntimo)"""
+    resultado = processar_calculo_lote(pd.DataFrame([dados_form]), st.session_state.tabela_irs)
+    return resultado.iloc[0].to_dict()
+
+def dados_colaboradores_lote(empresa, colaboradores=None):
+    """Campos da aba Colaboradores nas chaves do dados_form, uma linha por colaborador ativo"""
+    df_base = carregar_dados_base(empresa)
+    if df_base.empty:
+        return pd.DataFrame()
     
-    return {
-        'vencimento_hora': vencimento_hora,
-        'vencimento_ajustado': vencimento_ajustado,
-        'sub_alimentacao': sub_alimentacao,
-        'trabalho_noturno': trabalho_noturno,
-        'domingos': domingos,
-        'feriados': feriados,
-        'sub_ferias': sub_ferias,
-        'sub_natal': sub_natal,
-        'banco_horas_valor': banco_horas_valor,
-        'outros_proveitos': outros_proveitos,
-        'total_remuneracoes': total_remuneracoes,
-        'base_ss': base_ss,
-        'seg_social': seg_social,
-        'base_irs': base_irs,
-        'irs': irs,
-        'desconto_especie': desconto_especie,
-        'cartao_refeicao': cartao_refeicao,
-        'total_descontos': total_descontos,
-        'liquido': liquido
+    df = df_base[df_base['Status'] == 'Ativo'].drop_duplicates('Nome Completo')
+    if colaboradores is not None:
+        df = df[df['Nome Completo'].isin(colaboradores)]
+    df = df.reset_index(drop=True)
+    
+    def coluna(nome, omissao):
+        return df[nome] if nome in df.columns else pd.Series(omissao, index=df.index)
+    
+    dados = pd.DataFrame({
+        'Nome Completo': df['Nome Completo'],
+        'Secção': coluna('Secção', '').fillna('').astype(str),
+        'Categoria Profissional': coluna('Categoria Profissional', '').fillna('').astype(str),
+        'salario_bruto': pd.to_numeric(coluna('Salário Bruto', 870.0), errors='coerce'),
+        'horas_semana': pd.to_numeric(coluna('Nº Horas/Semana', 40), errors='coerce'),
+        'subsidio_alimentacao': pd.to_numeric(coluna('Subsídio Alimentação Diário', 5.96), errors='coerce'),
+        'sub_ferias_tipo': coluna('Sub Férias Tipo', 'Duodécimos').map(normalizar_tipo_subsidio),
+        'sub_natal_tipo': coluna('Sub Natal Tipo', 'Duodécimos').map(normalizar_tipo_subsidio),
+        'cartao_refeicao': coluna('Cartão Refeição', 'Não').map(normalizar_sim_nao) == 'Sim',
+        'estado_civil': coluna('Estado Civil', 'Solteiro').map(normalizar_estado_civil),
+        'num_dependentes': pd.to_numeric(coluna('Nº Dependentes', 0), errors='coerce').fillna(0).astype(int),
+        'tem_deficiencia': coluna('Pessoa com Deficiência', 'Não').map(normalizar_deficiencia) == 'Sim',
+        'irs_modo': coluna('Tipo IRS', 'Tabela').map(normalizar_tipo_irs),
+        'irs_percentagem_fixa': coluna('% IRS Fixa', 0).map(normalizar_percentagem_irs),
+        'data_rescisao': pd.to_datetime(coluna('Data Rescisão', ''), errors='coerce')
+    })
+    
+    # Valores em falta ou inválidos não podem entrar no cálculo como 0,00 €
+    invalidos = {}
+    for chave, nome_coluna in CAMPOS_OBRIGATORIOS_LOTE.items():
+        for nome in dados.loc[dados[chave].isna(), 'Nome Completo']:
+            invalidos.setdefault(nome, []).append(nome_coluna)
+    if invalidos:
+        st.error("❌ Valores em falta ou inválidos na aba Colaboradores (colaboradores fora do cálculo): " +
+                 "; ".join(f"{nome} ({', '.join(campos)})" for nome, campos in invalidos.items()))
+        dados = dados[~dados['Nome Completo'].isin(invalidos)].reset_index(drop=True)
+    return dados
+
+def preparar_dados_lote(empresa, ano, mes, colaboradores=None):
+    """Um dados_form por linha para os colaboradores ativos (aba Colaboradores + faltas/baixas e extras do mês)
+    
+    Com `colaboradores`, só as linhas desses colaboradores.
+    """
+    dados = dados_colaboradores_lote(empresa, colaboradores)
+    if dados.empty:
+        return dados
+    
+    # Faltas e baixas: soma dos dias úteis por tipo (como no processamento individual)
+    dados['dias_faltas'] = 0
+    dados['dias_baixas'] = 0
+    df_fb = carregar_faltas_baixas(empresa, ano, mes)
+    if not df_fb.empty:
+        dias = pd.to_numeric(df_fb['Dias Úteis'], errors='coerce').fillna(0)
+        por_tipo = dias.groupby([df_fb['Nome Completo'], df_fb['Tipo']]).sum().unstack(fill_value=0)
+        for tipo, coluna_dias in (('Falta', 'dias_faltas'), ('Baixa', 'dias_baixas')):
+            if tipo in por_tipo.columns:
+                dados[coluna_dias] = dados['Nome Completo'].map(por_tipo[tipo]).fillna(0).astype(int)
+    
+    dias_uteis_mes = calcular_dias_uteis(ano, mes, feriados_empresa(empresa, ano))
+    dados['dias_uteis_trabalhados'] = (dias_uteis_mes - dados['dias_faltas'] - dados['dias_baixas']).clip(lower=0)
+    
+    # Horas extra e outros proveitos: soma dos registos do mês
+    colunas_extras = {
+        'Horas Noturnas': 'horas_noturnas',
+        'Horas Domingos': 'horas_domingos',
+        'Horas Feriados': 'horas_feriados',
+        'Horas Extra': 'horas_extra',
+        'Outros Proveitos': 'outros_proveitos'
     }
+    df_extras = carregar_horas_extras(empresa, ano, mes)
+    for coluna_extra, chave in colunas_extras.items():
+        dados[chave] = 0.0
+        if not df_extras.empty:
+            somas = pd.to_numeric(df_extras[coluna_extra], errors='coerce').fillna(0).groupby(df_extras['Nome Completo']).sum()
+            dados[chave] = dados['Nome Completo'].map(somas).fillna(0.0).astype(float)
+    
+    return dados
+
+def revisao_dados(empresa, ano):
+    """content_hash dos Excel de onde vêm as entradas do ano (principal e arquivo anual, se existir)"""
+    obter_cache_excel(empresa)
+    return tuple((st.session_state.cache_excel.get(chave) or {}).get('content_hash')
+                 for chave in (chave_excel(empresa), chave_excel(empresa, ano)))
+
+def calcular_salarios_empresa(empresa, ano, mes):
+    """Processamento do mês para todos os colaboradores ativos: dados de entrada + colunas do cálculo
+    
+    Os resultados ficam em st.session_state.resultados_salariais: só são relidos e
+    recalculados os colaboradores afetados por alterações desde o último cálculo.
+    """
+    resultados = st.session_state.resultados_salariais
+    tabela_irs = st.session_state.tabela_irs
+    feriados = feriados_empresa(empresa, ano)
+    revisao = revisao_dados(empresa, ano)
+    
+    colaboradores = resultados.pendentes(empresa, ano, mes, tabela_irs, feriados, revisao)
+    if colaboradores is None or colaboradores:
+        dados = preparar_dados_lote(empresa, ano, mes, colaboradores)
+        if 'Nome Completo' not in dados.columns:
+            return pd.DataFrame()
+        resultados.atualizar(empresa, ano, mes, dados.set_index('Nome Completo'), tabela_irs, feriados, revisao, colaboradores)
+    
+    df = resultados.resultados(empresa, ano, mes)
+    if df.empty:
+        return df
+    for coluna in COLUNAS_MONETARIAS:
+        df[coluna] = em_euros(df[coluna].to_numpy())
+    return df
+
+def tabela_processamento(df_calculo, ano, mes):
+    """Linhas da aba Processamento_YYYY_MM (valores arredondados ao cêntimo) a partir de calcular_salarios_empresa"""
+    df = pd.DataFrame({
+        "Nome Completo": df_calculo['Nome Completo'],
+        "Ano": ano,
+        "Mês": mes,
+        "Secção": df_calculo['Secção'],
+        "Categoria Profissional": df_calculo['Categoria Profissional']
+    })
+    for chave, rotulo in ROTULOS_PROCESSAMENTO.items():
+        df[rotulo] = df_calculo[chave].round(2)
+    df["Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return df[COLUNAS_PROCESSAMENTO]
+
+def gravar_processamento(empresa, ano, mes, df_processamento):
+    """Grava o processamento do mês na aba Processamento_YYYY_MM (substitui a anterior) num só upload"""
+    nome_aba = get_nome_aba_processamento(ano, mes)
+    linhas = [[valor.item() if hasattr(valor, 'item') else valor for valor in linha]
+              for linha in df_processamento[COLUNAS_PROCESSAMENTO].itertuples(index=False, name=None)]
+    
+    return gravar_alteracoes(empresa, [{
+        'tipo': 'substituir_aba',
+        'aba': nome_aba,
+        'colunas': COLUNAS_PROCESSAMENTO,
+        'linhas': linhas,
+        'descricao': f"Processamento {ano}-{mes:02d} ({len(linhas)} colaboradores)"
+    }], ano_arquivo_aba(empresa, nome_aba))
 
 def calcular_ftes_e_estatisticas(empresa, ano=None, mes=None):
     """Calcula FTEs e estatísticas por secção"""
@@ -1444,10 +2244,13 @@ st.markdown("---")
 
 menu = st.sidebar.radio(
     "Menu Principal",
-    ["⚙️ Configurações", "💼 Processar Salários", "👥 Visão FTEs/Secção", "📊 Output", "📈 Tabela IRS"],
+    ["⚙️ Configurações", "💼 Processar Salários", "👥 Visão FTEs/Secção", "📊 Output", "📈 Tabela IRS", "🧪 Simulação", "📅 Projeção"],
     index=0
 )
 
+with st.sidebar:
+    mostrar_alteracoes_pendentes()
+
 # ==================== CONFIGURAÇÕES ====================
 
 if menu == "⚙️ Configurações":
@@ -1460,16 +2263,32 @@ if menu == "⚙️ Configurações":
     
     with tab1:
         st.subheader("📅 Feriados Municipais")
+        col1, col2 = st.columns(2)
+        emp_fer = col1.selectbox("Empresa", list(EMPRESAS.keys()), key="fer_emp")
+        ano_fer = col2.selectbox("Ano", [2024, 2025, 2026], index=1, key="fer_ano")
+        
+        # Só os feriados de dia fixo se editam aqui; os relativos à Páscoa mantêm-se
+        regras = st.session_state.feriados_municipais.get(emp_fer, [])
+        fixos = [r for r in regras if not isinstance(r, int)]
+        moveis = [r for r in regras if isinstance(r, int)]
+        
         feriados_temp = []
         for i in range(3):
-            valor_default = st.session_state.feriados_municipais[i] if i < len(st.session_state.feriados_municipais) else None
-            feriado = st.date_input(f"Feriado {i+1}", value=valor_default, key=f"fer_{i}")
+            valor_default = data_feriado_municipal(fixos[i], ano_fer) if i < len(fixos) else None
+            feriado = st.date_input(f"Feriado {i+1}", value=valor_default, key=f"fer_{emp_fer}_{ano_fer}_{i}")
             if feriado:
-                feriados_temp.append(feriado)
+                feriados_temp.append((feriado.month, feriado.day))
         
         if st.button("💾 Atualizar Feriados"):
-            st.session_state.feriados_municipais = feriados_temp
-            st.success(f"✅ {len(feriados_temp)} feriados")
+            st.session_state.feriados_municipais[emp_fer] = feriados_temp + moveis
+            st.success(f"✅ {len(feriados_temp) + len(moveis)} feriados municipais ({emp_fer})")
+        
+        st.markdown(f"**Feriados {ano_fer} - {emp_fer}**")
+        nacionais = feriados_nacionais(ano_fer)
+        st.dataframe(pd.DataFrame([
+            {"Data": d.strftime("%d/%m/%Y"), "Feriado": nacionais.get(d, "Municipal")}
+            for d in sorted(feriados_empresa(emp_fer, ano_fer))
+        ]), use_container_width=True, hide_index=True)
     
     with tab2:
         st.subheader("👥 Editar Dados dos Colaboradores")
@@ -1579,41 +2398,27 @@ if menu == "⚙️ Configurações":
                         submit = st.form_submit_button("💾 GUARDAR TUDO", use_container_width=True, type="primary")
                         
                         if submit:
-                            df_base = carregar_dados_base(emp)
-                            excel_file = download_excel(emp)
-                            wb = load_workbook(excel_file, data_only=False)
-                            
-                            mask = df_base['Nome Completo'] == colab
-                            df_base.loc[mask, 'Salário Bruto'] = novo_salario
-                            df_base.loc[mask, 'Subsídio Alimentação Diário'] = novo_sub
-                            df_base.loc[mask, 'Número Pingo Doce'] = novo_num
-                            df_base.loc[mask, 'IBAN'] = novo_iban
-                            df_base.loc[mask, 'Cartão Refeição'] = 'Sim' if cartao_refeicao else 'Não'
-                            df_base.loc[mask, 'Sub Férias Tipo'] = sub_ferias_tipo
-                            df_base.loc[mask, 'Sub Natal Tipo'] = sub_natal_tipo
+                            campos = {
+                                'Salário Bruto': novo_salario,
+                                'Subsídio Alimentação Diário': novo_sub,
+                                'Número Pingo Doce': novo_num,
+                                'IBAN': novo_iban,
+                                'Cartão Refeição': 'Sim' if cartao_refeicao else 'Não',
+                                'Sub Férias Tipo': sub_ferias_tipo,
+                                'Sub Natal Tipo': sub_natal_tipo
+                            }
                             
                             if data_rescisao:
-                                df_base.loc[mask, 'Data Rescisão'] = data_rescisao.strftime("%Y-%m-%d")
+                                campos['Data Rescisão'] = data_rescisao.strftime("%Y-%m-%d")
                                 obs_completa = motivo_rescisao
                                 if obs_rescisao:
                                     obs_completa += f" | Obs: {obs_rescisao}"
-                                df_base.loc[mask, 'Motivo Rescisão'] = obs_completa
-                            
-                            if not validar_workbook(wb):
-                                st.error("❌ Validação falhou")
-                                st.stop()
-                            
-                            if "Colaboradores" in wb.sheetnames:
-                                idx = wb.sheetnames.index("Colaboradores")
-                                del wb["Colaboradores"]
-                                ws = wb.create_sheet("Colaboradores", idx)
-                            else:
-                                ws = wb.create_sheet("Colaboradores", 0)
-                            
-                            for r in dataframe_to_rows(df_base, index=False, header=True):
-                                ws.append(r)
+                                campos['Motivo Rescisão'] = obs_completa
                             
-                            if upload_excel_seguro(emp, wb):
+                            campos = campos_alterados(campos, snap)
+                            if not campos:
+                                st.info("ℹ️ Nenhum dado foi alterado")
+                            elif atualizar_colaborador(emp, colab, campos):
                                 st.success("✅ Todos os dados atualizados!")
                                 if data_rescisao:
                                     st.info(f"🚪 Rescisão registada: {data_rescisao.strftime('%d/%m/%Y')}")
@@ -1670,28 +2475,7 @@ if menu == "⚙️ Configurações":
                         if novas_horas == horas_atuais:
                             st.warning("⚠️ As horas não foram alteradas!")
                         else:
-                            df_base = carregar_dados_base(emp)
-                            excel_file = download_excel(emp)
-                            wb = load_workbook(excel_file, data_only=False)
-                            
-                            if not validar_workbook(wb):
-                                st.error("❌ Validação falhou")
-                                st.stop()
-                            
-                            mask = df_base['Nome Completo'] == colab
-                            df_base.loc[mask, 'Nº Horas/Semana'] = novas_horas
-                            
-                            if "Colaboradores" in wb.sheetnames:
-                                idx = wb.sheetnames.index("Colaboradores")
-                                del wb["Colaboradores"]
-                                ws = wb.create_sheet("Colaboradores", idx)
-                            else:
-                                ws = wb.create_sheet("Colaboradores", 0)
-                            
-                            for r in dataframe_to_rows(df_base, index=False, header=True):
-                                ws.append(r)
-                            
-                            if upload_excel_seguro(emp, wb):
+                            if atualizar_colaborador(emp, colab, {'Nº Horas/Semana': novas_horas}):
                                 st.success("✅ Horário atualizado!")
                                 st.balloons()
                                 time.sleep(2)
@@ -1733,33 +2517,27 @@ if menu == "⚙️ Configurações":
                     submit_irs = st.form_submit_button("💾 GUARDAR", use_container_width=True, type="primary")
                     
                     if submit_irs:
-                        df_base = carregar_dados_base(emp)
-                        excel_file = download_excel(emp)
-                        wb = load_workbook(excel_file, data_only=False)
-                        
-                        if not validar_workbook(wb):
-                            st.error("❌ Validação falhou")
-                            st.stop()
+                        campos = {
+                            'Estado Civil': estado_civil,
+                            'Nº Titulares': num_titulares,
+                            'Nº Dependentes': num_dependentes,
+                            'Pessoa com Deficiência': tem_deficiencia,
+                            'Tipo IRS': irs_modo,
+                            '% IRS Fixa': irs_percentagem
+                        }
+                        originais = {
+                            'Estado Civil': snap_irs.get('Estado Civil'),
+                            'Nº Titulares': snap_irs.get('Nº Titulares'),
+                            'Nº Dependentes': snap_irs.get('Nº Dependentes'),
+                            'Pessoa com Deficiência': snap_irs.get('Deficiência'),
+                            'Tipo IRS': snap_irs.get('IRS Modo Calculo'),
+                            '% IRS Fixa': snap_irs.get('IRS Percentagem Fixa')
+                        }
                         
-                        mask = df_base['Nome Completo'] == colab
-                        df_base.loc[mask, 'Estado Civil'] = estado_civil
-                        df_base.loc[mask, 'Nº Titulares'] = num_titulares
-                        df_base.loc[mask, 'Nº Dependentes'] = num_dependentes
-                        df_base.loc[mask, 'Pessoa com Deficiência'] = tem_deficiencia
-                        df_base.loc[mask, 'Tipo IRS'] = irs_modo
-                        df_base.loc[mask, '% IRS Fixa'] = irs_percentagem
-                        
-                        if "Colaboradores" in wb.sheetnames:
-                            idx = wb.sheetnames.index("Colaboradores")
-                            del wb["Colaboradores"]
-                            ws = wb.create_sheet("Colaboradores", idx)
-                        else:
-                            ws = wb.create_sheet("Colaboradores", 0)
-                        
-                        for r in dataframe_to_rows(df_base, index=False, header=True):
-                            ws.append(r)
-                        
-                        if upload_excel_seguro(emp, wb):
+                        campos = campos_alterados(campos, originais)
+                        if not campos:
+                            st.info("ℹ️ Nenhum dado foi alterado")
+                        elif atualizar_colaborador(emp, colab, campos):
                             st.success("✅ Dados IRS atualizados!")
                             st.balloons()
                             time.sleep(2)
@@ -1816,28 +2594,7 @@ if menu == "⚙️ Configurações":
                     submit_cat = st.form_submit_button("💾 GUARDAR", use_container_width=True, type="primary")
                     
                     if submit_cat:
-                        df_base = carregar_dados_base(emp)
-                        excel_file = download_excel(emp)
-                        wb = load_workbook(excel_file, data_only=False)
-                        
-                        if not validar_workbook(wb):
-                            st.error("❌ Validação falhou")
-                            st.stop()
-                        
-                        mask = df_base['Nome Completo'] == colab
-                        df_base.loc[mask, 'Categoria Profissional'] = nova_categoria
-                        
-                        if "Colaboradores" in wb.sheetnames:
-                            idx = wb.sheetnames.index("Colaboradores")
-                            del wb["Colaboradores"]
-                            ws = wb.create_sheet("Colaboradores", idx)
-                        else:
-                            ws = wb.create_sheet("Colaboradores", 0)
-                        
-                        for r in dataframe_to_rows(df_base, index=False, header=True):
-                            ws.append(r)
-                        
-                        if upload_excel_seguro(emp, wb):
+                        if atualizar_colaborador(emp, colab, {'Categoria Profissional': nova_categoria}):
                             st.success(f"✅ Categoria atualizada: **{nova_categoria}**")
                             if obs_categoria:
                                 st.info(f"📝 Observação: {obs_categoria}")
@@ -1850,6 +2607,46 @@ if menu == "⚙️ Configurações":
     with tab6:
         st.subheader("🔧 Gestão de Status dos Colaboradores")
         
+        with st.expander("🗜️ Compactar Snapshots"):
+            st.caption(f"Mantém só o snapshot mais recente de cada colaborador na aba do mês (automático acima de {LIMITE_LINHAS_SNAPSHOT} snapshots substituídos)")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                emp_comp = st.selectbox("Empresa", list(EMPRESAS.keys()), key="emp_compactar")
+            with col2:
+                mes_comp = st.selectbox("Mês", list(range(1, 13)), format_func=lambda x: calendar.month_name[x],
+                                        index=st.session_state.mes_selecionado - 1, key="mes_compactar")
+            with col3:
+                ano_comp = st.selectbox("Ano", [2024, 2025, 2026], index=1, key="ano_compactar")
+            
+            historico_comp = st.checkbox("Guardar linhas antigas na aba Historico_", value=GUARDAR_HISTORICO_SNAPSHOTS, key="hist_compactar")
+            
+            if st.button("🗜️ Compactar", key="btn_compactar"):
+                compactar_snapshots(emp_comp, ano_comp, mes_comp, historico_comp)
+                st.success(f"✅ Compactação de {get_nome_aba_snapshot(ano_comp, mes_comp)} registada ({contar_alteracoes_pendentes(emp_comp)} alterações pendentes)")
+        
+        if ARMAZENAMENTO != "local":
+            with st.expander("📡 Ligação Dropbox"):
+                cliente = obter_cliente_dropbox()
+                estatisticas = cliente.estatisticas()
+                if estatisticas:
+                    st.caption("Chamadas à API desde o arranque do servidor (todas as sessões)")
+                    st.dataframe(pd.DataFrame(estatisticas), use_container_width=True, hide_index=True)
+                    
+                    st.caption("Últimas chamadas (mais recente primeiro)")
+                    st.dataframe(
+                        pd.DataFrame([
+                            {"Método": nome, "Latência (ms)": round(1000 * latencia, 1),
+                             "Repetições": repeticoes, "Sucesso": "✅" if sucesso else "❌"}
+                            for nome, latencia, repeticoes, sucesso in cliente.ultimas_chamadas()[:20]
+                        ]),
+                        use_container_width=True, hide_index=True
+                    )
+                    if st.button("🔄 Limpar estatísticas", key="btn_limpar_stats_dropbox"):
+                        cliente.limpar_estatisticas()
+                        st.rerun()
+                else:
+                    st.info("ℹ️ Ainda não houve chamadas à Dropbox")
+        
         col1, col2 = st.columns(2)
         with col1:
             emp_status = st.selectbox("Empresa", list(EMPRESAS.keys()), 
@@ -1914,6 +2711,71 @@ if menu == "⚙️ Configurações":
 elif menu == "💼 Processar Salários":
     st.header("💼 Processamento Mensal")
     
+    modo_proc = st.radio("Modo", ["👤 Individual", "👥 Processar todos"], horizontal=True, key="modo_proc")
+    
+    if modo_proc == "👥 Processar todos":
+        emp, mes, ano = criar_filtros_padrao("proc_todos", incluir_colaborador=False)
+        nome_aba_proc = get_nome_aba_processamento(ano, mes)
+        
+        st.markdown("---")
+        
+        resultados_proc = st.session_state.resultados_salariais
+        
+        # Depois do primeiro cálculo do mês, cada visita só recalcula os colaboradores alterados
+        if (st.button("▶️ Processar todos os colaboradores ativos", type="primary", key="btn_processar_todos")
+                or resultados_proc.calculado(emp, ano, mes)):
+            inicio_proc = time.perf_counter()
+            df_calculo = calcular_salarios_empresa(emp, ano, mes)
+            if not df_calculo.empty:
+                st.caption(f"⚡ {len(df_calculo)} colaboradores em {(time.perf_counter() - inicio_proc) * 1000:.0f} ms")
+        
+        if not resultados_proc.calculado(emp, ano, mes) or df_calculo.empty:
+            st.info(f"ℹ️ Clique em Processar para calcular {calendar.month_name[mes]} {ano} de todos os colaboradores ativos")
+            st.stop()
+        
+        df_proc = tabela_processamento(df_calculo, ano, mes)
+        totais_proc = resultados_proc.totais(emp, ano, mes) / 100
+        
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("👥 Colaboradores", len(df_proc))
+        col2.metric("💰 Remunerações", f"{totais_proc['total_remuneracoes']:,.2f}€")
+        col3.metric("📉 Descontos", f"{totais_proc['total_descontos']:,.2f}€")
+        col4.metric("💵 Líquido", f"{totais_proc['liquido']:,.2f}€")
+        
+        formato_euros = {coluna: st.column_config.NumberColumn(coluna, format="%.2f €") for coluna in COLUNAS_VALORES_PROCESSAMENTO}
+        
+        st.subheader("📋 Por Colaborador")
+        st.dataframe(
+            df_proc.drop(columns=["Ano", "Mês", "Timestamp"]),
+            use_container_width=True,
+            hide_index=True,
+            column_config=formato_euros
+        )
+        
+        st.subheader("🏢 Totais por Secção")
+        df_seccoes = df_proc.groupby("Secção")[COLUNAS_VALORES_PROCESSAMENTO].sum().round(2)
+        df_seccoes.insert(0, "Nº Colaboradores", df_proc.groupby("Secção").size())
+        df_seccoes.loc["TOTAL EMPRESA"] = df_seccoes.sum().round(2)
+        df_seccoes["Nº Colaboradores"] = df_seccoes["Nº Colaboradores"].astype(int)
+        st.dataframe(
+            df_seccoes.reset_index(),
+            use_container_width=True,
+            hide_index=True,
+            column_config=formato_euros
+        )
+        
+        st.markdown("---")
+        
+        bundle_proc = carregar_bundle(emp, ano_arquivo_aba(emp, nome_aba_proc))
+        if bundle_proc and bundle_proc.tem_aba(nome_aba_proc):
+            st.warning(f"⚠️ A aba '{nome_aba_proc}' já existe e será substituída")
+        
+        if st.button(f"💾 Gravar em {nome_aba_proc}", type="primary", use_container_width=True, key="btn_gravar_processamento"):
+            if gravar_processamento(emp, ano, mes, df_proc):
+                st.success(f"✅ Processamento de {len(df_proc)} colaboradores gravado em '{nome_aba_proc}'")
+        
+        st.stop()
+    
     emp, mes, ano, colab = criar_filtros_padrao("proc", incluir_colaborador=True)
     
     if not colab:
@@ -1926,13 +2788,21 @@ elif menu == "💼 Processar Salários":
         st.error("❌ Erro ao carregar")
         st.stop()
     
+    # Mesmos campos obrigatórios do cálculo em lote: valores em falta não entram como 0,00 €
+    campos_invalidos = [
+        nome_coluna for nome_coluna in CAMPOS_OBRIGATORIOS_LOTE.values()
+        if pd.isna(pd.to_numeric(snap_proc.get(nome_coluna), errors='coerce'))
+    ]
+    if campos_invalidos:
+        st.error(f"❌ Valores em falta ou inválidos na aba Colaboradores para {colab}: {', '.join(campos_invalidos)}")
+        st.stop()
+    
     salario_bruto = float(snap_proc['Salário Bruto'])
     horas_semana = float(snap_proc['Nº Horas/Semana'])
     subsidio_alim = float(snap_proc['Subsídio Alimentação Diário'])
     vencimento_hora = float(snap_proc['Vencimento Hora'])
     
-    feriados = FERIADOS_NACIONAIS_2025 + st.session_state.feriados_municipais
-    dias_uteis_mes = calcular_dias_uteis(ano, mes, feriados)
+    dias_uteis_mes = calcular_dias_uteis(ano, mes, feriados_empresa(emp, ano))
     
     st.markdown("---")
     
@@ -2595,19 +3465,205 @@ elif menu == "📈 Tabela IRS":
     uploaded = st.file_uploader("📤 Carregar Tabelas IRS (Excel)", type=['xlsx', 'xls'])
     
     if uploaded:
-        xls = carregar_tabela_irs_excel(uploaded)
-        
-        if xls:
-            st.markdown("---")
-            aba_sel = st.selectbox("Selecione a aba", xls.sheet_names)
-            df_preview = pd.read_excel(uploaded, sheet_name=aba_sel)
-            st.dataframe(df_preview, use_container_width=True)
+        carregar_tabela_irs_excel(uploaded)
     
     if st.session_state.tabela_irs:
+        tabela_irs = st.session_state.tabela_irs
+        st.markdown("---")
+        aba_sel = st.selectbox("Selecione a tabela", list(tabela_irs.tabelas))
+        situacoes_aba = [
+            f"{estado}{' com deficiência' if deficiencia else ''} ({'com' if com_dependentes else 'sem'} dependentes)"
+            for (estado, deficiencia, com_dependentes), aba in sorted(tabela_irs.situacoes.items()) if aba == aba_sel
+        ]
+        st.caption("Aplica-se a: " + "; ".join(situacoes_aba))
+        st.dataframe(tabela_irs.tabelas[aba_sel].como_dataframe(), use_container_width=True, hide_index=True)
         st.success("✅ Tabela IRS carregada!")
     else:
         st.warning("⚠️ IRS será calculado com escalões aproximados")
 
+# ==================== SIMULAÇÃO ====================
+
+elif menu == "🧪 Simulação":
+    st.header("🧪 Simulação Salarial")
+    st.caption("ℹ️ Os cenários são aplicados em memória aos dados da aba Colaboradores - nada é gravado na Dropbox")
+    
+    emp, mes, ano = criar_filtros_padrao("sim", incluir_colaborador=False)
+    
+    dados_sim = preparar_dados_lote(emp, ano, mes)
+    if dados_sim.empty:
+        st.warning("⚠️ Nenhum colaborador ativo")
+        st.stop()
+    
+    st.session_state.salario_minimo = st.number_input(
+        "💶 Salário Mínimo Nacional", min_value=0.0, value=float(st.session_state.salario_minimo), step=10.0, key="sim_smn"
+    )
+    
+    st.markdown("### 📝 Cenários")
+    st.caption("Linhas com o mesmo nome formam um cenário e são aplicadas por ordem. "
+               "'Salário mínimo' sobe os salários abaixo do valor (proporcional às horas semanais).")
+    grupos_sim = sorted((set(dados_sim['Categoria Profissional']) | set(dados_sim['Secção'])) - {''})
+    
+    df_cenarios = st.data_editor(
+        pd.DataFrame([
+            {"Cenário": "Aumento 5%", "Tipo": "Percentagem", "Valor": 5.0, "Aplicar a": "Todos", "Grupo": None},
+            {"Cenário": "Novo salário mínimo", "Tipo": "Salário mínimo", "Valor": float(st.session_state.salario_minimo),
+             "Aplicar a": "Todos", "Grupo": None}
+        ]),
+        num_rows="dynamic",
+        use_container_width=True,
+        hide_index=True,
+        key="sim_cenarios",
+        column_config={
+            "Tipo": st.column_config.SelectboxColumn("Tipo", options=list(TIPOS_ALTERACAO), required=True),
+            "Valor": st.column_config.NumberColumn("Valor", help="% ou € (mínimo: valor a tempo inteiro)"),
+            "Aplicar a": st.column_config.SelectboxColumn("Aplicar a", options=["Todos"] + list(CAMPOS_GRUPO), required=True),
+            "Grupo": st.column_config.SelectboxColumn("Grupo", options=grupos_sim)
+        }
+    )
+    
+    cenarios = {}
+    for _, linha in df_cenarios.iterrows():
+        nome = str(linha["Cenário"]).strip() if pd.notna(linha["Cenário"]) else ""
+        if not nome or nome == CENARIO_ATUAL or linha["Tipo"] not in TIPOS_ALTERACAO or pd.isna(linha["Valor"]):
+            continue
+        grupo = linha["Grupo"] if pd.notna(linha["Grupo"]) and linha["Grupo"] else None
+        campo = linha["Aplicar a"] if linha["Aplicar a"] in CAMPOS_GRUPO and grupo else None
+        cenarios.setdefault(nome, []).append(
+            AlteracaoSalarial(linha["Tipo"], float(linha["Valor"]), campo, grupo if campo else None)
+        )
+    
+    if not cenarios:
+        st.info("ℹ️ Defina pelo menos um cenário")
+        st.stop()
+    
+    ano_fim_sim = ano + (mes + 10) // 12
+    inicio_sim = time.perf_counter()
+    resultado_sim = simular_cenarios(
+        dados_sim, cenarios, ano, mes,
+        calendario_uteis(ano, ano_fim_sim, feriados_empresa(emp, ano, ano_fim_sim)),
+        st.session_state.tabela_irs
+    )
+    colunas_sim = ['total_remuneracoes', 'liquido', 'seg_social_entidade', 'custo_empresa', 'custo_anual']
+    totais_sim, diferencas_sim, abrangidos_sim = resumo_cenarios(resultado_sim, colunas_sim)
+    st.caption(f"⚡ {len(cenarios)} cenários × {len(dados_sim)} colaboradores em {(time.perf_counter() - inicio_sim) * 1000:.0f} ms")
+    
+    st.markdown("---")
+    st.markdown(f"### 📊 Resultado ({calendar.month_name[mes]} {ano})")
+    
+    df_resumo = pd.DataFrame({
+        "Cenário": totais_sim.index,
+        "Colaboradores Abrangidos": abrangidos_sim.to_numpy(),
+        "Remunerações/Mês": em_euros(totais_sim['total_remuneracoes'].to_numpy()),
+        "Líquido/Mês": em_euros(totais_sim['liquido'].to_numpy()),
+        "Custo Empresa/Mês": em_euros(totais_sim['custo_empresa'].to_numpy()),
+        "Δ Custo/Mês": em_euros(diferencas_sim['custo_empresa'].to_numpy()),
+        "Custo Empresa/Ano": em_euros(totais_sim['custo_anual'].to_numpy()),
+        "Δ Custo/Ano": em_euros(diferencas_sim['custo_anual'].to_numpy())
+    })
+    formato_sim = {coluna: st.column_config.NumberColumn(coluna, format="%.2f €")
+                   for coluna in df_resumo.columns if coluna not in ("Cenário", "Colaboradores Abrangidos")}
+    st.dataframe(df_resumo, use_container_width=True, hide_index=True, column_config=formato_sim)
+    st.caption("Custo empresa = remunerações + TSU da entidade patronal. "
+               "Anual = os 12 meses a partir deste (como na Projeção): sem faltas nem horas extra, "
+               "subsídios nos meses de pagamento e saídas pela Data Rescisão.")
+    
+    cenario_sel = st.selectbox("🔍 Detalhe do cenário", list(cenarios), key="sim_cenario_sel")
+    atual_sim = resultado_sim[resultado_sim['Cenário'] == CENARIO_ATUAL].reset_index(drop=True)
+    sel_sim = resultado_sim[resultado_sim['Cenário'] == cenario_sel].reset_index(drop=True)
+    
+    df_detalhe = pd.DataFrame({
+        "Nome Completo": sel_sim['Nome Completo'],
+        "Secção": sel_sim['Secção'],
+        "Categoria Profissional": sel_sim['Categoria Profissional'],
+        "Salário Atual": sel_sim['salario_atual'],
+        "Salário Simulado": sel_sim['salario_simulado'],
+        "Δ Líquido/Mês": em_euros((sel_sim['liquido'] - atual_sim['liquido']).to_numpy()),
+        "Δ Custo/Mês": em_euros((sel_sim['custo_empresa'] - atual_sim['custo_empresa']).to_numpy()),
+        "Δ Custo/Ano": em_euros((sel_sim['custo_anual'] - atual_sim['custo_anual']).to_numpy())
+    })
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**🏢 Por Secção**")
+        st.dataframe(
+            df_detalhe.groupby("Secção")[["Δ Custo/Mês", "Δ Custo/Ano"]].sum().round(2).reset_index(),
+            use_container_width=True, hide_index=True, column_config=formato_sim
+        )
+    with col2:
+        st.markdown("**👔 Por Categoria Profissional**")
+        st.dataframe(
+            df_detalhe.groupby("Categoria Profissional")[["Δ Custo/Mês", "Δ Custo/Ano"]].sum().round(2).reset_index(),
+            use_container_width=True, hide_index=True, column_config=formato_sim
+        )
+    
+    st.markdown("**👤 Por Colaborador** (só os abrangidos)")
+    st.dataframe(
+        df_detalhe[df_detalhe["Salário Simulado"] != df_detalhe["Salário Atual"]],
+        use_container_width=True, hide_index=True,
+        column_config={coluna: st.column_config.NumberColumn(coluna, format="%.2f €")
+                       for coluna in df_detalhe.columns[3:]}
+    )
+
+# ==================== PROJEÇÃO ====================
+
+elif menu == "📅 Projeção":
+    st.header("📅 Projeção a 12 Meses")
+    st.caption("ℹ️ Salários atuais da aba Colaboradores, sem faltas nem horas extra; "
+               "subsídios 'Total' em junho (férias) e dezembro (Natal), e saídas pela Data Rescisão")
+    
+    emp, mes, ano = criar_filtros_padrao("proj", incluir_colaborador=False)
+    
+    dados_proj = dados_colaboradores_lote(emp)
+    if dados_proj.empty:
+        st.warning("⚠️ Nenhum colaborador ativo")
+        st.stop()
+    
+    ano_fim_proj = ano + (mes + 10) // 12
+    inicio_proj = time.perf_counter()
+    projecao = projetar_salarios(
+        dados_proj, ano, mes,
+        calendario_uteis(ano, ano_fim_proj, feriados_empresa(emp, ano, ano_fim_proj)),
+        st.session_state.tabela_irs
+    )
+    st.caption(f"⚡ {len(dados_proj)} colaboradores × 12 meses em {(time.perf_counter() - inicio_proj) * 1000:.0f} ms")
+    
+    totais_proj = projecao[COLUNAS_PROJECAO].sum()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("💰 Remunerações (12 meses)", f"{totais_proj['total_remuneracoes'] / 100:,.2f}€")
+    col2.metric("💵 Líquido (12 meses)", f"{totais_proj['liquido'] / 100:,.2f}€")
+    col3.metric("🏢 Custo Empresa (12 meses)", f"{totais_proj['custo_empresa'] / 100:,.2f}€")
+    col4.metric("🚪 Saídas Previstas", int(projecao['Saída'].sum()))
+    
+    nomes_proj = {
+        'total_remuneracoes': "Remunerações",
+        'seg_social': "SS Trabalhador",
+        'irs': "IRS",
+        'liquido': "Líquido",
+        'seg_social_entidade': "SS Entidade",
+        'custo_empresa': "Custo Empresa"
+    }
+    formato_proj = {nome: st.column_config.NumberColumn(nome, format="%.2f €") for nome in nomes_proj.values()}
+    
+    st.markdown("---")
+    st.markdown("### 📆 Por Mês")
+    por_mes = projecao.groupby('Mês')
+    df_meses = pd.DataFrame({"Colaboradores": por_mes.size()})
+    for coluna, nome in nomes_proj.items():
+        df_meses[nome] = em_euros(por_mes[coluna].sum().to_numpy())
+    df_meses = df_meses.reset_index()
+    st.dataframe(df_meses, use_container_width=True, hide_index=True, column_config=formato_proj)
+    st.bar_chart(df_meses.set_index("Mês")[["Custo Empresa"]])
+    
+    st.markdown("### 👤 Por Colaborador")
+    por_colab = projecao.groupby(['Nome Completo', 'Secção'], sort=False)
+    df_colab = pd.DataFrame({"Meses": por_colab.size()})
+    for coluna, nome in nomes_proj.items():
+        df_colab[nome] = em_euros(por_colab[coluna].sum().to_numpy())
+    saidas_proj = projecao[projecao['Saída']].set_index('Nome Completo')['Mês']
+    df_colab = df_colab.reset_index()
+    df_colab.insert(2, "Saída", df_colab['Nome Completo'].map(saidas_proj).fillna(""))
+    st.dataframe(df_colab, use_container_width=True, hide_index=True, column_config=formato_proj)
+
 st.sidebar.markdown("---")
 st.sidebar.success(f"""✅ v3.5.1 CORREÇÕES:
 - 🆔 Campos "Documento de Identificação" e "Validade Documento"
@@ -2618,5 +3674,7 @@ st.sidebar.success(f"""✅ v3.5.1 CORREÇÕES:
 """)
 
 if st.sidebar.button("🚪 Logout", use_container_width=True):
+    if not gravar_todas_alteracoes_pendentes():
+        st.stop()
     st.session_state.authenticated = False
     st.rerun()
@@ -0,0 +1,61 @@
+"""
+Calendário de dias úteis - contagens entre datas em O(1) por somas acumuladas
+
+Para um intervalo de datas e um conjunto de feriados, guarda quantos dias
+úteis (segunda a sexta, sem feriados) há desde o início do calendário até cada
+dia. Os dias úteis entre duas datas são então uma subtração, e colunas inteiras
+de datas de início/fim contam-se com uma única operação NumPy.
+"""
+
+import numpy as np
+
+
+class CalendarioUteis:
+    """Dias úteis entre `inicio` e `fim` (inclusive), descontando `feriados`"""
+
+    def __init__(self, inicio, fim, feriados=()):
+        self.inicio = np.datetime64(inicio, "D")
+        self.fim = np.datetime64(fim, "D")
+        if self.fim < self.inicio:
+            raise ValueError("Fim do calendário antes do início")
+
+        dias = np.arange(self.inicio, self.fim + 1)
+        feriados = np.array(sorted(feriados), dtype="datetime64[D]")
+        self.uteis = np.is_busday(dias, holidays=feriados)
+        # acumulado[i] = dias úteis em [inicio, inicio + i)
+        self._acumulado = np.concatenate(([0], np.cumsum(self.uteis)))
+
+    def _posicoes(self, datas, limite):
+        posicoes = (np.asarray(datas, dtype="datetime64[D]") - self.inicio).astype(np.int64)
+        if np.any(posicoes < 0) or np.any(posicoes > limite):
+            raise ValueError(f"Data fora do calendário ({self.inicio} a {self.fim})")
+        return posicoes
+
+    @staticmethod
+    def _resultado(valores):
+        return int(valores) if np.ndim(valores) == 0 else valores
+
+    def contar(self, inicio, fim):
+        """Dias úteis de `inicio` a `fim`, ambos incluídos (0 se inicio > fim); datas ou arrays de datas"""
+        a = self._posicoes(inicio, len(self.uteis) - 1)
+        b = self._posicoes(fim, len(self.uteis) - 1)
+        return self._resultado(np.where(b >= a, self._acumulado[np.maximum(a, b) + 1] - self._acumulado[a], 0))
+
+    def busday_count(self, inicio, fim):
+        """Como np.busday_count: dias úteis em [inicio, fim); se fim < inicio, menos os de (fim, inicio]"""
+        a = self._posicoes(inicio, len(self.uteis))
+        b = self._posicoes(fim, len(self.uteis))
+        ultimo = len(self.uteis)
+        return self._resultado(np.where(
+            b >= a,
+            self._acumulado[b] - self._acumulado[a],
+            self._acumulado[np.minimum(b + 1, ultimo)] - self._acumulado[np.minimum(a + 1, ultimo)]
+        ))
+
+    def contar_mes(self, ano, mes):
+        """Dias úteis do mês"""
+        primeiro = np.datetime64(f"{ano:04d}-{mes:02d}", "M")
+        return self.busday_count(primeiro.astype("datetime64[D]"), (primeiro + 1).astype("datetime64[D]"))
+
+    def e_util(self, data):
+        return bool(self.uteis[self._posicoes(data, len(self.uteis) - 1)])
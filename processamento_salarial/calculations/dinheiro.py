@@ -0,0 +1,40 @@
+"""
+Dinheiro em cêntimos - valores monetários como inteiros (int64), escalares ou arrays
+
+Cada linha do recibo (vencimento, subsídios, horas, descontos) é arredondada ao
+cêntimo no momento em que é calculada, metade para cima (afastando de zero),
+como num recibo de vencimento; os totais são somas de inteiros e batem sempre
+certo com as linhas, na pré-visualização, na folha de processamento e nos
+relatórios.
+"""
+
+import numpy as np
+
+
+def _resultado(valores):
+    return int(valores) if np.ndim(valores) == 0 else valores
+
+
+def arredondar_centimos(centimos):
+    """Cêntimos (float) arredondados ao cêntimo inteiro; valores em falta (NaN) lançam ValueError
+
+    Um valor em falta não pode virar 0,00 € sem aviso: as entradas são validadas
+    antes do cálculo (ver dados_colaboradores_lote).
+    """
+    valor = np.asarray(centimos, dtype=float)
+    if np.isnan(valor).any():
+        raise ValueError("Valor monetário em falta (NaN) no cálculo")
+    # O round a 6 casas tira o ruído binário (1.005 * 100 = 100.49999999999999)
+    inteiro = np.sign(valor) * np.floor(np.abs(np.round(valor, 6)) + 0.5)
+    return _resultado(inteiro.astype(np.int64))
+
+
+def para_centimos(euros):
+    """Euros (escalar ou array) para cêntimos inteiros"""
+    return arredondar_centimos(np.asarray(euros, dtype=float) * 100)
+
+
+def em_euros(centimos):
+    """Cêntimos inteiros para euros (float com no máximo 2 casas)"""
+    euros = np.asarray(centimos, dtype=np.int64) / 100
+    return float(euros) if np.ndim(euros) == 0 else euros
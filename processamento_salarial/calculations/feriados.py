@@ -0,0 +1,83 @@
+"""
+Feriados - nacionais calculados para qualquer ano, mais os municipais de cada empresa
+
+Os feriados móveis (Sexta-feira Santa, Páscoa, Corpo de Deus) saem da data da
+Páscoa. Os municipais são regras que se repetem todos os anos: (mês, dia) para
+um dia fixo, ou um inteiro com o desvio em dias da Páscoa (ex.: 39 para a
+Quinta-feira da Ascensão). Cada ano é calculado uma só vez por processo.
+"""
+
+from datetime import date, timedelta
+from functools import lru_cache
+
+
+FERIADOS_FIXOS = [
+    ((1, 1), "Ano Novo"),
+    ((4, 25), "Dia da Liberdade"),
+    ((5, 1), "Dia do Trabalhador"),
+    ((6, 10), "Dia de Portugal"),
+    ((8, 15), "Assunção de Nossa Senhora"),
+    ((10, 5), "Implantação da República"),
+    ((11, 1), "Dia de Todos os Santos"),
+    ((12, 1), "Restauração da Independência"),
+    ((12, 8), "Imaculada Conceição"),
+    ((12, 25), "Natal"),
+]
+
+# Desvio em dias em relação ao Domingo de Páscoa
+FERIADOS_MOVEIS = [
+    (-2, "Sexta-feira Santa"),
+    (0, "Páscoa"),
+    (60, "Corpo de Deus"),
+]
+
+# Feriados suspensos entre 2013 e 2015 (repostos em 2016)
+FERIADOS_SUSPENSOS = {"Corpo de Deus", "Implantação da República", "Dia de Todos os Santos",
+                      "Restauração da Independência"}
+ANOS_SUSPENSAO = range(2013, 2016)
+
+
+def calcular_pascoa(ano):
+    """Domingo de Páscoa (calendário gregoriano, algoritmo de Meeus/Jones/Butcher)"""
+    a = ano % 19
+    b, c = divmod(ano, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(ano, mes, dia + 1)
+
+
+@lru_cache(maxsize=None)
+def feriados_nacionais(ano):
+    """Dicionário data -> nome dos feriados nacionais do ano, por ordem de data"""
+    pascoa = calcular_pascoa(ano)
+    feriados = {date(ano, mes, dia): nome for (mes, dia), nome in FERIADOS_FIXOS}
+    feriados.update({pascoa + timedelta(days=desvio): nome for desvio, nome in FERIADOS_MOVEIS})
+
+    if ano in ANOS_SUSPENSAO:
+        feriados = {data: nome for data, nome in feriados.items() if nome not in FERIADOS_SUSPENSOS}
+    return dict(sorted(feriados.items()))
+
+
+def data_feriado_municipal(regra, ano):
+    """Data no ano de uma regra municipal ((mês, dia) ou desvio da Páscoa), ou None se não existir"""
+    if isinstance(regra, int):
+        return calcular_pascoa(ano) + timedelta(days=regra)
+    mes, dia = regra
+    try:
+        return date(ano, mes, dia)
+    except ValueError:
+        # 29 de fevereiro fora dos anos bissextos
+        return None
+
+
+@lru_cache(maxsize=None)
+def feriados_ano(ano, regras_municipais=()):
+    """frozenset com os feriados nacionais e municipais do ano (`regras_municipais` num tuplo)"""
+    municipais = (data_feriado_municipal(regra, ano) for regra in regras_municipais)
+    return frozenset(feriados_nacionais(ano)) | frozenset(d for d in municipais if d is not None)
@@ -0,0 +1,202 @@
+"""
+Processamento em lote - o cálculo salarial para todos os colaboradores de uma vez
+
+Recebe um DataFrame com uma linha por colaborador e as mesmas chaves do
+`dados_form` do cálculo individual (salario_bruto, horas_semana, dias_faltas,
+...) e calcula todas as colunas com operações NumPy sobre a coluna inteira.
+O cálculo individual (processar_calculo_salario) é este mesmo, com uma linha.
+
+Os valores são calculados em cêntimos inteiros (ver dinheiro.py): cada linha
+do recibo é arredondada ao cêntimo e os totais são somas exatas dessas linhas.
+O vencimento/hora é uma taxa e não é arredondado.
+
+Com uma TabelaIRS (tabelas oficiais carregadas), o IRS por tabela sai dela; as
+situações que nenhuma tabela cobre usam os escalões simplificados abaixo.
+"""
+
+import numpy as np
+import pandas as pd
+
+from processamento_salarial.calculations.dinheiro import arredondar_centimos, em_euros, para_centimos
+
+
+# Escalões da tabela simplificada de IRS: base até ao limite -> taxa (acima do último, a última taxa)
+LIMITES_IRS = np.array([820.0, 1200.0, 1700.0, 2500.0])
+TAXAS_IRS = np.array([0.135, 0.18, 0.23, 0.265, 0.32])
+TAXA_MINIMA_IRS = 0.05
+REDUCAO_POR_DEPENDENTE = 0.01
+FATOR_CASADO_UNICO_TITULAR = 0.85
+
+TAXA_SEG_SOCIAL = 0.11
+TAXA_SEG_SOCIAL_ENTIDADE = 0.2375
+
+# Valores usados quando a coluna não vem no DataFrame (os mesmos defaults do dados_form)
+VALORES_OMISSAO = {
+    'horas_noturnas': 0.0,
+    'horas_domingos': 0.0,
+    'horas_feriados': 0.0,
+    'horas_extra': 0.0,
+    'outros_proveitos': 0.0,
+    'sub_ferias_tipo': 'Duodécimos',
+    'sub_natal_tipo': 'Duodécimos',
+    'sub_ferias_fracao': 1.0,
+    'sub_natal_fracao': 1.0,
+    'cartao_refeicao': False,
+    'irs_modo': 'Tabela',
+    'irs_percentagem_fixa': 0.0,
+    'estado_civil': 'Solteiro',
+    'num_dependentes': 0,
+    'tem_deficiencia': False,
+}
+
+COLUNAS_RESULTADO = [
+    'vencimento_hora', 'vencimento_ajustado', 'sub_alimentacao', 'trabalho_noturno',
+    'domingos', 'feriados', 'sub_ferias', 'sub_natal', 'banco_horas_valor',
+    'outros_proveitos', 'total_remuneracoes', 'base_ss', 'seg_social', 'base_irs',
+    'irs', 'desconto_especie', 'cartao_refeicao', 'total_descontos', 'liquido',
+    'seg_social_entidade', 'custo_empresa'
+]
+
+# Colunas em cêntimos no resultado de processar_calculo_lote_centimos
+COLUNAS_MONETARIAS = [c for c in COLUNAS_RESULTADO if c not in ('vencimento_hora', 'cartao_refeicao')]
+
+
+def _coluna(df, nome, tipo=float):
+    if nome in df.columns:
+        serie = df[nome]
+    else:
+        serie = pd.Series(VALORES_OMISSAO[nome], index=df.index)
+    if tipo is float:
+        return serie.to_numpy(dtype=float)
+    if tipo is bool:
+        return serie.fillna(False).to_numpy(dtype=bool)
+    return serie.to_numpy(dtype=object)
+
+
+def calcular_subsidio_lote(salario_centimos, tipo, fracao=1.0):
+    """Sub. férias/natal em cêntimos: salário inteiro (Total, ou a `fracao` dele), nada (Não Pagar) ou 1/12 (Duodécimos)"""
+    total = arredondar_centimos(salario_centimos * fracao)
+    duodecimo = arredondar_centimos(salario_centimos / 12)
+    return np.where(tipo == 'Total', total, np.where(tipo == 'Não Pagar', 0, duodecimo))
+
+
+def calcular_vencimento_ajustado_lote(salario_centimos, dias_faltas, dias_baixas):
+    """Vencimento dos dias pagos (30 menos faltas e baixas), em cêntimos"""
+    dias_pagos = np.maximum(30 - dias_faltas - dias_baixas, 0)
+    return arredondar_centimos(salario_centimos * dias_pagos / 30)
+
+
+def calcular_irs_escaloes_lote(base_incidencia, estado_civil, num_dependentes):
+    """IRS pelos escalões simplificados (sem tabela oficial carregada), em cêntimos; base em cêntimos"""
+    taxa = TAXAS_IRS[np.searchsorted(LIMITES_IRS * 100, base_incidencia, side='left')]
+    taxa_final = np.maximum(taxa - num_dependentes * REDUCAO_POR_DEPENDENTE, TAXA_MINIMA_IRS)
+    taxa_final = np.where(estado_civil == "Casado Único Titular", taxa_final * FATOR_CASADO_UNICO_TITULAR, taxa_final)
+    return arredondar_centimos(base_incidencia * taxa_final)
+
+
+def calcular_irs_tabela_lote(base_incidencia, estado_civil, num_dependentes, tem_deficiencia, tabela_irs=None):
+    """IRS por tabela em cêntimos (base em cêntimos): tabela oficial onde houver, senão escalões"""
+    escaloes = calcular_irs_escaloes_lote(base_incidencia, estado_civil, num_dependentes)
+    if tabela_irs is None:
+        return escaloes
+    retencao = tabela_irs.calcular(em_euros(base_incidencia), estado_civil, num_dependentes, tem_deficiencia)
+    coberta = ~np.isnan(retencao)
+    return np.where(coberta, para_centimos(np.where(coberta, retencao, 0.0)), escaloes)
+
+
+def calcular_irs_lote(base_incidencia, modo_calculo, percentagem_fixa, estado_civil, num_dependentes,
+                      tem_deficiencia, tabela_irs=None):
+    """IRS em cêntimos (base em cêntimos): taxa fixa ou tabela, linha a linha"""
+    return np.where(
+        modo_calculo == "Fixa",
+        arredondar_centimos(base_incidencia * (percentagem_fixa / 100)),
+        calcular_irs_tabela_lote(base_incidencia, estado_civil, num_dependentes, tem_deficiencia, tabela_irs)
+    )
+
+
+def processar_calculo_lote_centimos(df, tabela_irs=None):
+    """DataFrame (mesmo índice) com o cálculo de cada linha de `df`; valores em cêntimos (int64)"""
+    salario_bruto = para_centimos(_coluna(df, 'salario_bruto'))
+    horas_semana = _coluna(df, 'horas_semana')
+    sub_alimentacao_dia = para_centimos(_coluna(df, 'subsidio_alimentacao'))
+
+    # Vencimento/hora em euros, sem arredondar (é uma taxa)
+    vencimento_hora = np.zeros(len(df))
+    com_horas = horas_semana != 0
+    vencimento_hora[com_horas] = (salario_bruto[com_horas] * 12) / (52 * horas_semana[com_horas]) / 100
+
+    dias_faltas = _coluna(df, 'dias_faltas')
+    dias_baixas = _coluna(df, 'dias_baixas')
+    dias_uteis_trabalhados = _coluna(df, 'dias_uteis_trabalhados')
+
+    vencimento_ajustado = calcular_vencimento_ajustado_lote(salario_bruto, dias_faltas, dias_baixas)
+
+    sub_alimentacao = arredondar_centimos(sub_alimentacao_dia * dias_uteis_trabalhados)
+    trabalho_noturno = para_centimos(_coluna(df, 'horas_noturnas') * vencimento_hora * 0.25)
+    domingos = para_centimos(_coluna(df, 'horas_domingos') * vencimento_hora)
+    feriados = para_centimos(_coluna(df, 'horas_feriados') * vencimento_hora * 2)
+
+    sub_ferias = calcular_subsidio_lote(salario_bruto, _coluna(df, 'sub_ferias_tipo', object), _coluna(df, 'sub_ferias_fracao'))
+    sub_natal = calcular_subsidio_lote(salario_bruto, _coluna(df, 'sub_natal_tipo', object), _coluna(df, 'sub_natal_fracao'))
+
+    banco_horas_valor = para_centimos(vencimento_hora * _coluna(df, 'horas_extra'))
+    outros_proveitos = para_centimos(_coluna(df, 'outros_proveitos'))
+
+    base_irs = (vencimento_ajustado + trabalho_noturno + domingos + feriados +
+                sub_ferias + sub_natal + banco_horas_valor + outros_proveitos)
+    total_remuneracoes = base_irs + sub_alimentacao
+
+    base_ss = total_remuneracoes - sub_alimentacao
+    seg_social = arredondar_centimos(base_ss * TAXA_SEG_SOCIAL)
+
+    irs = calcular_irs_lote(
+        base_irs,
+        _coluna(df, 'irs_modo', object),
+        _coluna(df, 'irs_percentagem_fixa'),
+        _coluna(df, 'estado_civil', object),
+        _coluna(df, 'num_dependentes'),
+        _coluna(df, 'tem_deficiencia', bool),
+        tabela_irs
+    )
+
+    cartao_refeicao = _coluna(df, 'cartao_refeicao', bool)
+    desconto_especie = np.where(cartao_refeicao, sub_alimentacao, 0)
+
+    total_descontos = seg_social + irs + desconto_especie
+    liquido = total_remuneracoes - total_descontos
+
+    # Encargos da entidade patronal (TSU) e custo total para a empresa
+    seg_social_entidade = arredondar_centimos(base_ss * TAXA_SEG_SOCIAL_ENTIDADE)
+    custo_empresa = total_remuneracoes + seg_social_entidade
+
+    return pd.DataFrame({
+        'vencimento_hora': vencimento_hora,
+        'vencimento_ajustado': vencimento_ajustado,
+        'sub_alimentacao': sub_alimentacao,
+        'trabalho_noturno': trabalho_noturno,
+        'domingos': domingos,
+        'feriados': feriados,
+        'sub_ferias': sub_ferias,
+        'sub_natal': sub_natal,
+        'banco_horas_valor': banco_horas_valor,
+        'outros_proveitos': outros_proveitos,
+        'total_remuneracoes': total_remuneracoes,
+        'base_ss': base_ss,
+        'seg_social': seg_social,
+        'base_irs': base_irs,
+        'irs': irs,
+        'desconto_especie': desconto_especie,
+        'cartao_refeicao': cartao_refeicao,
+        'total_descontos': total_descontos,
+        'liquido': liquido,
+        'seg_social_entidade': seg_social_entidade,
+        'custo_empresa': custo_empresa
+    }, index=df.index, columns=COLUNAS_RESULTADO)
+
+
+def processar_calculo_lote(df, tabela_irs=None):
+    """DataFrame (mesmo índice) com as colunas de processar_calculo_salario para cada linha de `df`, em euros"""
+    resultado = processar_calculo_lote_centimos(df, tabela_irs)
+    for coluna in COLUNAS_MONETARIAS:
+        resultado[coluna] = em_euros(resultado[coluna].to_numpy())
+    return resultado
@@ -0,0 +1,95 @@
+"""
+Projeção salarial - os próximos meses de cada colaborador numa só matriz
+
+A partir das linhas de dados_colaboradores_lote (sem faltas nem extras), monta a
+matriz colaborador × mês e calcula-a com uma única chamada ao cálculo em lote:
+
+- subsídios "Total" pagos por inteiro no mês de pagamento (férias em junho,
+  Natal em dezembro) e nada nos outros meses; "Duodécimos" todos os meses;
+- com Data Rescisão, o mês da saída paga só os dias até à saída (e os dias
+  úteis até lá), os subsídios "Total" ainda não pagos nesse ano são pagos na
+  saída em proporção aos meses do ano, e os meses seguintes ficam a zero.
+"""
+
+import numpy as np
+import pandas as pd
+
+from processamento_salarial.calculations.processamento_lote import COLUNAS_MONETARIAS, processar_calculo_lote_centimos
+
+
+MES_PAGAMENTO_SUB_FERIAS = 6
+MES_PAGAMENTO_SUB_NATAL = 12
+DIAS_MES_COMERCIAL = 30
+
+COLUNAS_PROJECAO = ['total_remuneracoes', 'seg_social', 'irs', 'liquido', 'seg_social_entidade', 'custo_empresa']
+
+
+def _subsidio(tipos, numero_mes, mes_pagamento, mes_saida):
+    """Tipo e fração do subsídio em cada (colaborador, mês)"""
+    total = (tipos == 'Total')[:, None]
+    pago = numero_mes == mes_pagamento
+    proporcional = total & mes_saida & (numero_mes < mes_pagamento)
+    tipo = np.where(total, np.where(pago | proporcional, 'Total', 'Não Pagar'), tipos[:, None])
+    fracao = np.where(proporcional, numero_mes / 12, 1.0)
+    return tipo, fracao
+
+
+def montar_projecao(dados, ano, mes, calendario, meses=12):
+    """Linhas para o cálculo em lote (`meses` por colaborador, seguidas) e as matrizes (colaborador, mês)
+
+    Devolve (linhas, periodos, ativo, mes_saida): `ativo` é falso nos meses
+    depois da saída, que ficam nas linhas mas não contam.
+    """
+    n = len(dados)
+    periodos = np.datetime64(f"{ano:04d}-{mes:02d}", "M") + np.arange(meses)
+    primeiro = periodos.astype("datetime64[D]")
+    ultimo = (periodos + 1).astype("datetime64[D]") - 1
+    numero_mes = periodos.astype(int) % 12 + 1
+
+    # Matrizes (colaborador, mês)
+    rescisao = pd.to_datetime(dados['data_rescisao'], errors='coerce').to_numpy(dtype="datetime64[D]")[:, None]
+    com_rescisao = ~np.isnat(rescisao)
+    ativo = ~com_rescisao | (rescisao >= primeiro)
+    mes_saida = com_rescisao & (rescisao >= primeiro) & (rescisao <= ultimo)
+
+    fim = np.where(mes_saida, rescisao, ultimo)
+    inicio = np.broadcast_to(primeiro, (n, meses))
+    dias_uteis = calendario.contar(inicio, fim) if n else np.zeros((0, meses), dtype=int)
+    # Mês comercial de 30 dias: saída no último dia do mês paga o mês inteiro
+    dias_contrato = np.where(mes_saida & (fim < ultimo),
+                             np.minimum((fim - inicio).astype(int) + 1, DIAS_MES_COMERCIAL), DIAS_MES_COMERCIAL)
+
+    sub_ferias_tipo, sub_ferias_fracao = _subsidio(
+        dados['sub_ferias_tipo'].to_numpy(dtype=object), numero_mes, MES_PAGAMENTO_SUB_FERIAS, mes_saida)
+    sub_natal_tipo, sub_natal_fracao = _subsidio(
+        dados['sub_natal_tipo'].to_numpy(dtype=object), numero_mes, MES_PAGAMENTO_SUB_NATAL, mes_saida)
+
+    linhas = dados.iloc[np.repeat(np.arange(n), meses)].reset_index(drop=True)
+    linhas = linhas.assign(
+        dias_faltas=(DIAS_MES_COMERCIAL - dias_contrato).ravel(),
+        dias_baixas=0,
+        dias_uteis_trabalhados=dias_uteis.ravel(),
+        horas_noturnas=0.0, horas_domingos=0.0, horas_feriados=0.0, horas_extra=0.0, outros_proveitos=0.0,
+        sub_ferias_tipo=sub_ferias_tipo.ravel(), sub_ferias_fracao=sub_ferias_fracao.ravel(),
+        sub_natal_tipo=sub_natal_tipo.ravel(), sub_natal_fracao=sub_natal_fracao.ravel()
+    )
+    return linhas, periodos, ativo, mes_saida
+
+
+def projetar_salarios(dados, ano, mes, calendario, tabela_irs=None, meses=12):
+    """Projeção de `meses` meses a partir de ano/mês: um DataFrame longo (colaborador, mês), valores em cêntimos
+
+    `calendario` é um CalendarioUteis que cubra todos os meses da projeção.
+    Os meses depois da saída do colaborador não aparecem.
+    """
+    linhas, periodos, ativo, mes_saida = montar_projecao(dados, ano, mes, calendario, meses)
+    calculo = processar_calculo_lote_centimos(linhas, tabela_irs)
+
+    resultado = pd.DataFrame({
+        'Nome Completo': linhas['Nome Completo'],
+        'Secção': linhas['Secção'],
+        'Mês': np.tile(periodos.astype(str), len(dados)),
+        'Saída': mes_saida.ravel()
+    })
+    resultado = pd.concat([resultado, calculo[COLUNAS_MONETARIAS]], axis=1)
+    return resultado[ativo.ravel()].reset_index(drop=True)
@@ -0,0 +1,147 @@
+"""
+Resultados salariais incrementais - um resultado por (empresa, ano, mês, colaborador)
+
+Cada resultado depende de entradas declaradas: a linha do colaborador no
+DataFrame de entrada (campos da aba Colaboradores, faltas/baixas e extras do
+mês já somados, dias úteis) e o contexto do período - tabela IRS e conjunto
+de feriados. Cada linha de entrada fica guardada com a sua impressão (hash).
+
+- Uma alteração marca como sujos só os colaboradores afetados, e o cálculo
+  seguinte relê e recalcula apenas esses.
+- Quando o Excel muda de revisão, todas as entradas são relidas, mas só as
+  linhas com impressão diferente voltam a ser calculadas.
+- Quando o contexto muda, o período é recalculado por inteiro.
+
+Os totais da empresa são somas corridas em cêntimos: ao recalcular um
+colaborador subtrai-se o resultado antigo e soma-se o novo.
+"""
+
+import numpy as np
+import pandas as pd
+
+from processamento_salarial.calculations.processamento_lote import COLUNAS_MONETARIAS, processar_calculo_lote_centimos
+
+
+class PeriodoSalarial:
+    """Um (empresa, ano, mês): uma linha por colaborador em arrays NumPy (entradas + resultados em cêntimos)
+
+    As linhas nunca mudam de posição: um colaborador recalculado é escrito no
+    mesmo sítio e um que sai fica só marcado como inativo.
+    """
+
+    def __init__(self, contexto):
+        self.contexto = contexto
+        self.revisao = None
+        self.nomes = []
+        self.posicoes = {}
+        self.colunas = {}
+        self.ativos = np.zeros(0, dtype=bool)
+        self.impressoes = np.zeros(0, dtype=np.uint64)
+        self.totais = np.zeros(len(COLUNAS_MONETARIAS), dtype=np.int64)
+        self.sujos = set()
+
+    def _valores(self, posicoes):
+        return np.array([self.colunas[coluna][posicoes].sum() for coluna in COLUNAS_MONETARIAS], dtype=np.int64)
+
+    def remover(self, nomes):
+        posicoes = [self.posicoes[nome] for nome in nomes]
+        self.totais -= self._valores(posicoes)
+        self.ativos[posicoes] = False
+
+    def gravar(self, registos, impressoes):
+        """Escreve as linhas de `registos` (índice = colaborador) e acerta os totais"""
+        anteriores = [self.posicoes[nome] for nome in registos.index
+                      if nome in self.posicoes and self.ativos[self.posicoes[nome]]]
+        if anteriores:
+            self.totais -= self._valores(anteriores)
+
+        novos = [nome for nome in registos.index if nome not in self.posicoes]
+        if novos:
+            self.posicoes.update((nome, len(self.nomes) + i) for i, nome in enumerate(novos))
+            self.nomes.extend(novos)
+            tamanho = len(self.nomes)
+            for coluna in registos.columns:
+                atual = self.colunas.get(coluna, np.empty(0, dtype=registos[coluna].to_numpy().dtype))
+                self.colunas[coluna] = np.concatenate([atual, np.empty(tamanho - len(atual), dtype=atual.dtype)])
+            self.ativos = np.concatenate([self.ativos, np.zeros(len(novos), dtype=bool)])
+            self.impressoes = np.concatenate([self.impressoes, np.zeros(len(novos), dtype=np.uint64)])
+
+        posicoes = np.array([self.posicoes[nome] for nome in registos.index], dtype=np.int64)
+        for coluna in registos.columns:
+            self.colunas[coluna][posicoes] = registos[coluna].to_numpy()
+        self.ativos[posicoes] = True
+        self.impressoes[posicoes] = impressoes
+        self.totais += registos[COLUNAS_MONETARIAS].to_numpy().sum(axis=0)
+
+
+class ResultadosIncrementais:
+    """Resultados salariais por período, recalculados só onde as entradas mudaram"""
+
+    def __init__(self):
+        self._periodos = {}
+
+    def calculado(self, empresa, ano, mes):
+        return (empresa, ano, mes) in self._periodos
+
+    def pendentes(self, empresa, ano, mes, tabela_irs, feriados, revisao):
+        """Colaboradores a reler (conjunto vazio = nada a fazer), ou None para reler todas as entradas"""
+        periodo = self._periodos.get((empresa, ano, mes))
+        if periodo is None or periodo.contexto != (tabela_irs, feriados) or periodo.revisao != revisao:
+            return None
+        return set(periodo.sujos)
+
+    def marcar_sujo(self, empresa, ano=None, mes=None, colaborador=None):
+        """Marca como sujos os resultados de um colaborador (ou de todos) num mês (ou em todos os da empresa)"""
+        for (emp, a, m), periodo in self._periodos.items():
+            if emp != empresa or ano not in (None, a) or mes not in (None, m):
+                continue
+            if colaborador is None:
+                periodo.revisao = None
+            else:
+                periodo.sujos.add(colaborador)
+
+    def atualizar(self, empresa, ano, mes, entradas, tabela_irs, feriados, revisao, colaboradores=None):
+        """Aplica as entradas relidas (índice = colaborador) e recalcula só as alteradas; devolve quantas
+
+        `colaboradores` são os que foram relidos (None = todos): os que não
+        vierem em `entradas` saíram do período (ex.: passaram a inativos).
+        """
+        chave = (empresa, ano, mes)
+        periodo = self._periodos.get(chave)
+        if periodo is None or periodo.contexto != (tabela_irs, feriados):
+            periodo = self._periodos[chave] = PeriodoSalarial((tabela_irs, feriados))
+
+        impressoes = pd.util.hash_pandas_object(entradas, index=True).to_numpy()
+        alteradas = []
+        for i, nome in enumerate(entradas.index):
+            posicao = periodo.posicoes.get(nome)
+            if posicao is None or not periodo.ativos[posicao] or periodo.impressoes[posicao] != impressoes[i]:
+                alteradas.append(i)
+
+        relidos = periodo.posicoes if colaboradores is None else colaboradores
+        presentes = set(entradas.index)
+        saidas = [nome for nome in relidos
+                  if nome in periodo.posicoes and periodo.ativos[periodo.posicoes[nome]] and nome not in presentes]
+        if saidas:
+            periodo.remover(saidas)
+
+        if alteradas:
+            linhas = entradas.iloc[alteradas]
+            novos = processar_calculo_lote_centimos(linhas, tabela_irs)
+            periodo.gravar(pd.concat([linhas.drop(columns=linhas.columns.intersection(novos.columns)), novos], axis=1),
+                           impressoes[alteradas])
+
+        periodo.revisao = revisao
+        periodo.sujos.clear()
+        return len(alteradas)
+
+    def resultados(self, empresa, ano, mes):
+        """Entradas + colunas do cálculo (em cêntimos), uma linha por colaborador, com 'Nome Completo'"""
+        periodo = self._periodos[(empresa, ano, mes)]
+        df = pd.DataFrame({coluna: valores[periodo.ativos] for coluna, valores in periodo.colunas.items()})
+        df.insert(0, 'Nome Completo', np.array(periodo.nomes, dtype=object)[periodo.ativos])
+        return df
+
+    def totais(self, empresa, ano, mes):
+        """Totais da empresa no mês, em cêntimos (Series por coluna monetária)"""
+        return pd.Series(self._periodos[(empresa, ano, mes)].totais, index=COLUNAS_MONETARIAS)
@@ -0,0 +1,102 @@
+"""
+Simulação salarial - cenários de alteração de salários aplicados em memória
+
+Um cenário é uma lista de alterações ao Salário Bruto, aplicadas por ordem:
+percentagem, valor absoluto ou mínimo (o salário mínimo, proporcional às horas
+semanais), a todos os colaboradores ou só a uma Categoria Profissional/Secção.
+Todos os cenários e colaboradores são calculados numa única chamada ao cálculo
+em lote: o mês tal como está e, para o custo anual, a projeção dos 12 meses
+seguintes (ver projecao.py: sem faltas nem extras, subsídios nos meses de
+pagamento e saídas pela Data Rescisão). Nada é gravado.
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from processamento_salarial.calculations.dinheiro import em_euros, para_centimos
+from processamento_salarial.calculations.processamento_lote import processar_calculo_lote_centimos
+from processamento_salarial.calculations.projecao import montar_projecao
+
+
+TIPOS_ALTERACAO = ("Percentagem", "Valor", "Salário mínimo")
+CAMPOS_GRUPO = ("Categoria Profissional", "Secção")
+HORAS_SEMANA_COMPLETA = 40
+CENARIO_ATUAL = "Atual"
+MESES_CUSTO_ANUAL = 12
+
+
+@dataclass
+class AlteracaoSalarial:
+    """Uma alteração ao Salário Bruto; com `campo`, só para os colaboradores com `grupo` nesse campo"""
+    tipo: str
+    valor: float
+    campo: str = None
+    grupo: str = None
+
+    def abrangidos(self, dados):
+        if self.campo is None:
+            return np.ones(len(dados), dtype=bool)
+        return (dados[self.campo] == self.grupo).to_numpy()
+
+    def aplicar(self, salarios, dados):
+        if self.tipo == "Percentagem":
+            novos = salarios * (1 + self.valor / 100)
+        elif self.tipo == "Valor":
+            novos = salarios + self.valor
+        elif self.tipo == "Salário mínimo":
+            horas = dados['horas_semana'].to_numpy(dtype=float)
+            novos = np.maximum(salarios, self.valor * np.minimum(horas / HORAS_SEMANA_COMPLETA, 1))
+        else:
+            raise ValueError(f"Tipo de alteração desconhecido: {self.tipo}")
+        return np.where(self.abrangidos(dados), em_euros(para_centimos(novos)), salarios)
+
+
+def aplicar_cenarios(dados, cenarios):
+    """Matriz (cenário, colaborador) de salários: a primeira linha é a atual, depois uma por cenário"""
+    atuais = dados['salario_bruto'].to_numpy(dtype=float)
+    salarios = np.tile(atuais, (len(cenarios) + 1, 1))
+    for linha, alteracoes in enumerate(cenarios.values(), start=1):
+        for alteracao in alteracoes:
+            salarios[linha] = alteracao.aplicar(salarios[linha], dados)
+    return salarios
+
+
+def simular_cenarios(dados, cenarios, ano, mes, calendario, tabela_irs=None):
+    """Cálculo de todos os cenários (dict nome -> alterações) para as linhas de `dados` (preparar_dados_lote)
+
+    Devolve um DataFrame longo, uma linha por (cenário, colaborador), com o
+    salário simulado e, em cêntimos, as colunas do mês e o custo anual (os 12
+    meses a partir de ano/mês; `calendario` tem de os cobrir).
+    """
+    nomes = [CENARIO_ATUAL] + list(cenarios)
+    salarios = aplicar_cenarios(dados, cenarios)
+    n = len(dados)
+
+    # Mês real repetido por cenário (cenário, colaborador), seguido da projeção de cada um (cenário, colaborador, mês)
+    reais = dados.iloc[np.tile(np.arange(n), len(nomes))].reset_index(drop=True)
+    reais['salario_bruto'] = salarios.ravel()
+    projecao, _, ativo, _ = montar_projecao(reais, ano, mes, calendario, MESES_CUSTO_ANUAL)
+    todos = pd.concat([reais.assign(sub_ferias_fracao=1.0, sub_natal_fracao=1.0), projecao], ignore_index=True)
+
+    calculo = processar_calculo_lote_centimos(todos, tabela_irs)
+    resultado = calculo.iloc[:len(reais)].reset_index(drop=True)
+    custo_mensal = calculo['custo_empresa'].to_numpy()[len(reais):].reshape(ativo.shape)
+    resultado['custo_anual'] = np.where(ativo, custo_mensal, 0).sum(axis=1)
+
+    resultado.insert(0, 'Cenário', np.repeat(nomes, n))
+    resultado.insert(1, 'Nome Completo', reais['Nome Completo'].to_numpy())
+    for campo in CAMPOS_GRUPO:
+        resultado.insert(2, campo, reais[campo].to_numpy())
+    resultado.insert(4, 'salario_atual', np.tile(salarios[0], len(nomes)))
+    resultado.insert(5, 'salario_simulado', salarios.ravel())
+    return resultado
+
+
+def resumo_cenarios(resultado, colunas):
+    """Totais por cenário (cêntimos) e diferenças para o cenário atual"""
+    totais = resultado.groupby('Cenário', sort=False)[colunas].sum()
+    abrangidos = (resultado['salario_simulado'] != resultado['salario_atual']).groupby(resultado['Cenário'], sort=False).sum()
+    diferencas = totais - totais.loc[CENARIO_ATUAL]
+    return totais, diferencas, abrangidos
@@ -0,0 +1,280 @@
+"""
+Tabelas de retenção na fonte de IRS - leitura do Excel oficial e cálculo vetorial
+
+Cada aba do Excel é uma tabela (ex.: "Não casado sem dependentes ou casado dois
+titulares", "Casado único titular - deficiência"): a situação sai do nome da aba
+e do título por cima do cabeçalho. São aceites os dois formatos das tabelas:
+
+- atual: "Remuneração mensal até" | "Taxa marginal máxima" | "Parcela a abater"
+  | "Parcela a abater por dependente", com a parcela dos primeiros escalões dada
+  por fórmula ("0,1250 × 2,6 × (1 135,39 - R)");
+- antigo: "Remuneração mensal até" e uma coluna de taxa por nº de dependentes
+  (0, 1, 2, ..., "5 ou mais").
+
+Cada tabela fica compilada em arrays NumPy ordenados pelo limite do escalão;
+o escalão de cada remuneração é encontrado com searchsorted, para uma coluna
+inteira de remunerações de uma vez.
+"""
+
+import math
+import re
+import unicodedata
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+
+ESTADOS_CIVIS = ("Solteiro", "Casado Único Titular", "Casado Dois Titulares")
+
+_NUMERO = re.compile(r"\d{1,3}(?:[ \u00a0.]\d{3})+(?:,\d+)?|\d+(?:[,.]\d+)?")
+
+
+def _normalizar_texto(valor):
+    texto = unicodedata.normalize("NFKD", str(valor)).encode("ascii", "ignore").decode()
+    return " ".join(texto.lower().split())
+
+
+def _vazio(valor):
+    return valor is None or (isinstance(valor, float) and math.isnan(valor)) or str(valor).strip() == ""
+
+
+def _ler_numero(texto):
+    """Número num texto em formato português ("1 135,39", "13,25") ou None"""
+    encontrados = _NUMERO.findall(str(texto))
+    if not encontrados:
+        return None
+    numero = encontrados[0].replace("\u00a0", "").replace(" ", "")
+    if "," in numero or re.fullmatch(r"\d{1,3}(\.\d{3})+", numero):
+        numero = numero.replace(".", "").replace(",", ".")
+    return float(numero)
+
+
+def _ler_valor(valor):
+    if isinstance(valor, (int, float, np.number)) and not _vazio(valor):
+        return float(valor)
+    if _vazio(valor):
+        return None
+    return _ler_numero(valor)
+
+
+def _ler_taxa(valor):
+    """Taxa como fração: 0.1325, 13.25 e "13,25%" dão todos 0.1325"""
+    numero = _ler_valor(valor)
+    if numero is None:
+        return None
+    if (isinstance(valor, str) and "%" in valor) or numero > 1:
+        return numero / 100
+    return numero
+
+
+def _ler_parcela(valor):
+    """(parte fixa, coeficiente de R) da parcela a abater: fixa + coeficiente × R
+
+    Uma fórmula "a × b × (L - R)" dá a·b·L - a·b·R; um fator com "%" ("13,00%")
+    conta como percentagem. O produto a·b é uma taxa: acima de 1 a fórmula é
+    recusada (lança ValueError).
+    """
+    if _vazio(valor):
+        return 0.0, 0.0
+    if isinstance(valor, (int, float, np.number)):
+        return float(valor), 0.0
+
+    texto = str(valor)
+    if "R" not in texto.upper().replace("EUR", ""):
+        numero = _ler_numero(texto)
+        return (numero or 0.0), 0.0
+
+    texto_numeros = texto.replace("\u00a0", " ")
+    numeros = [
+        _ler_numero(n.group()) / (100 if texto_numeros[n.end():].lstrip().startswith("%") else 1)
+        for n in _NUMERO.finditer(texto_numeros)
+    ]
+    if len(numeros) < 2:
+        raise ValueError(f"Parcela a abater não reconhecida: {texto}")
+    fator = float(np.prod(numeros[:-1]))
+    if fator > 1:
+        raise ValueError(f"Parcela a abater com fator {fator:g} acima de 100%: {texto}")
+    return fator * numeros[-1], -fator
+
+
+@dataclass
+class TabelaRetencao:
+    """Uma tabela compilada: escalões ordenados e uma coluna de taxas/parcelas por nº de dependentes"""
+    nome: str
+    limites: np.ndarray
+    taxas: np.ndarray
+    parcelas_fixas: np.ndarray
+    coeficientes_parcela: np.ndarray
+    parcela_dependente: np.ndarray
+
+    def reter(self, base, dependentes):
+        """Retenção para arrays de remunerações e nºs de dependentes (nunca negativa)"""
+        escalao = np.minimum(np.searchsorted(self.limites, base, side="left"), len(self.limites) - 1)
+        coluna = np.minimum(dependentes, self.taxas.shape[1] - 1)
+        valor = (base * (self.taxas[escalao, coluna] - self.coeficientes_parcela[escalao, coluna])
+                 - self.parcelas_fixas[escalao, coluna] - self.parcela_dependente[escalao] * dependentes)
+        return np.maximum(valor, 0.0)
+
+    def como_dataframe(self):
+        """Escalões para mostrar na interface"""
+        dados = {"Remuneração Até": self.limites}
+        for coluna in range(self.taxas.shape[1]):
+            sufixo = f" ({coluna}{'+' if coluna == self.taxas.shape[1] - 1 and coluna else ''} dep.)" if self.taxas.shape[1] > 1 else ""
+            dados[f"Taxa{sufixo}"] = self.taxas[:, coluna]
+            dados[f"Parcela Fixa{sufixo}"] = self.parcelas_fixas[:, coluna]
+            dados[f"Parcela × R{sufixo}"] = self.coeficientes_parcela[:, coluna]
+        dados["Parcela por Dependente"] = self.parcela_dependente
+        return pd.DataFrame(dados)
+
+
+def _situacoes_do_titulo(titulo):
+    """Situações (estado civil, deficiência, com dependentes) cobertas por uma tabela, pelo título"""
+    texto = _normalizar_texto(titulo).replace("um ou mais", "1+")
+    deficiencia = "deficien" in texto and "sem deficien" not in texto
+    dependencias = {"com": (True,), "sem": (False,)}
+
+    situacoes = set()
+    for clausula in re.split(r"\bou\b", texto):
+        condicao = (False, True)
+        for prefixo, valores in dependencias.items():
+            if re.search(rf"\b{prefixo} (1\+ |)dependentes?", clausula):
+                condicao = valores
+
+        estados = []
+        if "unico titular" in clausula:
+            estados.append("Casado Único Titular")
+        if "dois titulares" in clausula:
+            estados.append("Casado Dois Titulares")
+        if "nao casado" in clausula or "solteiro" in clausula:
+            estados.append("Solteiro")
+
+        for estado in estados:
+            for com_dependentes in condicao:
+                situacoes.add((estado, deficiencia, com_dependentes))
+    return situacoes
+
+
+def _compilar_aba(nome_aba, linhas):
+    """TabelaRetencao e situações de uma aba (linhas em bruto), ou (None, motivo)"""
+    cabecalho = next((i for i, linha in enumerate(linhas)
+                      if any("remunera" in _normalizar_texto(v) for v in linha if not _vazio(v))), None)
+    if cabecalho is None:
+        return None, "sem coluna 'Remuneração'"
+
+    titulo = " ".join([nome_aba] + [str(v) for linha in linhas[:cabecalho] for v in linha if not _vazio(v)])
+    situacoes = _situacoes_do_titulo(titulo)
+    if not situacoes:
+        return None, "situação (estado civil) não reconhecida no título"
+
+    nomes = [_normalizar_texto(v) if not _vazio(v) else "" for v in linhas[cabecalho]]
+    col_limite = next(i for i, n in enumerate(nomes) if "remunera" in n)
+    col_taxa = next((i for i, n in enumerate(nomes) if "taxa" in n), None)
+    col_parcela = next((i for i, n in enumerate(nomes) if "parcela" in n and "dependente" not in n), None)
+    col_dependente = next((i for i, n in enumerate(nomes) if "parcela" in n and "dependente" in n), None)
+
+    # Formato antigo: uma coluna de taxa por nº de dependentes (no cabeçalho ou na linha seguinte)
+    colunas_dependentes = []
+    inicio = cabecalho + 1
+    if col_taxa is None:
+        for linha_dep in (cabecalho, cabecalho + 1):
+            if linha_dep >= len(linhas):
+                break
+            candidatas = [(int(_ler_numero(v)), i) for i, v in enumerate(linhas[linha_dep])
+                          if i != col_limite and not _vazio(v) and _ler_numero(v) is not None
+                          and re.fullmatch(r"\d+(\.0)?( ou mais|\+)?", _normalizar_texto(v))]
+            # 0, 1, 2, ... seguidos (uma linha de taxas a 0% não conta)
+            if len(candidatas) > 1 and sorted(n for n, _ in candidatas) == list(range(len(candidatas))):
+                colunas_dependentes = [i for _, i in sorted(candidatas)]
+                inicio = linha_dep + 1
+                break
+        if not colunas_dependentes:
+            return None, "sem coluna de taxa"
+    else:
+        colunas_dependentes = [col_taxa]
+
+    escaloes = []
+    for linha in linhas[inicio:]:
+        if all(_vazio(v) for v in linha):
+            continue
+        taxas = [_ler_taxa(linha[i]) if i < len(linha) else None for i in colunas_dependentes]
+        if any(t is None for t in taxas):
+            continue
+        limite = _ler_valor(linha[col_limite]) if col_limite < len(linha) else None
+        if limite is None or "superior" in _normalizar_texto(linha[col_limite]):
+            limite = math.inf
+
+        parcela = _ler_parcela(linha[col_parcela]) if col_parcela is not None else (0.0, 0.0)
+        por_dependente = _ler_valor(linha[col_dependente]) if col_dependente is not None else None
+        escaloes.append((limite, taxas, parcela, por_dependente or 0.0))
+
+    if not escaloes:
+        return None, "sem escalões"
+
+    escaloes.sort(key=lambda e: e[0])
+    limites = np.array([e[0] for e in escaloes])
+    if np.any(np.diff(limites) <= 0):
+        return None, "limites de escalão repetidos"
+
+    colunas = len(colunas_dependentes)
+    tabela = TabelaRetencao(
+        nome=nome_aba,
+        limites=limites,
+        taxas=np.array([e[1] for e in escaloes], dtype=float),
+        parcelas_fixas=np.array([[e[2][0]] * colunas for e in escaloes], dtype=float),
+        coeficientes_parcela=np.array([[e[2][1]] * colunas for e in escaloes], dtype=float),
+        parcela_dependente=np.array([e[3] for e in escaloes], dtype=float)
+    )
+    return tabela, situacoes
+
+
+class TabelaIRS:
+    """Conjunto de tabelas de retenção compiladas, com a tabela de cada situação"""
+
+    def __init__(self, tabelas, situacoes, ignoradas):
+        self.tabelas = tabelas
+        self.situacoes = situacoes
+        self.ignoradas = ignoradas
+
+    def tabela_para(self, estado_civil, tem_deficiencia, num_dependentes):
+        nome = self.situacoes.get((estado_civil, bool(tem_deficiencia), num_dependentes > 0))
+        return self.tabelas.get(nome)
+
+    def calcular(self, base_incidencia, estado_civil, num_dependentes, tem_deficiencia=False):
+        """Retenção para escalares ou arrays; NaN onde nenhuma tabela cobre a situação"""
+        base, estado, dependentes, deficiencia = np.broadcast_arrays(
+            np.asarray(base_incidencia, dtype=float),
+            np.asarray(estado_civil, dtype=object),
+            np.asarray(num_dependentes, dtype=int),
+            np.asarray(tem_deficiencia, dtype=bool)
+        )
+        resultado = np.full(base.shape, np.nan)
+
+        for (estado_sit, deficiencia_sit, com_dependentes), nome in self.situacoes.items():
+            linhas = (estado == estado_sit) & (deficiencia == deficiencia_sit) & ((dependentes > 0) == com_dependentes)
+            if linhas.any():
+                resultado[linhas] = self.tabelas[nome].reter(base[linhas], dependentes[linhas])
+
+        return resultado if resultado.ndim else float(resultado)
+
+
+def compilar_tabela_irs(conteudo):
+    """TabelaIRS a partir do Excel (bytes); abas que não são tabelas de retenção ficam em `ignoradas`"""
+    abas = pd.read_excel(BytesIO(conteudo), sheet_name=None, header=None, dtype=object)
+
+    tabelas, situacoes, ignoradas = {}, {}, {}
+    for nome_aba, df in abas.items():
+        tabela, resultado = _compilar_aba(nome_aba, df.values.tolist())
+        if tabela is None:
+            ignoradas[nome_aba] = resultado
+            continue
+        tabelas[nome_aba] = tabela
+        for situacao in resultado:
+            # Com duas abas para a mesma situação fica a primeira
+            situacoes.setdefault(situacao, nome_aba)
+
+    if not tabelas:
+        raise ValueError("Nenhuma tabela de retenção reconhecida: " +
+                         "; ".join(f"{aba}: {motivo}" for aba, motivo in ignoradas.items()))
+    return TabelaIRS(tabelas, situacoes, ignoradas)
@@ -0,0 +1,395 @@
+"""
+Armazenamento - interface de ficheiros remotos (Dropbox ou pasta local)
+
+A aplicação só precisa de: metadados, download, upload condicionado à revisão,
+criação de pastas e listagem de pastas. ArmazenamentoDropbox fala com a API;
+ArmazenamentoLocal guarda tudo numa pasta do disco, com revisões simuladas e
+latência configurável, para medir o caminho de I/O sem rede nem credenciais.
+"""
+
+import hashlib
+import os
+import random
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+import dropbox
+
+
+TAMANHO_BLOCO_HASH = 4 * 1024 * 1024
+
+
+class ConflitoRevisao(Exception):
+    """O ficheiro mudou desde a revisão que foi descarregada"""
+    pass
+
+
+class FicheiroNaoEncontrado(Exception):
+    """O caminho não existe no armazenamento"""
+    pass
+
+
+class ConteudoDivergente(Exception):
+    """O content_hash devolvido pelo armazenamento não corresponde aos bytes enviados/recebidos"""
+    pass
+
+
+@dataclass
+class MetadadosFicheiro:
+    caminho: str
+    rev: str
+    content_hash: str
+    tamanho: int
+
+
+def calcular_content_hash(conteudo):
+    """content_hash no formato da Dropbox: SHA-256 da concatenação dos SHA-256 de cada bloco de 4 MB"""
+    blocos = b"".join(
+        hashlib.sha256(conteudo[inicio:inicio + TAMANHO_BLOCO_HASH]).digest()
+        for inicio in range(0, len(conteudo), TAMANHO_BLOCO_HASH)
+    )
+    return hashlib.sha256(blocos).hexdigest()
+
+
+def verificar_content_hash(metadados, conteudo):
+    """Lança ConteudoDivergente se o content_hash dos metadados não for o dos bytes"""
+    calculado = calcular_content_hash(conteudo)
+    if metadados.content_hash != calculado:
+        raise ConteudoDivergente(
+            f"{metadados.caminho} (rev {metadados.rev}): content_hash {metadados.content_hash} != {calculado} calculado localmente"
+        )
+
+
+class Armazenamento(ABC):
+    """Interface comum; os caminhos usam sempre o formato da Dropbox ("/pasta/ficheiro")"""
+
+    @abstractmethod
+    def obter_metadados(self, caminho):
+        """MetadadosFicheiro do ficheiro (lança FicheiroNaoEncontrado)"""
+
+    @abstractmethod
+    def descarregar(self, caminho, rev=None):
+        """(MetadadosFicheiro, bytes) da revisão indicada ou da atual"""
+
+    @abstractmethod
+    def enviar(self, caminho, conteudo, rev=None, novo=False, progresso=None, sessoes=None):
+        """Grava o ficheiro; com `rev` só grava se essa ainda for a revisão atual (senão ConflitoRevisao)
+
+        Com `novo=True` só grava se o ficheiro ainda não existir (senão ConflitoRevisao).
+        Se o ficheiro gravado não tiver o content_hash dos bytes enviados, lança ConteudoDivergente.
+
+        `progresso(enviados, total)` é chamado durante uploads longos; `sessoes` é um
+        dicionário onde uploads interrompidos podem guardar o estado para retomar.
+        """
+
+    @abstractmethod
+    def criar_pastas(self, caminhos):
+        """Cria as pastas indicadas (e as intermédias); pastas já existentes não são erro"""
+
+    @abstractmethod
+    def listar_pastas(self, caminho, recursivo=True):
+        """Conjunto (em minúsculas) com a pasta e as subpastas (lança FicheiroNaoEncontrado)"""
+
+
+class ArmazenamentoDropbox(Armazenamento):
+    """Armazenamento na Dropbox; uploads grandes vão por sessão de upload em blocos
+
+    As repetições em falhas de rede e limites de pedidos ficam só no cliente
+    (ClienteDropboxResiliente), chamada a chamada; aqui só se corrigem offsets de blocos.
+    """
+
+    def __init__(self, dbx, limiar_sessao=8 * 1024 * 1024, tamanho_bloco=4 * 1024 * 1024,
+                 max_tentativas_bloco=5):
+        self.dbx = dbx
+        self.limiar_sessao = limiar_sessao
+        self.tamanho_bloco = tamanho_bloco
+        self.max_tentativas_bloco = max_tentativas_bloco
+
+    @staticmethod
+    def _metadados(metadata):
+        return MetadadosFicheiro(metadata.path_display, metadata.rev, metadata.content_hash, metadata.size)
+
+    @staticmethod
+    def _is_nao_encontrado(erro):
+        motivo = erro.error
+        return motivo.is_path() and motivo.get_path().is_not_found()
+
+    @staticmethod
+    def _is_conflito(erro):
+        if isinstance(erro.error, dropbox.files.UploadError):
+            return erro.error.is_path() and erro.error.get_path().reason.is_conflict()
+        if isinstance(erro.error, dropbox.files.UploadSessionFinishError):
+            return erro.error.is_path() and erro.error.get_path().is_conflict()
+        return False
+
+    @staticmethod
+    def _offset_correto(erro):
+        """Se a Dropbox rejeitou um bloco por offset errado, devolve o offset em que a sessão realmente vai"""
+        motivo = erro.error
+        if isinstance(motivo, dropbox.files.UploadSessionFinishError):
+            if not motivo.is_lookup_failed():
+                return None
+            motivo = motivo.get_lookup_failed()
+        if hasattr(motivo, "is_incorrect_offset") and motivo.is_incorrect_offset():
+            return motivo.get_incorrect_offset().correct_offset
+        return None
+
+    def obter_metadados(self, caminho):
+        try:
+            return self._metadados(self.dbx.files_get_metadata(caminho))
+        except dropbox.exceptions.ApiError as e:
+            if self._is_nao_encontrado(e):
+                raise FicheiroNaoEncontrado(caminho) from e
+            raise
+
+    def descarregar(self, caminho, rev=None):
+        metadata, resposta = self.dbx.files_download(caminho, rev=rev)
+        metadados = self._metadados(metadata)
+        verificar_content_hash(metadados, resposta.content)
+        return metadados, resposta.content
+
+    def enviar(self, caminho, conteudo, rev=None, novo=False, progresso=None, sessoes=None):
+        if rev:
+            modo = dropbox.files.WriteMode.update(rev)
+        elif novo:
+            modo = dropbox.files.WriteMode.add
+        else:
+            modo = dropbox.files.WriteMode.overwrite
+        try:
+            if len(conteudo) <= self.limiar_sessao:
+                metadata = self.dbx.files_upload(conteudo, caminho, mode=modo)
+            else:
+                metadata = self._enviar_por_sessao(caminho, conteudo, rev, modo, progresso,
+                                                   sessoes if sessoes is not None else {})
+        except dropbox.exceptions.ApiError as e:
+            if self._is_conflito(e):
+                # Uma tentativa repetida pelo cliente pode ter sido gravada sem a resposta ter chegado
+                gravado = self._ja_gravado(caminho, conteudo)
+                if gravado is not None:
+                    return gravado
+                raise ConflitoRevisao(f"Revisão {rev} já não é a atual" if rev else f"{caminho} já existe") from e
+            raise
+
+        # A Dropbox devolve o content_hash do que ficou gravado: tem de ser o dos bytes enviados
+        metadados = self._metadados(metadata)
+        verificar_content_hash(metadados, conteudo)
+        return metadados
+
+    def _ja_gravado(self, caminho, conteudo):
+        """Metadados do ficheiro atual se já tiver exatamente este conteúdo, senão None"""
+        try:
+            metadados = self.obter_metadados(caminho)
+        except FicheiroNaoEncontrado:
+            return None
+        return metadados if metadados.content_hash == calcular_content_hash(conteudo) else None
+
+    def _enviar_por_sessao(self, caminho, conteudo, rev, modo, progresso, sessoes):
+        """files_upload_session_start/append/finish; o estado fica em `sessoes` para retomar depois de uma falha
+
+        Uma sessão por caminho e revisão: só é retomada se os bytes já enviados forem
+        os mesmos (senão o ficheiro final misturaria duas versões); as sessões do mesmo
+        caminho para outras revisões já não podem ser concluídas e são descartadas.
+        """
+        total = len(conteudo)
+        prefixo = f"{caminho.lower()}:"
+        chave = f"{prefixo}{rev or '-'}"
+        for antiga in [c for c in sessoes if c.startswith(prefixo) and c != chave]:
+            sessoes.pop(antiga)
+
+        sessao = sessoes.get(chave)
+        if sessao is not None and hashlib.sha256(conteudo[:sessao["offset"]]).hexdigest() != sessao.get("hash_enviado"):
+            sessoes.pop(chave)
+            sessao = None
+        falhas = 0
+
+        try:
+            while True:
+                try:
+                    if sessao is None:
+                        bloco = conteudo[:self.tamanho_bloco]
+                        resultado = self.dbx.files_upload_session_start(bloco)
+                        sessao = {"session_id": resultado.session_id, "offset": len(bloco)}
+                        sessoes[chave] = sessao
+                    else:
+                        cursor = dropbox.files.UploadSessionCursor(session_id=sessao["session_id"], offset=sessao["offset"])
+                        bloco = conteudo[sessao["offset"]:sessao["offset"] + self.tamanho_bloco]
+
+                        if sessao["offset"] + len(bloco) >= total:
+                            commit = dropbox.files.CommitInfo(path=caminho, mode=modo)
+                            metadata = self.dbx.files_upload_session_finish(bloco, cursor, commit)
+                            sessoes.pop(chave, None)
+                            return metadata
+
+                        self.dbx.files_upload_session_append_v2(bloco, cursor)
+                        sessao["offset"] += len(bloco)
+
+                    falhas = 0
+                    if progresso is not None:
+                        progresso(sessao["offset"], total)
+
+                except dropbox.exceptions.ApiError as e:
+                    offset_correto = self._offset_correto(e) if sessao is not None else None
+                    falhas += 1
+                    if offset_correto is None or falhas >= self.max_tentativas_bloco:
+                        # Sessão inválida, expirada ou commit recusado (ex.: conflito): recomeça do zero na próxima vez
+                        sessoes.pop(chave, None)
+                        raise
+                    sessao["offset"] = offset_correto
+        finally:
+            # Interrompido a meio (falha de rede, script parado): guarda o hash do que já foi enviado para validar a retoma
+            if chave in sessoes:
+                sessoes[chave]["hash_enviado"] = hashlib.sha256(conteudo[:sessoes[chave]["offset"]]).hexdigest()
+
+    def criar_pastas(self, caminhos):
+        lancamento = self.dbx.files_create_folder_batch(list(caminhos))
+        if lancamento.is_async_job_id():
+            estado = self.dbx.files_create_folder_batch_check(lancamento.get_async_job_id())
+            while estado.is_in_progress():
+                time.sleep(0.5)
+                estado = self.dbx.files_create_folder_batch_check(lancamento.get_async_job_id())
+            if estado.is_failed():
+                raise Exception(estado.get_failed())
+            entradas = estado.get_complete().entries
+        else:
+            entradas = lancamento.get_complete().entries
+
+        for entrada in entradas:
+            if entrada.is_failure():
+                erro = entrada.get_failure()
+                # Criada entretanto por outra sessão
+                if not (erro.is_path() and erro.get_path().is_conflict()):
+                    raise Exception(erro)
+
+    def listar_pastas(self, caminho, recursivo=True):
+        try:
+            resultado = self.dbx.files_list_folder(caminho, recursive=recursivo)
+        except dropbox.exceptions.ApiError as e:
+            if self._is_nao_encontrado(e):
+                raise FicheiroNaoEncontrado(caminho) from e
+            raise
+
+        pastas = {caminho.lower()}
+        while True:
+            for entrada in resultado.entries:
+                if isinstance(entrada, dropbox.files.FolderMetadata):
+                    pastas.add(entrada.path_lower)
+            if not resultado.has_more:
+                return pastas
+            resultado = self.dbx.files_list_folder_continue(resultado.cursor)
+
+
+class ArmazenamentoLocal(Armazenamento):
+    """Armazenamento numa pasta local, com revisões simuladas e latência artificial por chamada
+
+    Como na Dropbox, os caminhos não distinguem maiúsculas de minúsculas e as
+    revisões anteriores de cada ficheiro continuam disponíveis para download.
+    """
+
+    def __init__(self, pasta_raiz, latencia=0.0):
+        self.pasta_raiz = pasta_raiz
+        self.latencia = latencia
+        os.makedirs(pasta_raiz, exist_ok=True)
+
+    def _esperar(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def _caminho_local(self, caminho):
+        partes = [parte for parte in caminho.lower().split("/") if parte]
+        return os.path.join(self.pasta_raiz, *partes)
+
+    def _caminho_revisoes(self, caminho):
+        local = self._caminho_local(caminho)
+        return os.path.join(os.path.dirname(local), ".revisoes", os.path.basename(local))
+
+    def _rev_atual(self, caminho):
+        try:
+            with open(os.path.join(self._caminho_revisoes(caminho), "atual"), encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            raise FicheiroNaoEncontrado(caminho)
+
+    def _ler_revisao(self, caminho, rev):
+        try:
+            with open(os.path.join(self._caminho_revisoes(caminho), rev), "rb") as f:
+                return f.read()
+        except OSError:
+            raise FicheiroNaoEncontrado(f"{caminho} (rev {rev})")
+
+    def _gravar_atomico(self, destino, dados):
+        fd, temporario = tempfile.mkstemp(dir=os.path.dirname(destino))
+        with os.fdopen(fd, "wb") as f:
+            f.write(dados)
+        os.replace(temporario, destino)
+
+    def obter_metadados(self, caminho):
+        self._esperar()
+        rev = self._rev_atual(caminho)
+        conteudo = self._ler_revisao(caminho, rev)
+        return MetadadosFicheiro(caminho, rev, calcular_content_hash(conteudo), len(conteudo))
+
+    def descarregar(self, caminho, rev=None):
+        self._esperar()
+        rev = rev or self._rev_atual(caminho)
+        conteudo = self._ler_revisao(caminho, rev)
+        return MetadadosFicheiro(caminho, rev, calcular_content_hash(conteudo), len(conteudo)), conteudo
+
+    def enviar(self, caminho, conteudo, rev=None, novo=False, progresso=None, sessoes=None):
+        self._esperar()
+        pasta_revisoes = self._caminho_revisoes(caminho)
+        os.makedirs(pasta_revisoes, exist_ok=True)
+
+        # Trinco simples para a verificação da revisão e a escrita serem atómicas entre processos
+        trinco = os.path.join(pasta_revisoes, ".trinco")
+        while True:
+            try:
+                fd = os.open(trinco, os.O_CREAT | os.O_EXCL)
+                break
+            except FileExistsError:
+                time.sleep(0.01)
+
+        try:
+            try:
+                atual = self._rev_atual(caminho)
+            except FicheiroNaoEncontrado:
+                atual = None
+            if rev and rev != atual:
+                raise ConflitoRevisao(f"Revisão {rev} já não é a atual")
+            if novo and atual is not None:
+                raise ConflitoRevisao(f"{caminho} já existe")
+
+            nova_rev = f"{time.time_ns():016x}{random.getrandbits(16):04x}"
+            self._gravar_atomico(os.path.join(pasta_revisoes, nova_rev), conteudo)
+            self._gravar_atomico(self._caminho_local(caminho), conteudo)
+            self._gravar_atomico(os.path.join(pasta_revisoes, "atual"), nova_rev.encode())
+        finally:
+            os.close(fd)
+            os.remove(trinco)
+
+        if progresso is not None:
+            progresso(len(conteudo), len(conteudo))
+        return MetadadosFicheiro(caminho, nova_rev, calcular_content_hash(conteudo), len(conteudo))
+
+    def criar_pastas(self, caminhos):
+        self._esperar()
+        for caminho in caminhos:
+            os.makedirs(self._caminho_local(caminho), exist_ok=True)
+
+    def listar_pastas(self, caminho, recursivo=True):
+        self._esperar()
+        local = self._caminho_local(caminho)
+        if not os.path.isdir(local):
+            raise FicheiroNaoEncontrado(caminho)
+
+        pastas = {caminho.lower()}
+        for raiz, subpastas, _ in os.walk(local):
+            subpastas[:] = [p for p in subpastas if p != ".revisoes"]
+            relativo = os.path.relpath(raiz, local)
+            for subpasta in subpastas:
+                partes = [] if relativo == "." else relativo.split(os.sep)
+                pastas.add("/".join([caminho.lower().rstrip("/")] + partes + [subpasta]))
+            if not recursivo:
+                break
+        return pastas
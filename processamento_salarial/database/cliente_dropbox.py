@@ -0,0 +1,112 @@
+"""
+Cliente Dropbox resiliente - repetições com backoff e estatísticas por chamada
+
+Envolve um dropbox.Dropbox: os métodos da API (files_*, users_*, ...) passam a
+repetir quando a Dropbox pede para abrandar (RateLimitError, respeitando o
+retry_after) ou em falhas transitórias (erros 5xx, ligação ou timeout), com
+espera exponencial com jitter. Cada chamada fica registada com a latência e o
+número de repetições. O dropbox.Dropbox envolvido deve ter as repetições
+próprias desligadas, para as esperas não se somarem.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import dropbox
+import requests
+
+
+PREFIXOS_API = ("files_", "users_", "sharing_", "file_requests_", "check_")
+
+# Falhas em que vale a pena repetir a chamada
+TRANSITORIOS = (
+    dropbox.exceptions.RateLimitError,
+    dropbox.exceptions.InternalServerError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+class ClienteDropboxResiliente:
+    """dropbox.Dropbox com repetições automáticas; partilhável entre sessões (as estatísticas têm trinco)"""
+
+    def __init__(self, dbx, max_tentativas=5, espera_base=0.5, espera_maxima=30.0, historico=200):
+        self.dbx = dbx
+        self.max_tentativas = max_tentativas
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self._estatisticas = {}
+        self._ultimas = deque(maxlen=historico)
+        self._trinco = threading.Lock()
+
+    def __getattr__(self, nome):
+        atributo = getattr(self.dbx, nome)
+        if not callable(atributo) or not nome.startswith(PREFIXOS_API):
+            return atributo
+
+        def chamada(*args, **kwargs):
+            return self._chamar(nome, atributo, args, kwargs)
+        return chamada
+
+    def _espera(self, repeticao, erro):
+        if isinstance(erro, dropbox.exceptions.RateLimitError) and erro.backoff is not None:
+            # A Dropbox diz quanto esperar; o jitter evita que as sessões voltem todas ao mesmo tempo
+            return erro.backoff + random.random() * self.espera_base
+        return min(self.espera_maxima, self.espera_base * 2 ** repeticao) * (0.5 + random.random())
+
+    def _chamar(self, nome, metodo, args, kwargs):
+        inicio = time.perf_counter()
+        repeticoes = 0
+        sucesso = False
+        try:
+            while True:
+                try:
+                    resultado = metodo(*args, **kwargs)
+                    sucesso = True
+                    return resultado
+                except TRANSITORIOS as e:
+                    if repeticoes + 1 >= self.max_tentativas:
+                        raise
+                    time.sleep(self._espera(repeticoes, e))
+                    repeticoes += 1
+        finally:
+            self._registar(nome, time.perf_counter() - inicio, repeticoes, sucesso)
+
+    def _registar(self, nome, latencia, repeticoes, sucesso):
+        with self._trinco:
+            estatistica = self._estatisticas.setdefault(nome, {
+                "chamadas": 0, "repeticoes": 0, "falhas": 0, "tempo_total": 0.0, "tempo_maximo": 0.0
+            })
+            estatistica["chamadas"] += 1
+            estatistica["repeticoes"] += repeticoes
+            estatistica["falhas"] += 0 if sucesso else 1
+            estatistica["tempo_total"] += latencia
+            estatistica["tempo_maximo"] = max(estatistica["tempo_maximo"], latencia)
+            self._ultimas.append((nome, latencia, repeticoes, sucesso))
+
+    def estatisticas(self):
+        """Uma linha por método: chamadas, repetições, falhas e latência média/máxima (ms)"""
+        with self._trinco:
+            return [
+                {
+                    "Método": nome,
+                    "Chamadas": e["chamadas"],
+                    "Repetições": e["repeticoes"],
+                    "Falhas": e["falhas"],
+                    "Latência Média (ms)": round(1000 * e["tempo_total"] / e["chamadas"], 1),
+                    "Latência Máx (ms)": round(1000 * e["tempo_maximo"], 1),
+                }
+                for nome, e in sorted(self._estatisticas.items())
+            ]
+
+    def ultimas_chamadas(self):
+        """Últimas chamadas, da mais recente para a mais antiga: (método, latência em s, repetições, sucesso)"""
+        with self._trinco:
+            return list(reversed(self._ultimas))
+
+    def limpar_estatisticas(self):
+        with self._trinco:
+            self._estatisticas.clear()
+            self._ultimas.clear()
@@ -0,0 +1,75 @@
+"""
+Leitor streaming - abas do Excel lidas linha a linha com openpyxl em modo read-only
+
+Só a aba pedida é percorrida, e as células chegam como valores simples
+(sem objetos Cell nem estilos). O resultado é o mesmo DataFrame que o
+pd.read_excel devolveria para essa aba.
+"""
+
+from io import BytesIO
+
+import pandas as pd
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+
+
+def _normalizar_valor(valor):
+    # Como o pandas: números inteiros guardados como float voltam a int
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if valor is None:
+        return ""
+    return valor
+
+
+def _linha_vazia(linha):
+    return all(valor is None for valor in linha)
+
+
+class LeitorStreaming:
+    """Workbook aberto em modo read-only; cada aba é lida a pedido, linha a linha
+
+    Fechar com fechar() (ou usar com `with`) quando já não houver abas a ler.
+    """
+
+    def __init__(self, conteudo):
+        self._wb = load_workbook(BytesIO(conteudo), read_only=True, data_only=True, keep_links=False)
+
+    @property
+    def abas(self):
+        return list(self._wb.sheetnames)
+
+    def ler_aba(self, nome_aba):
+        """DataFrame da aba (cabeçalho na primeira linha), igual ao de pd.read_excel"""
+        if nome_aba not in self._wb.sheetnames:
+            raise ValueError(f"Aba '{nome_aba}' não encontrada")
+
+        linhas = []
+        ultima_preenchida = -1
+        for linha in self._wb[nome_aba].iter_rows(values_only=True):
+            if not _linha_vazia(linha):
+                ultima_preenchida = len(linhas)
+            linhas.append(linha)
+        del linhas[ultima_preenchida + 1:]
+
+        # Colunas vazias à direita (dimensão da aba desatualizada) também ficam de fora
+        largura = 0
+        for linha in linhas:
+            for posicao in range(len(linha) - 1, -1, -1):
+                if linha[posicao] is not None:
+                    largura = max(largura, posicao + 1)
+                    break
+
+        dados = [[_normalizar_valor(v) for v in linha[:largura]] for linha in linhas]
+        if not dados:
+            return pd.DataFrame()
+        return TextParser(dados, header=0).read()
+
+    def fechar(self):
+        self._wb.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excecao):
+        self.fechar()
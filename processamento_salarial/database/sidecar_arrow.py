@@ -0,0 +1,116 @@
+"""
+Sidecar Arrow - cópia colunar em disco de cada aba do Excel, por content_hash
+
+Um processo Streamlit novo (ex.: depois de um redeploy) lê as abas destes
+ficheiros Arrow IPC com memory-map em vez de voltar a interpretar o XLSX com
+openpyxl. Quando o content_hash do Excel muda, as pastas antigas só são
+descartadas depois de deixarem de ser recentes: outras sessões do processo podem
+ainda estar a ler uma revisão anterior.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+# Revisões antigas: mantêm-se sempre as X mais recentes e nenhuma com menos de Y segundos
+REVISOES_MANTIDAS = 3
+IDADE_MINIMA_DESCARTE = 3600
+
+
+class SidecarArrow:
+    """Ficheiros Arrow IPC (Feather v2) das abas de uma revisão do Excel de uma empresa"""
+
+    def __init__(self, pasta_empresa, content_hash):
+        self.pasta_empresa = pasta_empresa
+        self.pasta = os.path.join(pasta_empresa, content_hash)
+        self._manifesto = self._ler_manifesto()
+
+    def _caminho_manifesto(self):
+        return os.path.join(self.pasta, "manifesto.json")
+
+    def _ler_manifesto(self):
+        try:
+            with open(self._caminho_manifesto(), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _gravar_manifesto(self):
+        # Escrita atómica: outras sessões podem estar a ler o manifesto
+        fd, temporario = tempfile.mkstemp(dir=self.pasta, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._manifesto, f)
+        os.replace(temporario, self._caminho_manifesto())
+
+    @property
+    def abas(self):
+        """Lista de abas da revisão, ou None se ainda não houver sidecar"""
+        return None if self._manifesto is None else list(self._manifesto["abas"])
+
+    def _descartar_revisoes_antigas(self):
+        try:
+            antigas = [os.path.join(self.pasta_empresa, nome) for nome in os.listdir(self.pasta_empresa)]
+            antigas = [(os.path.getmtime(p), p) for p in antigas if p != self.pasta and os.path.isdir(p)]
+        except OSError:
+            return
+
+        limite = time.time() - IDADE_MINIMA_DESCARTE
+        for modificada, antiga in sorted(antigas, reverse=True)[REVISOES_MANTIDAS - 1:]:
+            if modificada < limite:
+                shutil.rmtree(antiga, ignore_errors=True)
+
+    def registar_abas(self, abas):
+        """Cria a pasta da revisão (descartando revisões antigas já sem uso) e guarda a lista de abas"""
+        if self._manifesto is not None:
+            return
+
+        if os.path.isdir(self.pasta_empresa):
+            self._descartar_revisoes_antigas()
+
+        os.makedirs(self.pasta, exist_ok=True)
+        self._manifesto = {"abas": list(abas), "ficheiros": {}}
+        self._gravar_manifesto()
+
+    def ler(self, nome_aba):
+        """DataFrame da aba (memory-mapped), ou None se a aba não estiver em cache ou o ficheiro já não existir/estiver corrompido"""
+        if self._manifesto is None or nome_aba not in self._manifesto["ficheiros"]:
+            return None
+
+        import pyarrow
+        from pyarrow import feather
+
+        caminho = os.path.join(self.pasta, self._manifesto["ficheiros"][nome_aba])
+        try:
+            return feather.read_table(caminho, memory_map=True).to_pandas()
+        except (OSError, pyarrow.ArrowInvalid):
+            return None
+
+    def gravar(self, nome_aba, df):
+        """Guarda a aba; abas com colunas de tipos mistos (não suportadas pelo Arrow) ou sem pasta ficam de fora"""
+        if self._manifesto is None:
+            return False
+
+        import pyarrow
+
+        nome_ficheiro = f"{self._manifesto['abas'].index(nome_aba):04d}.arrow"
+        # Escrita atómica, como no manifesto: nunca fica um ficheiro a meio no caminho final
+        try:
+            fd, temporario = tempfile.mkstemp(dir=self.pasta, suffix=".arrow")
+            os.close(fd)
+        except OSError:
+            # Pasta da revisão já descartada por outra sessão
+            return False
+        try:
+            df.reset_index(drop=True).to_feather(temporario)
+            os.replace(temporario, os.path.join(self.pasta, nome_ficheiro))
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, OSError):
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            return False
+
+        self._manifesto["ficheiros"][nome_aba] = nome_ficheiro
+        self._gravar_manifesto()
+        return True
@@ -0,0 +1,103 @@
+"""
+Snapshots em delta - cada linha guarda só os campos que mudaram desde o snapshot anterior
+
+Alternativa às linhas completas das abas Estado_YYYY_MM: as abas Delta_YYYY_MM
+têm uma coluna "Campos" (JSON) com os campos alterados. A primeira linha de
+cada colaborador no ano, e depois uma em cada INTERVALO, é um checkpoint com
+todos os campos, para a reconstrução nunca ter de recuar muito.
+"""
+
+import json
+import logging
+import math
+from datetime import date, datetime, time
+
+
+TIPO_CHECKPOINT = "Checkpoint"
+TIPO_DELTA = "Delta"
+
+COLUNAS_DELTA = ["Nome Completo", "Ano", "Mês", "Tipo Registo", "Campos", "Timestamp"]
+
+# Campos que identificam a linha e por isso nunca entram no JSON
+CAMPOS_LINHA = ("Nome Completo", "Ano", "Mês", "Timestamp")
+
+logger = logging.getLogger(__name__)
+
+
+def _normalizar(valor):
+    # Datas como texto "AAAA-MM-DD HH:MM:SS" (o que fica no JSON), escalares numpy como tipos Python
+    if isinstance(valor, date):
+        if valor != valor:
+            return None
+        if not isinstance(valor, datetime):
+            valor = datetime.combine(valor, time())
+        return valor.isoformat(sep=" ")
+    if hasattr(valor, "item"):
+        return valor.item()
+    return valor
+
+
+def _vazio(valor):
+    return valor is None or (isinstance(valor, float) and math.isnan(valor))
+
+
+def _iguais(a, b):
+    a, b = _normalizar(a), _normalizar(b)
+    if _vazio(a) or _vazio(b):
+        return _vazio(a) and _vazio(b)
+    return a == b
+
+
+def campos_alterados(anterior, atual):
+    """Campos de `atual` diferentes dos de `anterior` (ambos dicionários de snapshot)"""
+    return {
+        campo: _normalizar(valor) for campo, valor in atual.items()
+        if campo not in CAMPOS_LINHA and (campo not in anterior or not _iguais(anterior[campo], valor))
+    }
+
+
+def criar_linha(snapshot, anterior=None, deltas_desde_checkpoint=0, intervalo=12):
+    """Linha (na ordem de COLUNAS_DELTA) a gravar para o snapshot: checkpoint ou só as diferenças"""
+    checkpoint = anterior is None or deltas_desde_checkpoint + 1 >= intervalo
+    if checkpoint:
+        campos = {campo: _normalizar(valor) for campo, valor in snapshot.items() if campo not in CAMPOS_LINHA}
+    else:
+        campos = campos_alterados(anterior, snapshot)
+
+    return [
+        snapshot["Nome Completo"],
+        snapshot["Ano"],
+        snapshot["Mês"],
+        TIPO_CHECKPOINT if checkpoint else TIPO_DELTA,
+        json.dumps(campos, ensure_ascii=False, default=str),
+        snapshot.get("Timestamp", ""),
+    ]
+
+
+def reconstruir(registos):
+    """Snapshot completo a partir dos registos de um colaborador (dicionários, por ordem cronológica)
+
+    Parte do último checkpoint e aplica os deltas seguintes. Sem nenhum
+    checkpoint, aplica todos os registos desde o primeiro (e regista-o no log).
+    Devolve (snapshot, nº de deltas desde o checkpoint), ou (None, 0) sem registos.
+    """
+    registos = list(registos)
+    if not registos:
+        return None, 0
+
+    inicio = None
+    for posicao, registo in enumerate(registos):
+        if registo["Tipo Registo"] == TIPO_CHECKPOINT:
+            inicio = posicao
+    if inicio is None:
+        logger.warning("Snapshot de '%s' sem checkpoint: reconstruído a partir de %d registos",
+                       registos[0]["Nome Completo"], len(registos))
+        inicio = 0
+
+    snapshot = {}
+    for registo in registos[inicio:]:
+        snapshot.update(json.loads(registo["Campos"]) if isinstance(registo["Campos"], str) else {})
+        for campo in CAMPOS_LINHA:
+            snapshot[campo] = registo[campo]
+
+    return snapshot, len(registos) - inicio - 1
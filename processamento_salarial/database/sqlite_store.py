@@ -0,0 +1,382 @@
+"""
+Armazém SQLite local - base operacional indexada, sincronizada com o Excel da Dropbox
+
+O Excel continua a ser o formato partilhado (mesmas abas Estado_/Historico_/Delta_/
+Faltas_Baixas_/Extras_/Processamento_YYYY_MM e mesmas colunas); esta base guarda uma cópia indexada por
+colaborador/mês, associada ao content_hash do Excel de onde foi importada.
+Tem a mesma interface de leitura que o WorkbookBundle.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import pandas as pd
+
+
+PADRAO_ABA_MENSAL = re.compile(r"^(Estado|Historico|Delta|Faltas_Baixas|Extras|Processamento)_(\d{4})_(\d{2})$")
+
+# Colunas que identificam uma linha de aba mensal (para eliminar a linha certa mesmo que outras mudem de posição)
+COLUNAS_CHAVE_LINHA = ("Nome Completo", "Timestamp")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    chave TEXT PRIMARY KEY,
+    valor TEXT
+);
+CREATE TABLE IF NOT EXISTS abas (
+    nome TEXT PRIMARY KEY,
+    posicao INTEGER NOT NULL,
+    colunas TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS colaboradores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome TEXT,
+    valores TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_colaboradores_nome ON colaboradores (nome);
+CREATE TABLE IF NOT EXISTS registos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    ano INTEGER NOT NULL,
+    mes INTEGER NOT NULL,
+    nome TEXT,
+    valores TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_registos_mes ON registos (tipo, ano, mes, nome);
+CREATE INDEX IF NOT EXISTS idx_registos_nome ON registos (nome, tipo, ano, mes);
+CREATE TABLE IF NOT EXISTS pendentes (
+    ordem INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    sessao TEXT NOT NULL,
+    atualizado_em REAL NOT NULL,
+    dados TEXT NOT NULL
+);
+"""
+
+
+def _codificar_valor(valor):
+    # Como no Excel: células vazias voltam sempre como NaN
+    if valor is None or (isinstance(valor, str) and valor == ""):
+        return float("nan")
+    if isinstance(valor, (datetime, date)):
+        return {"__data__": pd.Timestamp(valor).isoformat()}
+    if hasattr(valor, "item"):
+        return valor.item()
+    return valor
+
+
+def _descodificar_valor(valor):
+    if isinstance(valor, dict) and "__data__" in valor:
+        return pd.Timestamp(valor["__data__"])
+    return valor
+
+
+def _codificar_linha(valores):
+    return json.dumps([_codificar_valor(v) for v in valores])
+
+
+def _descodificar_linha(texto):
+    return [_descodificar_valor(v) for v in json.loads(texto)]
+
+
+def _valor_json(valor):
+    # Valores numpy/pandas das linhas da fila de alterações
+    if isinstance(valor, (datetime, date)):
+        return pd.Timestamp(valor).isoformat()
+    if hasattr(valor, "item"):
+        return valor.item()
+    return str(valor)
+
+
+def _nome_completo(colunas, valores):
+    if "Nome Completo" not in colunas:
+        return None
+    nome = valores[colunas.index("Nome Completo")]
+    return None if pd.isna(nome) else str(nome)
+
+
+def _texto_chave(valor):
+    if valor is None or (isinstance(valor, str) and valor == "") or pd.isna(valor):
+        return None
+    if isinstance(valor, (datetime, date)):
+        return pd.Timestamp(valor).strftime("%Y-%m-%d %H:%M:%S")
+    return str(valor)
+
+
+def chave_linha(colunas, valores):
+    """Chave da linha (Nome Completo + Timestamp em texto), igual no Excel, nos DataFrames e na base"""
+    colunas = list(colunas)
+    return [_texto_chave(valores[colunas.index(c)]) if c in colunas else None for c in COLUNAS_CHAVE_LINHA]
+
+
+def localizar_linha(colunas, linhas, chave, posicao):
+    """Índice da linha com esta chave (entre várias iguais, a mais próxima de `posicao`), ou None"""
+    candidatas = [i for i, valores in enumerate(linhas) if chave_linha(colunas, valores) == list(chave)]
+    return min(candidatas, key=lambda i: abs(i - posicao)) if candidatas else None
+
+
+class ArmazemSQLite:
+    """Base SQLite local de uma empresa (um ficheiro por empresa)"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+        with self._ligar() as conn:
+            conn.executescript(ESQUEMA)
+
+    @contextmanager
+    def _ligar(self):
+        conn = sqlite3.connect(self.caminho, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ---------- sincronização ----------
+
+    @property
+    def content_hash(self):
+        with self._ligar() as conn:
+            linha = conn.execute("SELECT valor FROM meta WHERE chave = 'content_hash'").fetchone()
+        return linha[0] if linha else None
+
+    def marcar_sincronizado(self, content_hash, conn=None):
+        if conn is None:
+            with self._ligar() as conn:
+                return self.marcar_sincronizado(content_hash, conn)
+        conn.execute("INSERT OR REPLACE INTO meta (chave, valor) VALUES ('content_hash', ?)", (content_hash,))
+
+    def importar(self, bundle, content_hash):
+        """Substitui o conteúdo da base pelo do Excel (WorkbookBundle) com o content_hash indicado"""
+        with self._ligar() as conn:
+            conn.execute("DELETE FROM abas")
+            conn.execute("DELETE FROM colaboradores")
+            conn.execute("DELETE FROM registos")
+
+            for posicao, nome_aba in enumerate(bundle.abas):
+                if nome_aba != "Colaboradores" and not PADRAO_ABA_MENSAL.match(nome_aba):
+                    continue
+
+                df = bundle.ler_aba(nome_aba)
+                colunas = [str(c) for c in df.columns]
+                conn.execute("INSERT INTO abas (nome, posicao, colunas) VALUES (?, ?, ?)",
+                             (nome_aba, posicao, json.dumps(colunas)))
+
+                linhas = [list(linha) for linha in df.itertuples(index=False, name=None)]
+                if nome_aba == "Colaboradores":
+                    conn.executemany(
+                        "INSERT INTO colaboradores (nome, valores) VALUES (?, ?)",
+                        [(_nome_completo(colunas, v), _codificar_linha(v)) for v in linhas]
+                    )
+                else:
+                    tipo, ano, mes = self._chave_aba(nome_aba)
+                    conn.executemany(
+                        "INSERT INTO registos (tipo, ano, mes, nome, valores) VALUES (?, ?, ?, ?, ?)",
+                        [(tipo, ano, mes, _nome_completo(colunas, v), _codificar_linha(v)) for v in linhas]
+                    )
+
+            self.marcar_sincronizado(content_hash, conn)
+
+    # ---------- alterações pendentes (fila ainda não enviada para a Dropbox) ----------
+
+    def guardar_pendentes(self, sessao, alteracoes):
+        """Substitui a fila guardada da sessão; devolve os ids que entretanto outra sessão adotou"""
+        adotadas = set()
+        with self._ligar() as conn:
+            conn.execute("DELETE FROM pendentes WHERE sessao = ?", (sessao,))
+            agora = time.time()
+            for alteracao in alteracoes:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO pendentes (id, sessao, atualizado_em, dados) VALUES (?, ?, ?, ?)",
+                    (alteracao['id'], sessao, agora, json.dumps(alteracao, default=_valor_json))
+                )
+                if cursor.rowcount == 0:
+                    adotadas.add(alteracao['id'])
+        return adotadas
+
+    def adotar_pendentes(self, sessao, inativas_desde):
+        """Passa para a sessão as alterações de sessões sem atividade desde `inativas_desde` (separador fechado, timeout)"""
+        with self._ligar() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            linhas = conn.execute(
+                "SELECT ordem, dados FROM pendentes WHERE sessao != ? AND atualizado_em < ? ORDER BY ordem",
+                (sessao, inativas_desde)
+            ).fetchall()
+            conn.executemany("UPDATE pendentes SET sessao = ?, atualizado_em = ? WHERE ordem = ?",
+                             [(sessao, time.time(), ordem) for ordem, _ in linhas])
+        return [json.loads(dados) for _, dados in linhas]
+
+    # ---------- leitura (mesma interface do WorkbookBundle) ----------
+
+    @staticmethod
+    def _chave_aba(nome_aba):
+        correspondencia = PADRAO_ABA_MENSAL.match(nome_aba)
+        if not correspondencia:
+            raise ValueError(f"Aba '{nome_aba}' não é uma aba mensal")
+        tipo, ano, mes = correspondencia.groups()
+        return tipo, int(ano), int(mes)
+
+    def _colunas(self, conn, nome_aba):
+        linha = conn.execute("SELECT colunas FROM abas WHERE nome = ?", (nome_aba,)).fetchone()
+        if linha is None:
+            raise ValueError(f"Aba '{nome_aba}' não encontrada")
+        return json.loads(linha[0])
+
+    @property
+    def abas(self):
+        with self._ligar() as conn:
+            return [linha[0] for linha in conn.execute("SELECT nome FROM abas ORDER BY posicao, nome")]
+
+    def tem_aba(self, nome_aba):
+        with self._ligar() as conn:
+            return conn.execute("SELECT 1 FROM abas WHERE nome = ?", (nome_aba,)).fetchone() is not None
+
+    def ler_aba(self, nome_aba, colaborador=None):
+        """DataFrame da aba; o índice é a posição da linha na aba, mesmo filtrando por colaborador"""
+        with self._ligar() as conn:
+            colunas = self._colunas(conn, nome_aba)
+
+            if nome_aba == "Colaboradores":
+                consulta = "SELECT posicao, valores FROM (SELECT ROW_NUMBER() OVER (ORDER BY id) - 1 AS posicao, nome, valores FROM colaboradores)"
+                parametros = []
+            else:
+                tipo, ano, mes = self._chave_aba(nome_aba)
+                consulta = ("SELECT posicao, valores FROM (SELECT ROW_NUMBER() OVER (ORDER BY id) - 1 AS posicao, nome, valores "
+                            "FROM registos WHERE tipo = ? AND ano = ? AND mes = ?)")
+                parametros = [tipo, ano, mes]
+
+            if colaborador is not None:
+                consulta += " WHERE nome = ?"
+                parametros.append(colaborador)
+
+            resultados = conn.execute(consulta + " ORDER BY posicao", parametros).fetchall()
+
+        indice = [posicao for posicao, _ in resultados]
+        linhas = [_descodificar_linha(valores) for _, valores in resultados]
+        df = pd.DataFrame(linhas, columns=colunas, index=indice)
+        return df.infer_objects()
+
+    def ultimo_registo(self, nome_aba, colaborador):
+        """Última linha do colaborador na aba mensal (DataFrame de 0 ou 1 linhas), pelo índice da tabela"""
+        with self._ligar() as conn:
+            colunas = self._colunas(conn, nome_aba)
+            tipo, ano, mes = self._chave_aba(nome_aba)
+            linha = conn.execute(
+                "SELECT valores FROM registos WHERE tipo = ? AND ano = ? AND mes = ? AND nome = ? ORDER BY id DESC LIMIT 1",
+                (tipo, ano, mes, colaborador)
+            ).fetchone()
+
+        linhas = [] if linha is None else [_descodificar_linha(linha[0])]
+        return pd.DataFrame(linhas, columns=colunas).infer_objects()
+
+    @property
+    def colaboradores(self):
+        return self.ler_aba("Colaboradores")
+
+    # ---------- escrita (uma linha de cada vez) ----------
+
+    def aplicar_alteracao(self, alteracao):
+        """Aplica uma alteração da fila (mesma semântica que no workbook)"""
+        with self._ligar() as conn:
+            nome_aba = alteracao['aba']
+
+            if alteracao['tipo'] == 'adicionar_linha':
+                colunas = list(alteracao['colunas'])
+                if conn.execute("SELECT 1 FROM abas WHERE nome = ?", (nome_aba,)).fetchone() is None:
+                    posicao = conn.execute("SELECT COALESCE(MAX(posicao), -1) + 1 FROM abas").fetchone()[0]
+                    conn.execute("INSERT INTO abas (nome, posicao, colunas) VALUES (?, ?, ?)",
+                                 (nome_aba, posicao, json.dumps(colunas)))
+                tipo, ano, mes = self._chave_aba(nome_aba)
+                conn.execute(
+                    "INSERT INTO registos (tipo, ano, mes, nome, valores) VALUES (?, ?, ?, ?, ?)",
+                    (tipo, ano, mes, _nome_completo(colunas, alteracao['linha']), _codificar_linha(alteracao['linha']))
+                )
+
+            elif alteracao['tipo'] == 'eliminar_linha':
+                colunas = self._colunas(conn, nome_aba)
+                tipo, ano, mes = self._chave_aba(nome_aba)
+                linhas = conn.execute(
+                    "SELECT id, valores FROM registos WHERE tipo = ? AND ano = ? AND mes = ? ORDER BY id",
+                    (tipo, ano, mes)
+                ).fetchall()
+                posicao = localizar_linha(colunas, [_descodificar_linha(valores) for _, valores in linhas],
+                                          alteracao['chave'], alteracao['linha_idx'])
+                if posicao is None:
+                    raise ValueError(f"Registo de '{alteracao['nome']}' já não existe em '{nome_aba}'")
+                conn.execute("DELETE FROM registos WHERE id = ?", (linhas[posicao][0],))
+
+            elif alteracao['tipo'] == 'atualizar_colaborador':
+                colunas = self._colunas(conn, "Colaboradores")
+                linhas = conn.execute("SELECT id, valores FROM colaboradores WHERE nome = ?",
+                                      (alteracao['nome'],)).fetchall()
+                if not linhas:
+                    raise ValueError(f"Colaborador '{alteracao['nome']}' não encontrado")
+
+                novas_colunas = [c for c in alteracao['campos'] if c not in colunas]
+                if novas_colunas:
+                    colunas = colunas + novas_colunas
+                    conn.execute("UPDATE abas SET colunas = ? WHERE nome = 'Colaboradores'", (json.dumps(colunas),))
+                    for id_linha, valores in conn.execute("SELECT id, valores FROM colaboradores").fetchall():
+                        valores = _descodificar_linha(valores) + [None] * len(novas_colunas)
+                        conn.execute("UPDATE colaboradores SET valores = ? WHERE id = ?",
+                                     (_codificar_linha(valores), id_linha))
+                    linhas = conn.execute("SELECT id, valores FROM colaboradores WHERE nome = ?",
+                                          (alteracao['nome'],)).fetchall()
+
+                for id_linha, valores in linhas:
+                    valores = _descodificar_linha(valores)
+                    for coluna, valor in alteracao['campos'].items():
+                        valores[colunas.index(coluna)] = valor
+                    conn.execute("UPDATE colaboradores SET valores = ? WHERE id = ?",
+                                 (_codificar_linha(valores), id_linha))
+
+            elif alteracao['tipo'] == 'compactar_snapshots':
+                tipo, ano, mes = self._chave_aba(nome_aba)
+                substituidos = [linha[0] for linha in conn.execute(
+                    "SELECT id FROM registos WHERE tipo = ? AND ano = ? AND mes = ? AND id NOT IN "
+                    "(SELECT MAX(id) FROM registos WHERE tipo = ? AND ano = ? AND mes = ? GROUP BY nome) ORDER BY id",
+                    (tipo, ano, mes, tipo, ano, mes)
+                )]
+                if not substituidos:
+                    return
+
+                marcadores = ",".join("?" * len(substituidos))
+                aba_historico = alteracao.get('aba_historico')
+                if aba_historico:
+                    # Copiadas (não movidas) para ficarem no fim do histórico, como no Excel
+                    if conn.execute("SELECT 1 FROM abas WHERE nome = ?", (aba_historico,)).fetchone() is None:
+                        posicao = conn.execute("SELECT COALESCE(MAX(posicao), -1) + 1 FROM abas").fetchone()[0]
+                        conn.execute("INSERT INTO abas (nome, posicao, colunas) VALUES (?, ?, ?)",
+                                     (aba_historico, posicao, json.dumps(self._colunas(conn, nome_aba))))
+                    tipo_historico, ano_historico, mes_historico = self._chave_aba(aba_historico)
+                    conn.execute(
+                        f"INSERT INTO registos (tipo, ano, mes, nome, valores) SELECT ?, ?, ?, nome, valores "
+                        f"FROM registos WHERE id IN ({marcadores}) ORDER BY id",
+                        [tipo_historico, ano_historico, mes_historico] + substituidos
+                    )
+                conn.execute(f"DELETE FROM registos WHERE id IN ({marcadores})", substituidos)
+
+            elif alteracao['tipo'] == 'substituir_aba':
+                colunas = list(alteracao['colunas'])
+                if conn.execute("SELECT 1 FROM abas WHERE nome = ?", (nome_aba,)).fetchone() is None:
+                    posicao = conn.execute("SELECT COALESCE(MAX(posicao), -1) + 1 FROM abas").fetchone()[0]
+                    conn.execute("INSERT INTO abas (nome, posicao, colunas) VALUES (?, ?, ?)",
+                                 (nome_aba, posicao, json.dumps(colunas)))
+                else:
+                    conn.execute("UPDATE abas SET colunas = ? WHERE nome = ?", (json.dumps(colunas), nome_aba))
+                tipo, ano, mes = self._chave_aba(nome_aba)
+                conn.execute("DELETE FROM registos WHERE tipo = ? AND ano = ? AND mes = ?", (tipo, ano, mes))
+                conn.executemany(
+                    "INSERT INTO registos (tipo, ano, mes, nome, valores) VALUES (?, ?, ?, ?, ?)",
+                    [(tipo, ano, mes, _nome_completo(colunas, linha), _codificar_linha(linha)) for linha in alteracao['linhas']]
+                )
+
+            else:
+                raise ValueError(f"Tipo de alteração desconhecido: {alteracao['tipo']}")
@@ -0,0 +1,84 @@
+"""
+Workbook bundle - Excel interpretado uma única vez por revisão
+"""
+
+from processamento_salarial.database.leitor_streaming import LeitorStreaming
+
+
+class WorkbookBundle:
+    """Excel de uma empresa já aberto: lista de abas e DataFrames lidos a pedido
+
+    Cada aba é interpretada no máximo uma vez; os loaders recebem sempre uma
+    cópia, para poderem alterar o DataFrame sem estragar a cache.
+
+    `conteudo` pode ser o próprio XLSX ou uma função que o devolve: com um
+    SidecarArrow completo para esta revisão o XLSX nem chega a ser transferido.
+    As abas são lidas em streaming (openpyxl read-only): abrir uma aba mensal
+    não obriga a interpretar o resto do workbook.
+    """
+
+    def __init__(self, conteudo, sidecar=None):
+        self._conteudo = conteudo
+        self._leitor = None
+        self._sidecar = sidecar
+        self._dataframes = {}
+        self._ultimas_linhas = {}
+
+        self.abas = sidecar.abas if sidecar is not None else None
+        if self.abas is None:
+            self.abas = self._abrir_leitor().abas
+            if sidecar is not None:
+                sidecar.registar_abas(self.abas)
+
+    def _abrir_leitor(self):
+        if self._leitor is None:
+            conteudo = self._conteudo() if callable(self._conteudo) else self._conteudo
+            self._leitor = LeitorStreaming(conteudo)
+        return self._leitor
+
+    def _interpretar_aba(self, nome_aba):
+        if self._sidecar is not None:
+            df = self._sidecar.ler(nome_aba)
+            if df is not None:
+                return df
+
+        df = self._abrir_leitor().ler_aba(nome_aba)
+        if self._sidecar is not None:
+            self._sidecar.gravar(nome_aba, df)
+        return df
+
+    def tem_aba(self, nome_aba):
+        return nome_aba in self.abas
+
+    def ler_aba(self, nome_aba, colaborador=None):
+        """Devolve uma cópia do DataFrame da aba (lança ValueError se não existir)"""
+        if nome_aba not in self._dataframes:
+            if nome_aba not in self.abas:
+                raise ValueError(f"Aba '{nome_aba}' não encontrada")
+            self._dataframes[nome_aba] = self._interpretar_aba(nome_aba)
+            if self._leitor is not None and len(self._dataframes) == len(self.abas):
+                # Todas as abas interpretadas: o workbook read-only já não é preciso
+                self._leitor.fechar()
+                self._leitor = None
+
+        df = self._dataframes[nome_aba]
+        if colaborador is not None:
+            df = df[df['Nome Completo'] == colaborador]
+        return df.copy()
+
+    def ultimo_registo(self, nome_aba, colaborador):
+        """Última linha do colaborador (DataFrame de 0 ou 1 linhas), por um índice nome -> linha criado uma vez por aba"""
+        if nome_aba not in self._ultimas_linhas:
+            df = self.ler_aba(nome_aba)
+            ultimas = ~df['Nome Completo'].duplicated(keep='last')
+            self._ultimas_linhas[nome_aba] = dict(zip(df.loc[ultimas, 'Nome Completo'], df.index[ultimas]))
+
+        posicao = self._ultimas_linhas[nome_aba].get(colaborador)
+        df = self._dataframes[nome_aba]
+        if posicao is None:
+            return df.iloc[0:0].copy()
+        return df.loc[[posicao]].copy()
+
+    @property
+    def colaboradores(self):
+        return self.ler_aba("Colaboradores")